@@ -0,0 +1,199 @@
+import random
+import sys
+import time
+
+import numpy as np
+
+from board import Board, EMPTY, KNIGHT, BISHOP, ROOK, QUEEN, KING, BLACK, CHARS_TO_CODES, KNIGHT_STEPS, \
+    ROOK_STEPS, BISHOP_STEPS, KING_STEPS
+from engine import PIECE_VALUES, PIECE_SQUARE_SCORES, evaluate
+from gamefile import FILE_SIZE, SLOT_SIZE, unpack_slot
+
+# Batches hold many positions in an (N, 64) int8 array of piece codes, one row per position with the squares
+# in the same order as Board.squares (a1 along each row to h8), and an (N,) bool array that is True where
+# black is to move.
+
+# Score (from white's point of view) of each piece code on each square, as in engine.PIECE_SQUARE_SCORES
+SCORE_TABLE = np.array(PIECE_SQUARE_SCORES, dtype=np.int32).reshape(-1, 64)
+# Material value (from white's point of view) of each piece code, not counting the kings
+MATERIAL_TABLE = np.zeros(SCORE_TABLE.shape[0], dtype=np.int32)
+for _piece_type in range(1, KING):
+    MATERIAL_TABLE[_piece_type] = PIECE_VALUES[_piece_type]
+    MATERIAL_TABLE[_piece_type | BLACK] = -PIECE_VALUES[_piece_type]
+# Centipawns for each extra square a side's pieces can move to
+MOBILITY_WEIGHT = 5
+
+SQUARE_COLUMNS = np.arange(64)
+
+
+def from_boards(boards):
+    """Loads boards into a batch
+
+    :param boards: Sequence of Board
+    :return: Tuple of the (N, 64) squares array, and the (N,) black to move array
+    """
+    squares = np.frombuffer(b"".join(bytes(board.squares) for board in boards), dtype=np.int8).reshape(-1, 64)
+    return squares, np.array([board.turn == 'B' for board in boards], dtype=bool)
+
+
+def from_strings(strings):
+    """Loads positions written as strings into a batch. Each string is either str(board) (64 characters,
+    with white to move), or the old text file format (the next player, then 64 characters).
+
+    :param strings: Sequence of strings
+    :return: Tuple of the (N, 64) squares array, and the (N,) black to move array
+    """
+    text = b"".join(string[-64:].encode('ascii') for string in strings).translate(CHARS_TO_CODES)
+    squares = np.frombuffer(text, dtype=np.int8).reshape(-1, 64)
+    return squares, np.array([len(string) > 64 and string[0] == 'B' for string in strings], dtype=bool)
+
+
+def from_game_files(filenames):
+    """Loads the latest snapshot of each game file into a batch. Moves in the games' journals since the
+    snapshot are not included.
+
+    :param filenames: Sequence of game file names
+    :return: Tuple of the (N, 64) squares array, and the (N,) black to move array
+    :raises ValueError: if a file has no valid snapshot
+    """
+    squares = np.empty((len(filenames), 64), dtype=np.int8)
+    black_to_move = np.empty(len(filenames), dtype=bool)
+    for row, filename in enumerate(filenames):
+        with open(filename, mode='rb') as file:
+            data = file.read(FILE_SIZE)
+        slots = [slot for slot in (unpack_slot(data[:SLOT_SIZE]), unpack_slot(data[SLOT_SIZE:]))
+                 if slot is not None]
+        if not slots:
+            raise ValueError(f"{filename} is not a game file")
+        _, slot_squares, next_player, _, _, _, _ = max(slots, key=lambda slot: slot[0])
+        squares[row] = np.frombuffer(slot_squares, dtype=np.int8)
+        black_to_move[row] = next_player == 'B'
+    return squares, black_to_move
+
+
+def to_board(row, black_to_move=False):
+    """Makes a Board from a row of a batch. Castling rights are inferred from the position.
+
+    :param row: Array of 64 piece codes
+    :param black_to_move: True if black is to move
+    :return: Board
+    """
+    board = Board()
+    board.set_position(row.astype(np.uint8).tobytes(), 'B' if black_to_move else 'W')
+    board.castling = board.infer_castling()
+    board.key = board.compute_key()
+    return board
+
+
+def material(squares):
+    """Scores the material in each position of a batch
+
+    :param squares: (N, 64) squares array
+    :return: (N,) array of scores in centipawns, from white's point of view
+    """
+    return MATERIAL_TABLE[squares].sum(axis=1)
+
+
+def piece_square_scores(squares):
+    """Scores the material and piece-square tables in each position of a batch, as engine.evaluate does
+
+    :param squares: (N, 64) squares array
+    :return: (N,) array of scores in centipawns, from white's point of view
+    """
+    return SCORE_TABLE[squares, SQUARE_COLUMNS].sum(axis=1)
+
+
+def _shift(grid, row_step, col_step):
+    """Moves every square of a (N, 8, 8) array by a step, filling with False"""
+    shifted = np.zeros_like(grid)
+    rows = slice(max(row_step, 0), 8 + min(row_step, 0))
+    cols = slice(max(col_step, 0), 8 + min(col_step, 0))
+    from_rows = slice(max(-row_step, 0), 8 - max(row_step, 0))
+    from_cols = slice(max(-col_step, 0), 8 - max(col_step, 0))
+    shifted[:, rows, cols] = grid[:, from_rows, from_cols]
+    return shifted
+
+
+def mobility(squares):
+    """Approximates each side's mobility in each position of a batch: the number of squares its knights,
+    bishops, rooks, queens and king can move to, ignoring pins, checks and pawns
+
+    :param squares: (N, 64) squares array
+    :return: (N,) array of white's mobility minus black's
+    """
+    grid = squares.reshape(-1, 8, 8)
+    empty = grid == EMPTY
+    total = np.zeros(len(squares), dtype=np.int32)
+    for colour, sign in ((0, 1), (BLACK, -1)):
+        open_squares = empty | ((grid & BLACK) != colour)
+        for piece_types, steps, slides in (((KNIGHT,), KNIGHT_STEPS, False), ((KING,), KING_STEPS, False),
+                                           ((ROOK, QUEEN), ROOK_STEPS, True), ((BISHOP, QUEEN), BISHOP_STEPS, True)):
+            pieces = np.isin(grid, [piece_type | colour for piece_type in piece_types])
+            for col_step, row_step in steps:
+                reached = _shift(pieces, row_step, col_step)
+                count = (reached & open_squares).sum(axis=(1, 2))
+                # Sliding pieces carry on through empty squares
+                while slides and reached.any():
+                    reached = _shift(reached & empty, row_step, col_step)
+                    count += (reached & open_squares).sum(axis=(1, 2))
+                total += sign * count
+    return total
+
+
+def evaluate_batch(squares, black_to_move, mobility_weight=0):
+    """Evaluates every position of a batch. With no mobility weight, this gives the same scores as
+    engine.evaluate.
+
+    :param squares: (N, 64) squares array
+    :param black_to_move: (N,) black to move array
+    :param mobility_weight: Centipawns for each extra square a side can move to (e.g. MOBILITY_WEIGHT)
+    :return: (N,) array of scores in centipawns, from the point of view of the player to move
+    """
+    scores = piece_square_scores(squares)
+    if mobility_weight:
+        scores += mobility_weight * mobility(squares)
+    return np.where(black_to_move, -scores, scores)
+
+
+def benchmark(count):
+    """Compares evaluating random positions one at a time with engine.evaluate and as a batch
+
+    :param count: Number of positions
+    """
+    rng = random.Random(2021)
+    boards = []
+    board = Board()
+    while len(boards) < count:
+        moves = list(board.generate_moves(board.turn))
+        if not moves or board.halfmove_clock >= 100:
+            board = Board()
+            continue
+        board.make_move(rng.choice(moves))
+        boards.append(board.copy())
+
+    start = time.perf_counter()
+    loop_scores = [evaluate(board) for board in boards]
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    squares, black_to_move = from_boards(boards)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    batch_scores = evaluate_batch(squares, black_to_move)
+    batch_seconds = time.perf_counter() - start
+    if batch_scores.tolist() != loop_scores:
+        raise RuntimeError("Batch scores differ from engine.evaluate")
+    start = time.perf_counter()
+    mobility(squares)
+    mobility_seconds = time.perf_counter() - start
+
+    print(f"{count} positions")
+    print(f"engine.evaluate loop: {loop_seconds:.3f}s ({count / loop_seconds:.0f} positions/s)")
+    print(f"from_boards:          {load_seconds:.3f}s")
+    print(f"evaluate_batch:       {batch_seconds:.3f}s ({count / batch_seconds:.0f} positions/s)")
+    print(f"mobility:             {mobility_seconds:.3f}s ({count / mobility_seconds:.0f} positions/s)")
+
+
+if __name__ == "__main__":
+    # Usage: python batch.py [number of positions]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
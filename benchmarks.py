@@ -0,0 +1,336 @@
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from board import Board, PIECE_CHARS, PAWN, KING
+from game import Game
+from gamefile import GameFile, NullGameFile
+
+# Benchmarks of the hot paths of move checking, parsing and saving games. Each one runs a fixed corpus of
+# positions and moves (a "pass") over and over, and reports operations per second, the most memory allocated at
+# once during a pass (the temporary objects the operations create), and the memory blocks per operation still
+# allocated after the pass (objects kept, e.g. in caches, or leaked).
+
+# Positions the move benchmarks are run on, in FEN
+POSITIONS = (
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQK2R w KQkq - 1 5",
+    "r2q1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N2N2/PP2BPPP/R2Q1RK1 b - - 3 10",
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    "8/2P2k2/8/8/3K4/8/6p1/8 w - - 0 60",
+)
+# Position for the movement and empty square benchmarks
+MIDDLEGAME = POSITIONS[2]
+# Position with a pawn that can be taken en-passant
+EN_PASSANT = POSITIONS[3]
+# Squares that pieces are moved from in the movement and empty square benchmarks
+FROM_SQUARES = (0, 12, 18, 27, 36, 45, 54, 63)
+# Moves as typed by players, for Game.parse_move (including some that are not valid)
+MOVE_TEXTS = ("e2 e4", "g1 f3", "g1 Nf3", "f3 Nxd4", "d1 Qxd8+", "e7 e8", "b1 c3+", "e2e4", "z9 e4", "e2 e9",
+              "bad", "h7 h8")
+# Moves played before the game file benchmarks, so loading replays a journal
+GAME_FILE_MOVES = ("e2 e4", "e7 e5", "g1 f3", "b8 c6", "f1 c4", "g8 f6", "d2 d3", "f8 c5", "c2 c3", "d7 d6")
+
+# Seconds each benchmark is timed for, and the number of times it is timed (the fastest time is kept)
+DEFAULT_MIN_TIME = 0.2
+REPEATS = 5
+# Fraction slower than the baseline that is reported as a regression. Timings on a busy or virtual machine vary
+# by up to 40% between runs, so smaller changes are not reported.
+REGRESSION_THRESHOLD = 0.50
+# Fraction more memory allocated during a pass than the baseline that is reported as a regression. The
+# allocations are the same on every run, so this can be much smaller.
+MEMORY_REGRESSION_THRESHOLD = 0.10
+# Increase in the memory allocated during a pass that is too small to report, in bytes
+MIN_MEMORY_REGRESSION = 1024
+# Results compared with by default. Speeds are only compared when the baseline was run on the same Python version
+# and platform, so update it (by passing its name as the results file) when a change is meant to alter
+# performance, or to compare speeds on another machine.
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks_baseline.json")
+
+
+def _square(index):
+    """Gets the column letter and row number of a square index"""
+    return chr(97 + (index & 7)), (index >> 3) + 1
+
+
+def _on_line(from_index, to_index):
+    """Checks if two different squares are on the same row, column or diagonal, with a square between them"""
+    col_step = abs((to_index & 7) - (from_index & 7))
+    row_step = abs((to_index >> 3) - (from_index >> 3))
+    return max(col_step, row_step) > 1 and (col_step == 0 or row_step == 0 or col_step == row_step)
+
+
+def board_move():
+    """Board.move for every legal move in each position, taking each move back with unmake_move"""
+    corpus = []
+    for fen in POSITIONS:
+        board = Board.from_fen(fen)
+        moves = []
+        for move in board.generate_moves(board.turn):
+            if board.squares[move & 63] & 7 == KING and abs(((move >> 6) & 63) - (move & 63)) == 2:
+                # Castling is done with Board.castle, not Board.move
+                continue
+            promotion = PIECE_CHARS[move >> 12] if move >> 12 else 'Q'
+            moves.append((*_square(move & 63), *_square((move >> 6) & 63), promotion))
+        corpus.append((board, moves))
+
+    def run():
+        ops = 0
+        for board, moves in corpus:
+            turn = board.turn
+            for from_col, from_row, to_col, to_row, promotion in moves:
+                board.unmake_move(board.move(turn, from_col, from_row, to_col, to_row, promotion))
+            ops += len(moves)
+        return ops
+    return run
+
+
+def validate_movement(piece):
+    """Board.validate_movement for a piece from each of FROM_SQUARES to every square"""
+    board = Board.from_fen(MIDDLEGAME)
+    corpus = [(*_square(from_index), *_square(to_index))
+              for from_index in FROM_SQUARES for to_index in range(64) if to_index != from_index]
+
+    def run():
+        validate = board.validate_movement
+        for from_col, from_row, to_col, to_row in corpus:
+            validate(piece, from_col, from_row, to_col, to_row)
+        return len(corpus)
+    return run
+
+
+def validate_empty_between():
+    """Board.validate_empty_between from each of FROM_SQUARES to every square on a line from it"""
+    board = Board.from_fen(MIDDLEGAME)
+    corpus = [(*_square(from_index), *_square(to_index))
+              for from_index in FROM_SQUARES for to_index in range(64) if _on_line(from_index, to_index)]
+
+    def run():
+        validate = board.validate_empty_between
+        for from_col, from_row, to_col, to_row in corpus:
+            validate(from_col, from_row, to_col, to_row)
+        return len(corpus)
+    return run
+
+
+def is_en_passant():
+    """Board.is_en_passant for every move of a white pawn one square forward or diagonally, in a position where
+    one of them is en-passant"""
+    board = Board.from_fen(EN_PASSANT)
+    corpus = [(*_square(from_index), *_square(from_index + step))
+              for from_index in range(8, 56) for step in (7, 8, 9)
+              if board.squares[from_index] == PAWN and abs(((from_index + step) & 7) - (from_index & 7)) <= 1]
+
+    def run():
+        check = board.is_en_passant
+        for from_col, from_row, to_col, to_row in corpus:
+            check(from_col, from_row, to_col, to_row)
+        return len(corpus)
+    return run
+
+
+def parse_move():
+    """Game.parse_move for each of MOVE_TEXTS"""
+    game = Game(None, game_file=NullGameFile())
+
+    def run():
+        parse = game.parse_move
+        for text in MOVE_TEXTS:
+            try:
+                parse(text)
+            except RuntimeError:
+                pass
+        return len(MOVE_TEXTS)
+    return run
+
+
+def _game_file_game(filename):
+    """Creates a game file with GAME_FILE_MOVES in its journal
+
+    :param filename: Name of the game file
+    :return: Game
+    """
+    game = Game(filename, game_file=GameFile(filename, sync_interval=0))
+    for move in GAME_FILE_MOVES:
+        error = game.apply_move(move)
+        if error:
+            raise RuntimeError(f"Benchmark move {move} is invalid: {error}")
+    return game
+
+
+def game_file_load(filename):
+    """GameFile.load of a game with a snapshot and a journal of moves, opening and closing the file each time"""
+    game = _game_file_game(filename)
+    game.close()
+
+    def run():
+        game_file = GameFile(filename, sync_interval=0)
+        game_file.load(game)
+        game_file.close()
+        return 1
+    return run
+
+
+def game_file_save(filename):
+    """GameFile.save of a game's position (each save is synced to disk)"""
+    game = _game_file_game(filename)
+
+    def run():
+        game.game_file.save(game)
+        return 1
+    return run
+
+
+def game_file_update(filename):
+    """GameFile.update after changing two squares (each update is synced to disk)"""
+    game = _game_file_game(filename)
+    board = game.board
+
+    def run():
+        # Move the h pawn forward one square, or back again
+        if board.get_square('h', 2) == 'P':
+            board.set_square('h', 2, ' ')
+            board.set_square('h', 3, 'P')
+        else:
+            board.set_square('h', 3, ' ')
+            board.set_square('h', 2, 'P')
+        game.game_file.update(game)
+        return 1
+    return run
+
+
+def benchmarks(directory):
+    """Sets up every benchmark
+
+    :param directory: Directory for the game files written by the benchmarks
+    :return: List of (name, run) pairs, where run does one pass and returns the number of operations
+    """
+    result = [("Board.move", board_move())]
+    result += [(f"Board.validate_movement[{piece}]", validate_movement(piece)) for piece in "PNBRQK"]
+    result += [("Board.validate_empty_between", validate_empty_between()),
+               ("Board.is_en_passant", is_en_passant()),
+               ("Game.parse_move", parse_move()),
+               ("GameFile.load", game_file_load(os.path.join(directory, "load.dat"))),
+               ("GameFile.save", game_file_save(os.path.join(directory, "save.dat"))),
+               ("GameFile.update", game_file_update(os.path.join(directory, "update.dat")))]
+    return result
+
+
+def measure(run, min_time=DEFAULT_MIN_TIME):
+    """Times a benchmark, then runs one more pass while tracing memory allocations
+
+    :param run: Function that does one pass of the benchmark and returns the number of operations
+    :param min_time: Seconds to keep running passes for in each timing
+    :return: Dictionary of ops_per_sec, peak_bytes (most memory allocated at once during a pass, above what was
+    in use before it) and retained_blocks_per_op (memory blocks allocated during the pass and still in use after it)
+    """
+    # Warm up, e.g. filling caches
+    run()
+    best = 0
+    for _ in range(REPEATS):
+        ops = 0
+        start = time.perf_counter()
+        while True:
+            ops += run()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, ops / elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    before = tracemalloc.take_snapshot().filter_traces(ignore)
+    tracemalloc.reset_peak()
+    start_size = tracemalloc.get_traced_memory()[0]
+    ops = run()
+    peak = tracemalloc.get_traced_memory()[1] - start_size
+    after = tracemalloc.take_snapshot().filter_traces(ignore)
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return {"ops_per_sec": round(best, 1), "peak_bytes": peak, "retained_blocks_per_op": round(blocks / ops, 3)}
+
+
+def run_benchmarks(min_time=DEFAULT_MIN_TIME, names=None):
+    """Runs the benchmarks, printing each result as it finishes
+
+    :param min_time: Seconds to keep running passes for in each timing
+    :param names: Names of the benchmarks to run (all of them if None)
+    :return: Dictionary of the Python version, platform, and results by benchmark name
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, run in benchmarks(directory):
+            if names is None or name in names:
+                results[name] = measure(run, min_time)
+                print(f"{name:34} {results[name]['ops_per_sec']:>14,.0f} ops/s "
+                      f"{results[name]['peak_bytes']:>10,} peak bytes/pass "
+                      f"{results[name]['retained_blocks_per_op']:>8.3f} retained blocks/op")
+    return {"python": platform.python_version(), "platform": platform.platform(), "results": results}
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD, memory_threshold=MEMORY_REGRESSION_THRESHOLD):
+    """Compares results with a baseline, printing the change in speed and memory allocated of each benchmark.
+    Speeds are only compared if the baseline was run on the same Python version and platform.
+
+    :param results: Dictionary from run_benchmarks
+    :param baseline: Dictionary from an earlier run_benchmarks
+    :param threshold: Fraction slower than the baseline that counts as a regression
+    :param memory_threshold: Fraction more memory allocated during a pass than the baseline that counts as a regression
+    :return: List of the names of the benchmarks that regressed
+    """
+    same_machine = (results["python"], results["platform"]) == (baseline["python"], baseline["platform"])
+    if not same_machine:
+        print(f"Baseline was run on Python {baseline['python']} ({baseline['platform']}), so speeds are not compared")
+    regressions = []
+    for name, result in results["results"].items():
+        before = baseline["results"].get(name)
+        if before is None or "peak_bytes" not in before:
+            print(f"{name:34} not in baseline")
+            continue
+        change = result["ops_per_sec"] / before["ops_per_sec"] - 1
+        extra_bytes = result["peak_bytes"] - before["peak_bytes"]
+        regressed = (same_machine and change < -threshold) or \
+            extra_bytes > max(MIN_MEMORY_REGRESSION, before["peak_bytes"] * memory_threshold)
+        if regressed:
+            regressions.append(name)
+        speed = f"{change:>+8.1%} speed" if same_machine else f"{'':>14}"
+        print(f"{name:34} {speed} {extra_bytes:>+10,} peak bytes/pass{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(output_filename=None, baseline_filename=None):
+    """Runs the benchmarks, optionally saving the results and comparing them with a baseline
+
+    :param output_filename: JSON file to write the results to, or None
+    :param baseline_filename: JSON file of earlier results to compare with (e.g. DEFAULT_BASELINE), or None
+    :return: Exit status: 1 if any benchmark regressed, 0 otherwise
+    """
+    results = run_benchmarks()
+    if output_filename:
+        with open(output_filename, mode='w') as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+        print(f"Results written to {output_filename}")
+    if baseline_filename:
+        with open(baseline_filename) as file:
+            baseline = json.load(file)
+        print(f"Compared with {baseline_filename}:")
+        regressions = compare(results, baseline)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    # Usage: python benchmarks.py [results JSON file|-] [baseline JSON file|-]
+    # Results are compared with benchmarks_baseline.json unless another baseline (or "-" for none) is given
+    baseline_argument = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_BASELINE
+    sys.exit(main(sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != "-" else None,
+                  baseline_argument if baseline_argument != "-" else None))
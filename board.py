@@ -1,24 +1,414 @@
+import random
+from functools import lru_cache
+
+# Pieces are stored as small integer codes. The low three bits hold the piece
+# type and the BLACK bit is set for black pieces, so an empty square is 0.
+EMPTY = 0
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+BLACK = 8
+
+# Letter for each piece code (codes 7 and 8 are unused)
+PIECE_CHARS = " PNBRQK  pnbrqk"
+# Piece code for each letter
+PIECE_CODES = {char: code for code, char in enumerate(PIECE_CHARS) if char != ' '}
+PIECE_CODES[' '] = EMPTY
+
+# Translation tables for converting a whole board between codes and letters in one call
+CODES_TO_CHARS = bytes.maketrans(bytes(range(len(PIECE_CHARS))), PIECE_CHARS.encode('ascii'))
+CHARS_TO_CODES = bytes.maketrans(
+    bytes(ord(char) for char in PIECE_CODES), bytes(code for code in PIECE_CODES.values()))
+
+# Column index for each column letter (either case)
+COL_INDEX = {chr(97 + i): i for i in range(8)}  # chr(97) is 'a'
+COL_INDEX.update({col.upper(): i for col, i in list(COL_INDEX.items())})
+
+
+def square_index(col, row) -> int:
+    """Gets the index of a square in the board's array of squares
+
+    :param col: column letter, 'a' to 'h'
+    :param row: row number, 1 to 8
+    :return: Square index, 0 (a1) to 63 (h8)
+    """
+    return (row - 1) * 8 + COL_INDEX[col]
+
+
+def square_name(index) -> str:
+    """Gets the name of a square from its index
+
+    :param index: Square index, 0 (a1) to 63 (h8)
+    :return: Square name, e.g. "e4"
+    """
+    return f"{chr(97 + (index & 7))}{(index >> 3) + 1}"
+
+
+def encode_move(from_index, to_index, promotion=EMPTY) -> int:
+    """Encodes a move as a single integer. Castling is encoded as the king moving two squares.
+
+    :param from_index: index of square of piece to move, 0 to 63
+    :param to_index: index of square to move to, 0 to 63
+    :param promotion: piece type a pawn is promoted to (e.g. QUEEN), or EMPTY if not a promotion
+    :return: Encoded move
+    """
+    return from_index | (to_index << 6) | (promotion << 12)
+
+
+def move_name(move) -> str:
+    """Gets the name of an encoded move in coordinate notation, e.g. "e2e4" or "e7e8q"
+
+    :param move: Encoded move
+    :return: Name of the move
+    """
+    name = square_name(move & 63) + square_name((move >> 6) & 63)
+    if move >> 12:
+        name += PIECE_CHARS[(move >> 12) | BLACK]
+    return name
+
+
+# Results of checking a move with Board.check_move or Board.check_castle: VALID_MOVE, or the reason the move
+# is invalid. Messages are only made (with move_error_message) when they are shown.
+VALID_MOVE = 0
+NO_PIECE = 1
+OPPONENTS_PIECE = 2
+OWN_PIECE_TAKEN = 3
+KING_TAKEN = 4
+INVALID_MOVEMENT = 5
+INVALID_PROMOTION = 6
+KING_IN_CHECK = 7
+CANNOT_CASTLE = 8
+
+MOVE_ERROR_MESSAGES = (
+    "",
+    "No piece located at {square}",
+    "An opponent's piece cannot be moved",
+    "A player cannot take their own piece",
+    "A king cannot be taken",
+    "The piece cannot move that way",
+    "A pawn cannot be promoted to {promotion}",
+    "The king would be in check",
+    "{player} can not castle {side}",
+)
+
+
+def move_error_message(code, square="", promotion="", player="", side="") -> str:
+    """Gets the message for a reason a move is invalid
+
+    :param code: Reason code from Board.check_move or Board.check_castle
+    :param square: Name of the from square, e.g. "e2"
+    :param promotion: Letter of the piece a pawn was to be promoted to
+    :param player: "White" or "Black", for castling
+    :param side: "kingside" or "queenside", for castling
+    :return: Message
+    """
+    return MOVE_ERROR_MESSAGES[code].format(square=square, promotion=promotion, player=player, side=side)
+
+
+# Outcome of a position for the player to move, with perfect play (e.g. from a tablebase)
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+# Castling rights, combined as bit flags
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+
+# Castling rights kept when a piece moves from or to each square (i.e. lost when a king or rook moves)
+CASTLING_MASK = [ALL_CASTLING] * 64
+CASTLING_MASK[0] = ALL_CASTLING & ~WHITE_QUEENSIDE
+CASTLING_MASK[4] = ALL_CASTLING & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[7] = ALL_CASTLING & ~WHITE_KINGSIDE
+CASTLING_MASK[56] = ALL_CASTLING & ~BLACK_QUEENSIDE
+CASTLING_MASK[60] = ALL_CASTLING & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[63] = ALL_CASTLING & ~BLACK_KINGSIDE
+
+# Movement directions as (column, row) steps
+KNIGHT_STEPS = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+ROOK_STEPS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+BISHOP_STEPS = ((1, 1), (1, -1), (-1, -1), (-1, 1))
+KING_STEPS = ROOK_STEPS + BISHOP_STEPS
+
+
+def _step_table(steps):
+    """Builds a table of the squares reachable from each square with a single step in each direction
+
+    :param steps: Tuple of (column, row) steps
+    :return: Tuple, indexed by square index, of tuples of square indices
+    """
+    return tuple(
+        tuple((index >> 3) * 8 + row_step * 8 + (index & 7) + col_step for col_step, row_step in steps
+              if 0 <= (index & 7) + col_step <= 7 and 0 <= (index >> 3) + row_step <= 7)
+        for index in range(64))
+
+
+def _ray_table(steps):
+    """Builds a table of the rays of squares from each square towards the edge of the board in each direction
+
+    :param steps: Tuple of (column, row) steps
+    :return: Tuple, indexed by square index, of a tuple of square indices (nearest first) for each direction
+    """
+    rays = []
+    for index in range(64):
+        square_rays = []
+        for col_step, row_step in steps:
+            ray = []
+            col = (index & 7) + col_step
+            row = (index >> 3) + row_step
+            while 0 <= col <= 7 and 0 <= row <= 7:
+                ray.append(row * 8 + col)
+                col += col_step
+                row += row_step
+            square_rays.append(tuple(ray))
+        rays.append(tuple(square_rays))
+    return tuple(rays)
+
+
+# Precomputed squares attacked from each square by a knight or king
+KNIGHT_ATTACKS = _step_table(KNIGHT_STEPS)
+KING_ATTACKS = _step_table(KING_STEPS)
+# Squares attacked from each square by a white pawn (index 0) and by a black pawn (index 1)
+PAWN_ATTACKS = (_step_table(((-1, 1), (1, 1))), _step_table(((-1, -1), (1, -1))))
+# Precomputed rays from each square for rooks (along columns and rows) and bishops (along diagonals)
+ROOK_RAYS = _ray_table(ROOK_STEPS)
+BISHOP_RAYS = _ray_table(BISHOP_STEPS)
+QUEEN_RAYS = tuple(ROOK_RAYS[index] + BISHOP_RAYS[index] for index in range(64))
+
+# Random numbers for Zobrist hashing. A position's key is the XOR of the numbers for each piece on its square,
+# the castling rights, the en-passant column, and the side to move (when black), so it can be updated
+# incrementally as pieces move. The seed is fixed so keys are the same in every process.
+_zobrist_random = random.Random(2021)
+# Number for each piece code on each square, indexed by (piece code << 6) | square index. Empty squares are 0.
+ZOBRIST_PIECES = [0 if code >> 6 == EMPTY or PIECE_CHARS[code >> 6] == ' ' else _zobrist_random.getrandbits(64)
+                  for code in range(len(PIECE_CHARS) << 6)]
+ZOBRIST_CASTLING = [0] + [_zobrist_random.getrandbits(64) for _ in range(ALL_CASTLING)]
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+INITIAL_SQUARES = bytes(
+    "RNBQKBNR" + "P" * 8 + " " * 32 + "p" * 8 + "rnbqkbnr", 'ascii').translate(CHARS_TO_CODES)
+
+# Lines of the board drawn by Board.render
+BOARD_COLUMNS = "    a   b   c   d   e   f   g   h  "
+BOARD_DIVIDER = "  ┼───┼───┼───┼───┼───┼───┼───┼───┼"
+
+# The initial position in Forsyth-Edwards Notation (FEN)
+INITIAL_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+# Number of FEN strings whose parsed positions are kept by parse_fen
+FEN_CACHE_SIZE = 4096
+# Castling rights for each letter of a FEN castling field, in the order they are written
+FEN_CASTLING = {'K': WHITE_KINGSIDE, 'Q': WHITE_QUEENSIDE, 'k': BLACK_KINGSIDE, 'q': BLACK_QUEENSIDE}
+# Translation table expanding the digits in a row of a FEN string into that many spaces (empty squares)
+FEN_EMPTY_SQUARES = str.maketrans({str(count): " " * count for count in range(1, 9)})
+# Characters allowed in a row of a FEN string once the empty squares are expanded
+FEN_SQUARE_CHARS = PIECE_CHARS.encode('ascii')
+# Runs of empty squares and the digit written for each in a FEN string, longest first
+FEN_EMPTY_RUNS = tuple((" " * count, str(count)) for count in range(8, 0, -1))
+
+
+class BoardSnapshot:
+    """An immutable copy of a board's position, which can be shared between boards, threads and processes.
+    The squares are held in bytes, so a snapshot takes about 220 bytes (measured with tracemalloc), against about
+    270 for a Board copy. Snapshots are hashable, compare equal when all their fields are equal, and pickle as
+    their fields (131 bytes)."""
+
+    __slots__ = ("squares", "turn", "castling", "en_passant", "halfmove_clock", "fullmove_number", "key")
+
+    def __init__(self, squares, turn, castling, en_passant, halfmove_clock, fullmove_number, key):
+        """
+        :param squares: 64 piece codes, from a1 along each row to h8 (copied unless already bytes)
+        :param turn: Player to move next, 'W' or 'B'
+        :param castling: Castling rights still available (bit flags, e.g. WHITE_KINGSIDE)
+        :param en_passant: Square a pawn can move to by capturing en-passant, or None
+        :param halfmove_clock: Number of moves since the last capture or pawn move
+        :param fullmove_number: Number of the current move, starting at 1
+        :param key: Zobrist hash key of the position
+        """
+        set_field = object.__setattr__
+        set_field(self, "squares", bytes(squares))
+        set_field(self, "turn", turn)
+        set_field(self, "castling", castling)
+        set_field(self, "en_passant", en_passant)
+        set_field(self, "halfmove_clock", halfmove_clock)
+        set_field(self, "fullmove_number", fullmove_number)
+        set_field(self, "key", key)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BoardSnapshot is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("BoardSnapshot is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, BoardSnapshot):
+            return NotImplemented
+        return self.key == other.key and self.squares == other.squares and self.turn == other.turn \
+            and self.castling == other.castling and self.en_passant == other.en_passant \
+            and self.halfmove_clock == other.halfmove_clock and self.fullmove_number == other.fullmove_number
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __reduce__(self):
+        return BoardSnapshot, (self.squares, self.turn, self.castling, self.en_passant, self.halfmove_clock,
+                               self.fullmove_number, self.key)
+
+    def __repr__(self):
+        return f"BoardSnapshot({Board.from_snapshot(self).to_fen()!r})"
+
+    def __str__(self):
+        """Returns the squares as a string, in the same format as str(Board)"""
+        return self.squares.translate(CODES_TO_CHARS).decode('ascii')
+
+
 class Board:
     """A chess board"""
 
     def __init__(self):
-        # Initialise 2d array for current state of board
-        self.state = [[]]
+        # Piece code of each square, from a1 (index 0) along each row to h8 (index 63)
+        self.squares = bytearray(64)
         self.size = 8  # board is size 8*8
+        # Castling rights still available (bit flags, e.g. WHITE_KINGSIDE)
+        self.castling = ALL_CASTLING
+        # Square a pawn can move to by capturing en-passant, or None
+        self.en_passant = None
+        # Player to move next, 'W' or 'B'
+        self.turn = 'W'
+        # Number of moves (by either player) since the last capture or pawn move, for the fifty-move rule
+        self.halfmove_clock = 0
+        # Number of the current move, starting at 1 and increased after each of black's moves (as in FEN)
+        self.fullmove_number = 1
+        # Zobrist hash key of the position
+        self.key = 0
+        # Last snapshot taken of the position (see snapshot), or None
+        self.last_snapshot = None
         self.reset()
 
     def reset(self):
         """Resets the board to its initial state at the start of a game"""
-        self.state = [
-            ['R', 'N', 'B', 'Q', 'K', 'B', 'N', 'R'],
-            ['P'] * 8,
-            [' '] * 8,
-            [' '] * 8,
-            [' '] * 8,
-            [' '] * 8,
-            ['p'] * 8,
-            ['r', 'n', 'b', 'q', 'k', 'b', 'n', 'r']
-        ]
+        self.squares[:] = INITIAL_SQUARES
+        self.castling = ALL_CASTLING
+        self.en_passant = None
+        self.turn = 'W'
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.key = self.compute_key()
+
+    def set_position(self, squares, turn='W', castling=ALL_CASTLING, en_passant=None, halfmove_clock=0,
+                     fullmove_number=1):
+        """Sets up the whole board at once
+
+        :param squares: 64 piece codes, from a1 along each row to h8 (bytes, bytearray, or similar)
+        :param turn: Player to move next, 'W' or 'B'
+        :param castling: Castling rights still available (bit flags, e.g. WHITE_KINGSIDE)
+        :param en_passant: Square a pawn can move to by capturing en-passant, or None
+        :param halfmove_clock: Number of moves since the last capture or pawn move
+        :param fullmove_number: Number of the current move, starting at 1
+        """
+        self.squares[:] = squares
+        self.turn = turn
+        self.castling = castling
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        self.key = self.compute_key()
+
+    def infer_castling(self):
+        """Works out castling rights from the position alone, assuming a king and rook on their
+        initial squares have not moved. Used when the rights were not stored.
+
+        :return: Castling rights (bit flags)
+        """
+        squares = self.squares
+        castling = 0
+        if squares[4] == KING:
+            castling |= (WHITE_KINGSIDE if squares[7] == ROOK else 0) | (WHITE_QUEENSIDE if squares[0] == ROOK else 0)
+        if squares[60] == KING | BLACK:
+            castling |= (BLACK_KINGSIDE if squares[63] == ROOK | BLACK else 0) \
+                | (BLACK_QUEENSIDE if squares[56] == ROOK | BLACK else 0)
+        return castling
+
+    def compute_key(self):
+        """Computes the Zobrist hash key of the position from scratch. The key is normally kept
+        up to date incrementally, so this is only needed after changing the board's attributes directly.
+
+        :return: 64-bit key
+        """
+        key = ZOBRIST_CASTLING[self.castling]
+        for index, code in enumerate(self.squares):
+            key ^= ZOBRIST_PIECES[(code << 6) | index]
+        if self.en_passant is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant & 7]
+        if self.turn == 'B':
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key
+
+    def set_turn(self, colour):
+        """Sets the player to move next
+
+        :param colour: 'W' for white player, 'B' for black player
+        """
+        if colour != self.turn:
+            self.turn = colour
+            self.key ^= ZOBRIST_BLACK_TO_MOVE
+
+    def copy(self):
+        """Creates an independent copy of the board
+
+        :return: New Board instance with the same pieces
+        """
+        board = Board.__new__(Board)
+        board.squares = bytearray(self.squares)
+        board.size = self.size
+        board.castling = self.castling
+        board.en_passant = self.en_passant
+        board.turn = self.turn
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+        board.key = self.key
+        board.last_snapshot = self.last_snapshot
+        return board
+
+    def snapshot(self):
+        """Gets an immutable snapshot of the position. The last snapshot taken is returned again while the
+        position has not changed (checked by its key, halfmove clock and move number, so like repetition
+        detection this relies on the key being kept up to date), so taking snapshots of a board that is not
+        moving costs no copying.
+
+        :return: BoardSnapshot
+        """
+        snapshot = self.last_snapshot
+        if snapshot is None or snapshot.key != self.key or snapshot.halfmove_clock != self.halfmove_clock \
+                or snapshot.fullmove_number != self.fullmove_number:
+            snapshot = self.last_snapshot = BoardSnapshot(self.squares, self.turn, self.castling, self.en_passant,
+                                                          self.halfmove_clock, self.fullmove_number, self.key)
+        return snapshot
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Creates a board from a snapshot. The board starts off sharing the snapshot, so snapshot() returns it
+        until the board changes.
+
+        :param snapshot: BoardSnapshot
+        :return: New Board instance
+        """
+        board = cls.__new__(cls)
+        board.squares = bytearray(snapshot.squares)
+        board.size = 8
+        board.castling = snapshot.castling
+        board.en_passant = snapshot.en_passant
+        board.turn = snapshot.turn
+        board.halfmove_clock = snapshot.halfmove_clock
+        board.fullmove_number = snapshot.fullmove_number
+        board.key = snapshot.key
+        board.last_snapshot = snapshot
+        return board
 
     def get_square(self, col, row) -> str:
         """Gets the piece at a sqaure
@@ -27,9 +417,7 @@ class Board:
         :param row: row number, 1 to 8
         :return: Letter indicating the piece at the square, or a space if the square is empty
         """
-        row_index = row - 1
-        col_index = ord(col.lower()) - 97  # ord('a') is 97
-        return self.state[row_index][col_index]
+        return PIECE_CHARS[self.squares[(row - 1) * 8 + COL_INDEX[col]]]
 
     def set_square(self, col, row, value):
         """Sets the value of a square on the board
@@ -38,9 +426,10 @@ class Board:
         :param row: row number, 1 to 8
         :param value: Value to be set (letter of a piece, or a space)
         """
-        row_index = row - 1
-        col_index = ord(col.lower()) - 97  # ord('a') is 97
-        self.state[row_index][col_index] = value
+        index = (row - 1) * 8 + COL_INDEX[col]
+        code = PIECE_CODES[value]
+        self.key ^= ZOBRIST_PIECES[(self.squares[index] << 6) | index] ^ ZOBRIST_PIECES[(code << 6) | index]
+        self.squares[index] = code
 
     def piece_colour(self, col, row):
         """Gets the colour of a piece at a particular square
@@ -49,29 +438,70 @@ class Board:
         :param row: square row number, 1 to 8
         :return: 'W' for a white piece, 'B' for a black piece, or None if square is empty
         """
-        square = self.get_square(col, row)
-        if square == ' ':
+        return self.colour_at(square_index(col, row))
+
+    def colour_at(self, index):
+        """Gets the colour of a piece at a particular square index
+
+        :param index: Square index, 0 (a1) to 63 (h8)
+        :return: 'W' for a white piece, 'B' for a black piece, or None if square is empty
+        """
+        code = self.squares[index]
+        if code == EMPTY:
             return None
-        return 'W' if square.isupper() else 'B'
+        return 'B' if code & BLACK else 'W'
 
-    def print(self):
-        """Prints the board to the screen"""
-        print("    a   b   c   d   e   f   g   h  ")
-        print("  ┼───┼───┼───┼───┼───┼───┼───┼───┼")
+    @classmethod
+    def from_fen(cls, fen):
+        """Creates a board from a position in Forsyth-Edwards Notation (FEN). Positions are parsed by
+        parse_fen, so a FEN string seen recently costs little more than copying its squares.
+
+        :param fen: FEN string, e.g. INITIAL_FEN
+        :return: New Board instance
+        :raises ValueError: if the string is not valid FEN
+        """
+        return cls.from_snapshot(parse_fen(fen))
+
+    def to_fen(self):
+        """Gets the position in Forsyth-Edwards Notation (FEN), including the castling rights, en-passant
+        square, halfmove clock and move number
+
+        :return: FEN string, e.g. INITIAL_FEN for a new board
+        """
+        text = str(self)
+        placement = "/".join([text[start:start + 8] for start in range(56, -8, -8)])
+        for run, digit in FEN_EMPTY_RUNS:
+            placement = placement.replace(run, digit)
+        castling = "".join([letter for letter, flag in FEN_CASTLING.items() if self.castling & flag]) or "-"
+        en_passant = "-" if self.en_passant is None else square_name(self.en_passant)
+        return f"{placement} {self.turn.lower()} {castling} {en_passant} {self.halfmove_clock} {self.fullmove_number}"
+
+    def render(self):
+        """Draws the board as text, with white at the bottom
+
+        :return: String of the drawing's lines, ending with a newline
+        """
+        state = str(self)
+        lines = [BOARD_COLUMNS, BOARD_DIVIDER]
         for row in range(8, 0, -1):
-            pieces = " │ ".join(self.state[row - 1])
-            print(f"{row} │ {pieces} │ {row}")
-            print("  ┼───┼───┼───┼───┼───┼───┼───┼───┼")
-        print("    a   b   c   d   e   f   g   h  ")
+            pieces = " │ ".join(state[(row - 1) * 8:row * 8])
+            lines.append(f"{row} │ {pieces} │ {row}")
+            lines.append(BOARD_DIVIDER)
+        lines.append(BOARD_COLUMNS)
+        return "\n".join(lines) + "\n"
+
+    def print(self):
+        """Prints the board to the screen, with a single write"""
+        print(self.render(), end="")
 
     def __str__(self):
         """Returns a string representation of the current state of the board
 
         :return: String representation of the board
         """
-        return "".join(list(map(lambda row: ''.join(row), self.state)))
+        return self.squares.translate(CODES_TO_CHARS).decode('ascii')
 
-    def move(self, player_colour, from_col, from_row, to_col, to_row):
+    def move(self, player_colour, from_col, from_row, to_col, to_row, promotion='Q'):
         """Moves a piece from one square to another
 
         :param player_colour: 'W' for white player, 'B' for black player
@@ -79,93 +509,480 @@ class Board:
         :param from_row: row number of piece to move, 1 to 8
         :param to_col: column letter of square to move to, 'a' to 'h'
         :param to_row: row number of square to move to, 1 to 8
+        :param promotion: letter of the piece a pawn reaching the end is promoted to (defaults to queen)
+        :return: Undo record for the move (see make_move)
         :raises RuntimeError: if move is invalid
         """
-        # Validate from square is a piece
-        from_square = self.get_square(from_col, from_row)
-        if from_square == ' ':
-            raise RuntimeError(f"No piece located at {from_col}{from_row}")
+        code = self.check_move(player_colour, from_col, from_row, to_col, to_row, promotion)
+        if code != VALID_MOVE:
+            raise RuntimeError(move_error_message(code, square=f"{from_col}{from_row}", promotion=promotion))
+        return self.make_move(self.encode(from_col, from_row, to_col, to_row, promotion))
 
-        # Validate the from square is a piece of the player's colour.
-        if player_colour != self.piece_colour(from_col, from_row):
-            raise RuntimeError(f"An opponent's piece cannot be moved")
+    def check_move(self, player_colour, from_col, from_row, to_col, to_row, promotion='Q'):
+        """Checks if a move is valid, without making it or raising an exception (see move for the parameters)
+
+        :return: VALID_MOVE, or a code for the reason the move is invalid (see move_error_message)
+        """
+        return self.check_move_index(player_colour, (from_row - 1) * 8 + COL_INDEX[from_col],
+                                     (to_row - 1) * 8 + COL_INDEX[to_col], PIECE_CODES.get(promotion.upper(), EMPTY))
+
+    def check_move_index(self, player_colour, from_index, to_index, promotion=QUEEN):
+        """Checks if a move is valid, using square indexes, without making it or raising an exception
+
+        :param player_colour: 'W' for white player, 'B' for black player
+        :param from_index: Square index of the piece to move
+        :param to_index: Square index to move to
+        :param promotion: Code of the piece a pawn reaching the end is promoted to
+        :return: VALID_MOVE, or a code for the reason the move is invalid (see move_error_message)
+        """
+        squares = self.squares
+        own = BLACK if player_colour == 'B' else 0
 
-        # Validate the to square is not a piece of the player's color
-        if player_colour == self.piece_colour(to_col, to_row):
-            raise RuntimeError(f"A player cannot take their own piece")
+        # Validate from square is a piece of the player's colour
+        piece = squares[from_index]
+        if piece == EMPTY:
+            return NO_PIECE
+        if piece & BLACK != own:
+            return OPPONENTS_PIECE
 
-        # Validate the to square is not a king
-        if self.get_square(to_col, to_row).lower() == 'k':
-            raise RuntimeError(f"A king cannot be taken")
+        # Validate the to square is not a piece of the player's colour, or a king
+        target = squares[to_index]
+        if target != EMPTY:
+            if target & BLACK == own:
+                return OWN_PIECE_TAKEN
+            if target & 7 == KING:
+                return KING_TAKEN
 
         # Validate the piece can move that way
-        if not self.validate_movement(from_square, from_col, from_row, to_col, to_row):
-            raise RuntimeError(f"The piece cannot move that way")
+        if not self.validate_movement_index(piece, from_index, to_index):
+            return INVALID_MOVEMENT
 
-        # For en-passant, the pawn in the (to_col, from_row) square is taken
-        if self.is_en_passant(from_col, from_row, to_col, to_row):
-            self.set_square(to_col, from_row, ' ')
+        # Promote pawns that have reached the end
+        if piece & 7 == PAWN and (to_index >= 56 or to_index < 8):
+            if promotion not in (KNIGHT, BISHOP, ROOK, QUEEN):
+                return INVALID_PROMOTION
+        else:
+            promotion = EMPTY
+
+        # Validate the player's own king is not left in check
+        if self.leaves_king_in_check(from_index | to_index << 6 | promotion << 12):
+            return KING_IN_CHECK
+        return VALID_MOVE
 
-        # Promote pawns that have reached the end to queens
-        if to_row == 8 and from_square == 'P':
-            from_square = 'Q'
-        elif to_row == 1 and from_square == 'p':
-            from_square = 'q'
+    def encode(self, from_col, from_row, to_col, to_row, promotion='Q'):
+        """Encodes a move given as squares, promoting a pawn only if it reaches the end (see move for the parameters)
 
-        # Make the move
-        self.set_square(to_col, to_row, from_square)
-        self.set_square(from_col, from_row, ' ')
+        :return: Encoded move
+        """
+        from_index = (from_row - 1) * 8 + COL_INDEX[from_col]
+        to_index = (to_row - 1) * 8 + COL_INDEX[to_col]
+        promotion_type = EMPTY
+        if self.squares[from_index] & 7 == PAWN and (to_index >= 56 or to_index < 8):
+            promotion_type = PIECE_CODES[promotion.upper()]
+        return encode_move(from_index, to_index, promotion_type)
 
     def castle(self, is_white, is_kingside):
         """Performs a castling move
 
         :param is_white: True for white, False for black
         :param is_kingside: True for a kingside castle, False for a queenside castle
+        :return: Undo record for the move (see make_move)
         :raises: RuntimeError: if move is invalid
         """
-        if is_white and is_kingside:
-            # Validate castling is possible
-            if self.get_square('e', 1) != "K" or self.get_square('f', 1) != " " or self.get_square('g', 1) != " " \
-                    or self.get_square('h', 1) != 'R':
-                raise RuntimeError("White can not castle kingside")
-            # Make the move
-            self.set_square('e', 1, ' ')
-            self.set_square('f', 1, 'R')
-            self.set_square('g', 1, 'K')
-            self.set_square('h', 1, ' ')
-
-        elif is_white and not is_kingside:
-            # Validate castling is possible
-            if self.get_square('e', 1) != "K" or self.get_square('d', 1) != " " or self.get_square('c', 1) != " " \
-                    or self.get_square('b', 1) != " " or self.get_square('a', 1) != 'R':
-                raise RuntimeError("White can not castle queenside")
-            # Make the move
-            self.set_square('e', 1, ' ')
-            self.set_square('d', 1, 'R')
-            self.set_square('c', 1, 'K')
-            self.set_square('a', 1, ' ')
-
-        elif is_kingside:  # for black
-            # Validate castling is possible
-            if self.get_square('e', 8) != "k" or self.get_square('f', 8) != " " or self.get_square('g', 8) != " " \
-                    or self.get_square('h', 8) != 'r':
-                raise RuntimeError("Black can not castle kingside")
-            # Make the move
-            self.set_square('e', 8, ' ')
-            self.set_square('f', 8, 'r')
-            self.set_square('g', 8, 'k')
-            self.set_square('h', 8, ' ')
-
-        else:  # black, queenside
-            # Validate castling is possible
-            if self.get_square('e', 8) != "k" or self.get_square('d', 8) != " " or self.get_square('c', 8) != " " \
-                    or self.get_square('b', 8) != " " or self.get_square('a', 8) != 'r':
-                raise RuntimeError("Black can not castle queenside")
-            # Make the move
-            self.set_square('e', 8, ' ')
-            self.set_square('d', 8, 'r')
-            self.set_square('c', 8, 'k')
-            self.set_square('a', 8, ' ')
+        code = self.check_castle(is_white, is_kingside)
+        if code != VALID_MOVE:
+            raise RuntimeError(move_error_message(code, player="White" if is_white else "Black",
+                                                  side="kingside" if is_kingside else "queenside"))
+        return self.make_move(self.castling_move(is_white, is_kingside))
+
+    def check_castle(self, is_white, is_kingside):
+        """Checks if a castling move is valid, without making it or raising an exception
+
+        :param is_white: True for white, False for black
+        :param is_kingside: True for a kingside castle, False for a queenside castle
+        :return: VALID_MOVE, or CANNOT_CASTLE
+        """
+        squares = self.squares
+        # Squares are relative to the back row of the castling player
+        base = 0 if is_white else 56
+        colour = 0 if is_white else BLACK
+        king = KING | colour
+        rook = ROOK | colour
+        enemy = colour ^ BLACK
+        if is_kingside:
+            # Validate castling is possible: king on e, rook on h, f/g empty, neither has moved,
+            # and the king does not start in, pass through, or end in check
+            if squares[base + 4] != king or squares[base + 5] != EMPTY or squares[base + 6] != EMPTY \
+                    or squares[base + 7] != rook \
+                    or not self.castling & (WHITE_KINGSIDE if is_white else BLACK_KINGSIDE) \
+                    or self.is_attacked_by(base + 4, enemy) or self.is_attacked_by(base + 5, enemy) \
+                    or self.is_attacked_by(base + 6, enemy):
+                return CANNOT_CASTLE
+        else:
+            # Validate castling is possible: king on e, rook on a, b/c/d empty, neither has moved,
+            # and the king does not start in, pass through, or end in check
+            if squares[base + 4] != king or squares[base + 3] != EMPTY or squares[base + 2] != EMPTY \
+                    or squares[base + 1] != EMPTY or squares[base] != rook \
+                    or not self.castling & (WHITE_QUEENSIDE if is_white else BLACK_QUEENSIDE) \
+                    or self.is_attacked_by(base + 4, enemy) or self.is_attacked_by(base + 3, enemy) \
+                    or self.is_attacked_by(base + 2, enemy):
+                return CANNOT_CASTLE
+        return VALID_MOVE
+
+    @staticmethod
+    def castling_move(is_white, is_kingside):
+        """Gets the encoded move of the king for a castling move
+
+        :param is_white: True for white, False for black
+        :param is_kingside: True for a kingside castle, False for a queenside castle
+        :return: Encoded move
+        """
+        base = 0 if is_white else 56
+        return encode_move(base + 4, base + 6 if is_kingside else base + 2)
+
+    def make_move(self, move):
+        """Makes an encoded move on the board, without validating it. This also handles
+        en-passant captures, promotions, moving the rook when castling, castling rights,
+        the player to move next, and the position's key.
+
+        :param move: Encoded move (see encode_move), such as one from generate_moves
+        :return: Undo record, which can be passed to unmake_move to take back the move. This is a tuple of
+        the move, the captured piece code, and the castling rights, en-passant square, halfmove clock,
+        and key from before the move.
+        """
+        squares = self.squares
+        from_index = move & 63
+        to_index = (move >> 6) & 63
+        piece = squares[from_index]
+        captured = squares[to_index]
+        piece_type = piece & 7
+        record = (move, captured, self.castling, self.en_passant, self.halfmove_clock, self.key)
+        # Take the moving piece off its square, and any captured piece off the to square
+        key = self.key ^ ZOBRIST_PIECES[(piece << 6) | from_index] ^ ZOBRIST_PIECES[(captured << 6) | to_index]
+        en_passant = self.en_passant
+        if en_passant is not None:
+            key ^= ZOBRIST_EN_PASSANT[en_passant & 7]
+            self.en_passant = None
+
+        if piece_type == PAWN:
+            self.halfmove_clock = 0
+            if to_index == en_passant:
+                # For en-passant, the pawn in the (to column, from row) square is taken
+                taken_index = (from_index & ~7) | (to_index & 7)
+                key ^= ZOBRIST_PIECES[(squares[taken_index] << 6) | taken_index]
+                squares[taken_index] = EMPTY
+            elif abs(to_index - from_index) == 16:
+                # After moving two squares, the skipped square can be taken en-passant by an opponent's pawn
+                enemy_pawn = PAWN | (piece & BLACK) ^ BLACK
+                if (to_index & 7 > 0 and squares[to_index - 1] == enemy_pawn) \
+                        or (to_index & 7 < 7 and squares[to_index + 1] == enemy_pawn):
+                    self.en_passant = (from_index + to_index) >> 1
+                    key ^= ZOBRIST_EN_PASSANT[to_index & 7]
+            elif move >> 12:
+                piece = (move >> 12) | (piece & BLACK)
+        else:
+            self.halfmove_clock = 0 if captured else self.halfmove_clock + 1
+            if piece_type == KING and abs(to_index - from_index) == 2:
+                # Castling, so move the rook too
+                if to_index > from_index:
+                    rook_from, rook_to = from_index + 3, from_index + 1
+                else:
+                    rook_from, rook_to = from_index - 4, from_index - 1
+                rook = squares[rook_from]
+                key ^= ZOBRIST_PIECES[(rook << 6) | rook_from] ^ ZOBRIST_PIECES[(rook << 6) | rook_to]
+                squares[rook_to] = rook
+                squares[rook_from] = EMPTY
+
+        squares[to_index] = piece
+        squares[from_index] = EMPTY
+        castling = self.castling & CASTLING_MASK[from_index] & CASTLING_MASK[to_index]
+        self.key = key ^ ZOBRIST_PIECES[(piece << 6) | to_index] ^ ZOBRIST_CASTLING[self.castling] \
+            ^ ZOBRIST_CASTLING[castling] ^ ZOBRIST_BLACK_TO_MOVE
+        self.castling = castling
+        if self.turn == 'B':
+            self.fullmove_number += 1
+            self.turn = 'W'
+        else:
+            self.turn = 'B'
+        return record
+
+    def unmake_move(self, record):
+        """Takes back a move made by make_move, restoring the board exactly as it was before the move
+
+        :param record: Undo record returned by make_move. Moves must be taken back in the reverse order
+        they were made.
+        """
+        move, captured, self.castling, en_passant, self.halfmove_clock, self.key = record
+        self.en_passant = en_passant
+        squares = self.squares
+        from_index = move & 63
+        to_index = (move >> 6) & 63
+        piece = squares[to_index]
+        if move >> 12:
+            # Promoted pieces go back to being pawns
+            piece = PAWN | (piece & BLACK)
+        squares[from_index] = piece
+        squares[to_index] = captured
+
+        piece_type = piece & 7
+        if piece_type == PAWN and to_index == en_passant:
+            # Put back the pawn taken en-passant
+            squares[(from_index & ~7) | (to_index & 7)] = PAWN | (piece & BLACK) ^ BLACK
+        elif piece_type == KING and abs(to_index - from_index) == 2:
+            # Castling, so move the rook back too
+            if to_index > from_index:
+                rook_from, rook_to = from_index + 3, from_index + 1
+            else:
+                rook_from, rook_to = from_index - 4, from_index - 1
+            squares[rook_from] = squares[rook_to]
+            squares[rook_to] = EMPTY
+        if self.turn == 'W':
+            self.fullmove_number -= 1
+            self.turn = 'B'
+        else:
+            self.turn = 'W'
+
+    def changed_squares(self, record):
+        """Gets the squares changed by a move that has just been made
+
+        :param record: Undo record returned by make_move
+        :return: List of square indices
+        """
+        move = record[0]
+        from_index = move & 63
+        to_index = (move >> 6) & 63
+        changed = [from_index, to_index]
+        piece_type = self.squares[to_index] & 7
+        if piece_type == PAWN and to_index == record[3]:
+            # The pawn taken en-passant
+            changed.append((from_index & ~7) | (to_index & 7))
+        elif piece_type == KING and abs(to_index - from_index) == 2:
+            # The rook moved by castling
+            if to_index > from_index:
+                changed += [from_index + 3, from_index + 1]
+            else:
+                changed += [from_index - 4, from_index - 1]
+        return changed
+
+    def generate_moves(self, colour, legal=True):
+        """Generates the moves a player can make, including castling, en-passant, and promotions
+
+        :param colour: 'W' for white player, 'B' for black player
+        :param legal: True to only generate legal moves, or False to also generate (pseudo-legal)
+        moves that leave the player's own king in check
+        :return: Generator of encoded moves (see encode_move)
+        """
+        if not legal:
+            yield from self.pseudo_legal_moves(colour)
+            return
+        own = BLACK if colour == 'B' else 0
+        king_index = self.squares.find(KING | own)
+        if king_index < 0:
+            yield from self.pseudo_legal_moves(colour)
+            return
+        # Unless in check, only moves of the king, pinned pieces, or en-passant captures can expose the king
+        checked = self.is_attacked_by(king_index, own ^ BLACK)
+        pinned = self.pinned_squares(colour)
+        en_passant = self.en_passant
+        for move in self.pseudo_legal_moves(colour):
+            from_index = move & 63
+            if not checked and from_index != king_index and from_index not in pinned \
+                    and (move >> 6) & 63 != en_passant:
+                yield move
+            elif not self.leaves_king_in_check(move):
+                yield move
+
+    def pseudo_legal_moves(self, colour):
+        """Generates the moves a player can make, without checking if they leave the player's king in check.
+        Castling moves are only generated when the king is not in check and does not pass through check.
+
+        :param colour: 'W' for white player, 'B' for black player
+        :return: Generator of encoded moves (see encode_move)
+        """
+        squares = self.squares
+        own = BLACK if colour == 'B' else 0
+        enemy = own ^ BLACK
+        for from_index in range(64):
+            piece = squares[from_index]
+            if piece == EMPTY or piece & BLACK != own:
+                continue
+            piece_type = piece & 7
+
+            if piece_type == PAWN:
+                forward = -8 if own else 8
+                to_index = from_index + forward
+                promotions = (QUEEN, ROOK, BISHOP, KNIGHT) if to_index >= 56 or to_index < 8 else (EMPTY,)
+                # Move forward one square, or two from the initial position
+                if squares[to_index] == EMPTY:
+                    for promotion in promotions:
+                        yield encode_move(from_index, to_index, promotion)
+                    if from_index >> 3 == (6 if own else 1) and squares[to_index + forward] == EMPTY:
+                        yield encode_move(from_index, to_index + forward)
+                # Take diagonally forward, normally or by en-passant
+                for target_index in PAWN_ATTACKS[1 if own else 0][from_index]:
+                    target = squares[target_index]
+                    if (target != EMPTY and target & BLACK == enemy) or target_index == self.en_passant:
+                        for promotion in promotions:
+                            yield encode_move(from_index, target_index, promotion)
+
+            elif piece_type == KNIGHT or piece_type == KING:
+                # Step a single time in each direction
+                for target_index in (KNIGHT_ATTACKS if piece_type == KNIGHT else KING_ATTACKS)[from_index]:
+                    target = squares[target_index]
+                    if target == EMPTY or target & BLACK == enemy:
+                        yield encode_move(from_index, target_index)
+
+            else:
+                # Slide in each direction until reaching the edge or another piece
+                if piece_type == ROOK:
+                    rays = ROOK_RAYS[from_index]
+                elif piece_type == BISHOP:
+                    rays = BISHOP_RAYS[from_index]
+                else:
+                    rays = QUEEN_RAYS[from_index]
+                for ray in rays:
+                    for target_index in ray:
+                        target = squares[target_index]
+                        if target == EMPTY:
+                            yield encode_move(from_index, target_index)
+                        else:
+                            if target & BLACK == enemy:
+                                yield encode_move(from_index, target_index)
+                            break
+
+        # Castling, if the king and rook have not moved, the squares between are empty,
+        # and the king does not start in, pass through, or end in check
+        base = 56 if own else 0
+        king = KING | own
+        if squares[base + 4] == king and self.castling and not self.is_attacked_by(base + 4, enemy):
+            if self.castling & (BLACK_KINGSIDE if own else WHITE_KINGSIDE) and squares[base + 7] == ROOK | own \
+                    and squares[base + 5] == EMPTY and squares[base + 6] == EMPTY \
+                    and not self.is_attacked_by(base + 5, enemy) and not self.is_attacked_by(base + 6, enemy):
+                yield encode_move(base + 4, base + 6)
+            if self.castling & (BLACK_QUEENSIDE if own else WHITE_QUEENSIDE) and squares[base] == ROOK | own \
+                    and squares[base + 3] == EMPTY and squares[base + 2] == EMPTY and squares[base + 1] == EMPTY \
+                    and not self.is_attacked_by(base + 3, enemy) and not self.is_attacked_by(base + 2, enemy):
+                yield encode_move(base + 4, base + 2)
+
+    def leaves_king_in_check(self, move):
+        """Checks if making a move would leave the moving player's king in check
+
+        :param move: Encoded move
+        :return: True if the king would be in check, False otherwise
+        """
+        own = self.squares[move & 63] & BLACK
+        record = self.make_move(move)
+        king_index = self.squares.find(KING | own)
+        checked = king_index >= 0 and self.is_attacked_by(king_index, own ^ BLACK)
+        self.unmake_move(record)
+        return checked
+
+    def pinned_squares(self, colour):
+        """Finds the player's pieces that are pinned against their king by an opponent's rook, bishop, or queen
+
+        :param colour: 'W' for white player, 'B' for black player
+        :return: Set of square indices of pinned pieces
+        """
+        squares = self.squares
+        own = BLACK if colour == 'B' else 0
+        pinned = set()
+        king_index = squares.find(KING | own)
+        if king_index < 0:
+            return pinned
+        queen = QUEEN | own ^ BLACK
+        for rays, slider in ((ROOK_RAYS, ROOK | own ^ BLACK), (BISHOP_RAYS, BISHOP | own ^ BLACK)):
+            for ray in rays[king_index]:
+                blocker = None
+                for index in ray:
+                    target = squares[index]
+                    if target == EMPTY:
+                        continue
+                    if blocker is None and target & BLACK == own:
+                        # First piece is the player's own, so it may be pinned
+                        blocker = index
+                        continue
+                    if blocker is not None and (target == slider or target == queen):
+                        pinned.add(blocker)
+                    break
+        return pinned
+
+    def is_attacked(self, index, by_colour):
+        """Checks if a square is attacked by any of a player's pieces
+
+        :param index: Square index, 0 (a1) to 63 (h8) (see square_index)
+        :param by_colour: 'W' for the white player's pieces, 'B' for the black player's pieces
+        :return: True if the square is attacked, False otherwise
+        """
+        return self.is_attacked_by(index, BLACK if by_colour == 'B' else 0)
+
+    def is_attacked_by(self, index, colour_bit):
+        """Checks if a square is attacked by any piece of a colour
+
+        :param index: Square index, 0 (a1) to 63 (h8)
+        :param colour_bit: BLACK for black pieces, or 0 for white pieces
+        :return: True if the square is attacked, False otherwise
+        """
+        squares = self.squares
+        # Pawns attack diagonally forward, so look diagonally backwards from the square
+        attacker = PAWN | colour_bit
+        for attack_index in PAWN_ATTACKS[0 if colour_bit else 1][index]:
+            if squares[attack_index] == attacker:
+                return True
+        attacker = KNIGHT | colour_bit
+        for attack_index in KNIGHT_ATTACKS[index]:
+            if squares[attack_index] == attacker:
+                return True
+        attacker = KING | colour_bit
+        for attack_index in KING_ATTACKS[index]:
+            if squares[attack_index] == attacker:
+                return True
+        # Sliding pieces: the first piece along each ray
+        queen = QUEEN | colour_bit
+        for rays, attacker in ((ROOK_RAYS, ROOK | colour_bit), (BISHOP_RAYS, BISHOP | colour_bit)):
+            for ray in rays[index]:
+                for attack_index in ray:
+                    target = squares[attack_index]
+                    if target != EMPTY:
+                        if target == attacker or target == queen:
+                            return True
+                        break
+        return False
+
+    def in_check(self, colour):
+        """Checks if a player's king is in check
+
+        :param colour: 'W' for white player, 'B' for black player
+        :return: True if in check, False otherwise
+        """
+        own = BLACK if colour == 'B' else 0
+        king_index = self.squares.find(KING | own)
+        return king_index >= 0 and self.is_attacked_by(king_index, own ^ BLACK)
+
+    def has_legal_move(self, colour):
+        """Checks if a player has any legal move
+
+        :param colour: 'W' for white player, 'B' for black player
+        :return: True if there is at least one legal move, False otherwise
+        """
+        for _ in self.generate_moves(colour):
+            return True
+        return False
+
+    def is_checkmate(self, colour):
+        """Checks if a player has been checkmated
+
+        :param colour: 'W' for white player, 'B' for black player
+        :return: True if the player is in check and has no legal move, False otherwise
+        """
+        return self.in_check(colour) and not self.has_legal_move(colour)
+
+    def is_stalemate(self, colour):
+        """Checks if a player is in stalemate
+
+        :param colour: 'W' for white player, 'B' for black player
+        :return: True if the player is not in check but has no legal move, False otherwise
+        """
+        return not self.in_check(colour) and not self.has_legal_move(colour)
 
     def validate_movement(self, piece, from_col, from_row, to_col, to_row):
         """Validates whether a piece can move from one square to another.
@@ -179,85 +996,83 @@ class Board:
         :param to_row: row number of square to move to, 1 to 8
         :return: True if the movement is valid, false otherwise
         """
-        col_diff = abs(ord(from_col) - ord(to_col))
+        return self.validate_movement_index(
+            PIECE_CODES[piece], square_index(from_col, from_row), square_index(to_col, to_row))
+
+    def validate_movement_index(self, piece, from_index, to_index):
+        """Validates whether a piece can move from one square to another, using square indices.
+        See validate_movement.
+
+        :param piece: Piece code
+        :param from_index: index of square of piece to move, 0 to 63
+        :param to_index: index of square to move to, 0 to 63
+        :return: True if the movement is valid, false otherwise
+        """
+        from_col = from_index & 7
+        from_row = from_index >> 3
+        to_col = to_index & 7
+        to_row = to_index >> 3
+        col_diff = abs(from_col - to_col)
         row_diff = abs(from_row - to_row)
 
         # For any piece, it must actually move...
         if col_diff == 0 and row_diff == 0:
             return False
         # ...and there must be empty spaces in between the from/to squares (when on a column, row, or diagonal)
-        if not self.validate_empty_between(from_col, from_row, to_col, to_row):
+        if not self.empty_between_index(from_index, to_index):
             return False
 
-        # White pawn
-        if piece == 'P':
-            if col_diff == 1 and (to_row - from_row == 1):
-                # Can move diagonally up one square, if taking another piece in that square or by en-passant
-                return self.piece_colour(to_col, to_row) == 'B' \
-                       or self.is_en_passant(from_col, from_row, to_col, to_row)
-            elif col_diff != 0:
-                # Otherwise, it can't change columns
-                return False
-            elif from_row == 2:
-                # From initial position, can go up one or two rows (but can't take a piece)
-                return (to_row == 3 or to_row == 4) and self.get_square(to_col, to_row) == ' '
-            else:
-                # Otherwise, can only move up one row (but can't take a piece)
-                return to_row - from_row == 1 and self.get_square(to_col, to_row) == ' '
-        # Black pawn
-        elif piece == 'p':
-            if col_diff == 1 and (from_row - to_row == 1):
-                # Can move diagonally down one square, if taking another piece in that square or by en-passant
-                return self.piece_colour(to_col, to_row) == 'W' \
-                       or self.is_en_passant(from_col, from_row, to_col, to_row)
+        piece_type = piece & 7
+        # Pawns
+        if piece_type == PAWN:
+            # White pawns move up the board, black pawns move down
+            forward = -1 if piece & BLACK else 1
+            start_row = 6 if piece & BLACK else 1
+            if col_diff == 1 and (to_row - from_row == forward):
+                # Can move diagonally forward one square, if taking another piece in that square or by en-passant
+                target = self.squares[to_index]
+                return (target != EMPTY and (target & BLACK) != (piece & BLACK)) \
+                    or self.is_en_passant_index(from_index, to_index)
             elif col_diff != 0:
                 # Otherwise, it can't change columns
                 return False
-            elif from_row == 7:
-                # From initial position, can go down one or two rows (but can't take a piece)
-                return (to_row == 6 or to_row == 5) and self.get_square(to_col, to_row) == ' '
+            elif from_row == start_row:
+                # From initial position, can go forward one or two rows (but can't take a piece)
+                return (to_row - from_row == forward or to_row - from_row == 2 * forward) \
+                    and self.squares[to_index] == EMPTY
             else:
-                # Otherwise, can only move down one row (but can't take a piece)
-                return from_row - to_row == 1 and self.get_square(to_col, to_row) == ' '
+                # Otherwise, can only move forward one row (but can't take a piece)
+                return to_row - from_row == forward and self.squares[to_index] == EMPTY
         # Rook
-        elif piece.lower() == 'r':
+        elif piece_type == ROOK:
             # Must remain in same column or same row
             return col_diff == 0 or row_diff == 0
         # Knight
-        elif piece.lower() == 'n':
+        elif piece_type == KNIGHT:
             # Jumps in a 2+1 pattern
             return (col_diff == 2 and row_diff == 1) or (col_diff == 1 and row_diff == 2)
         # Bishop
-        elif piece.lower() == 'b':
+        elif piece_type == BISHOP:
             # Moves along diagonals
             return col_diff == row_diff
         # Queen
-        elif piece.lower() == 'q':
+        elif piece_type == QUEEN:
             # Can move along columns, rows, or diagonals
             return col_diff == 0 or row_diff == 0 or col_diff == row_diff
         # King
-        elif piece.lower() == 'k':
+        elif piece_type == KING:
             # Can move a single square in any direction
-            if not(0 <= col_diff <= 1) or not(0 <= row_diff <= 1):
+            if col_diff > 1 or row_diff > 1:
                 return False
 
             # But not next to the other king
-            other_king = 'k' if piece.isupper() else 'K'
-            # Get valid border squares
-            border_squares = list(filter(
-                lambda b_square: 'a' <= b_square[0] <= 'f' and 1 <= b_square[1] <= 8,
-                [
-                    (chr(ord(to_col) - 1), to_row - 1), (to_col, to_row - 1), (chr(ord(to_col) + 1), to_row - 1),
-                    (chr(ord(to_col) - 1), to_row),     (to_col, to_row),     (chr(ord(to_col) + 1), to_row),
-                    (chr(ord(to_col) - 1), to_row + 1), (to_col, to_row + 1), (chr(ord(to_col) + 1), to_row + 1)
-                ]
-            ))
-            # Check for the other king
-            for square in border_squares:
-                if self.get_square(square[0], square[1]) == other_king:
+            other_king = piece ^ BLACK
+            for index in KING_ATTACKS[to_index]:
+                if self.squares[index] == other_king:
                     return False
 
             return True
+        return False
 
     def validate_empty_between(self, from_col, from_row, to_col, to_row):
         """Checks if the squares between the from square and to square are empty
@@ -268,32 +1083,26 @@ class Board:
         :param to_row: row number of square to move to, 1 to 8
         :return: Squares between the from and to squares are empty
         """
-        row_diff = from_row - to_row
-        col_diff = ord(from_col) - ord(to_col)
+        return self.empty_between_index(square_index(from_col, from_row), square_index(to_col, to_row))
+
+    def empty_between_index(self, from_index, to_index):
+        """Checks if the squares between the from square and to square are empty, using square indices
+
+        :param from_index: index of square of piece to move, 0 to 63
+        :param to_index: index of square to move to, 0 to 63
+        :return: Squares between the from and to squares are empty
+        """
+        row_diff = (to_index >> 3) - (from_index >> 3)
+        col_diff = (to_index & 7) - (from_index & 7)
         # If not on a column, row, or diagonal, then there are no squares between
         if row_diff != 0 and col_diff != 0 and abs(row_diff) != abs(col_diff):
             return True
-        # Calculate the number of squares to check
-        steps = max(abs(row_diff), abs(col_diff))-1
-        row = from_row
-        col_ord = ord(from_col)
-        for i in range(steps):
-            # Increment/decrement row, if needed
-            if row_diff > 0:
-                # From is bigger than to, so decrement:
-                row = row - 1
-            elif row_diff < 0:
-                # From is smaller than to, so increment:
-                row = row + 1
-            # Increment/decrement row, if needed
-            if col_diff > 0:
-                # From is bigger than to, so decrement:
-                col_ord = col_ord - 1
-            elif col_diff < 0:
-                # From is smaller than to, so increment:
-                col_ord = col_ord + 1
-            # Check the square
-            if self.get_square(chr(col_ord), row) != ' ':
+        # Step one square at a time towards the to square
+        step = (row_diff > 0) - (row_diff < 0)
+        step = step * 8 + (col_diff > 0) - (col_diff < 0)
+        squares = self.squares
+        for index in range(from_index + step, to_index, step):
+            if squares[index] != EMPTY:
                 return False
         return True
 
@@ -306,29 +1115,110 @@ class Board:
         :param to_row: row number of square to move to, 1 to 8
         :return: True if it is en-passant, False if not
         """
-        from_square = self.get_square(from_col, from_row)
-        to_square = self.get_square(to_col, to_row)
-        taking_square = self.get_square(to_col, from_row)
+        return self.is_en_passant_index(square_index(from_col, from_row), square_index(to_col, to_row))
+
+    def is_en_passant_index(self, from_index, to_index):
+        """Checks if a move is an en-passant move, using square indices
+
+        :param from_index: index of square of piece to move, 0 to 63
+        :param to_index: index of square to move to, 0 to 63
+        :return: True if it is en-passant, False if not
+        """
+        squares = self.squares
+        from_square = squares[from_index]
+        taking_square = squares[(from_index & ~7) | (to_index & 7)]
         # Check the to_col is next to the from_col
-        if abs(ord(from_col) - ord(to_col)) != 1:
-            return False
-        # Check the from row is correct (5 for white, 4 for black)
-        elif from_row != (5 if from_square.isupper() else 4):
+        if abs((from_index & 7) - (to_index & 7)) != 1:
             return False
         # Check the from square is a pawn
-        elif from_square.lower() != 'p':
+        elif from_square & 7 != PAWN:
+            return False
+        # Check the from row is correct (5 for white, 4 for black)
+        elif from_index >> 3 != (3 if from_square & BLACK else 4):
             return False
-        # Check the to square is empty
-        elif self.get_square(to_col, to_row) != ' ':
+        # Check the to square is the one skipped by a pawn that just moved two squares
+        elif to_index != self.en_passant or squares[to_index] != EMPTY:
             return False
         # Check the square being taken is a pawn of the opposite colour
-        elif taking_square.lower() != 'p' or taking_square == from_square:
+        elif taking_square & 7 != PAWN or taking_square == from_square:
             return False
         else:
             # It is a valid en-passant move
             return True
 
 
+@lru_cache(maxsize=FEN_CACHE_SIZE)
+def parse_fen(fen):
+    """Parses a position in Forsyth-Edwards Notation (FEN). The most recently used FEN_CACHE_SIZE results are
+    cached, so parsing the same position again is a dictionary lookup.
+
+    Castling rights whose king or rook is not on its initial square are dropped, and the en-passant square is
+    only kept if a pawn can take there (as make_move does), so a position has the same key however it was
+    reached.
+
+    :param fen: FEN string, e.g. INITIAL_FEN. The halfmove clock and move number may be left out.
+    :return: BoardSnapshot of the position, which cannot be changed, so it can be shared
+    :raises ValueError: if the string is not valid FEN
+    """
+    fields = fen.split()
+    if not 4 <= len(fields) <= 6:
+        raise ValueError(f"Invalid FEN {fen!r}: expected 4 to 6 fields")
+    rows = [row.translate(FEN_EMPTY_SQUARES) for row in fields[0].split('/')]
+    text = "".join(reversed(rows)).encode('ascii', errors='replace')
+    if len(rows) != 8 or any(len(row) != 8 for row in rows) or text.translate(None, FEN_SQUARE_CHARS):
+        raise ValueError(f"Invalid FEN {fen!r}: the pieces must be 8 rows of 8 squares")
+    squares = text.translate(CHARS_TO_CODES)
+    if squares.count(KING) != 1 or squares.count(KING | BLACK) != 1:
+        raise ValueError(f"Invalid FEN {fen!r}: each player must have one king")
+    # Pawns on the first or last row could not have got there, and would move off the board
+    end_rows = text[:8] + text[56:]
+    if b'P' in end_rows or b'p' in end_rows:
+        raise ValueError(f"Invalid FEN {fen!r}: there can be no pawns on the first or last row")
+
+    if fields[1] not in ('w', 'b'):
+        raise ValueError(f"Invalid FEN {fen!r}: the player to move must be w or b")
+    turn = fields[1].upper()
+
+    castling = 0
+    if fields[2] != '-':
+        for letter in fields[2]:
+            if letter not in FEN_CASTLING or castling & FEN_CASTLING[letter]:
+                raise ValueError(f"Invalid FEN {fen!r}: the castling rights must be - or some of KQkq")
+            castling |= FEN_CASTLING[letter]
+
+    en_passant = None
+    if fields[3] != '-':
+        skipped_row = '6' if turn == 'W' else '3'
+        if len(fields[3]) != 2 or fields[3][0] not in "abcdefgh" or fields[3][1] != skipped_row:
+            raise ValueError(f"Invalid FEN {fen!r}: the en-passant square must be - or on row {skipped_row}")
+        # The pawn that moved two squares is just past the skipped square, and can be taken by the
+        # player to move's pawns either side of it
+        pawn_index = square_index(fields[3][0], int(skipped_row)) + (-8 if turn == 'W' else 8)
+        taking_pawn = PAWN if turn == 'W' else PAWN | BLACK
+        if squares[pawn_index] == taking_pawn ^ BLACK and \
+                ((pawn_index & 7 > 0 and squares[pawn_index - 1] == taking_pawn)
+                 or (pawn_index & 7 < 7 and squares[pawn_index + 1] == taking_pawn)):
+            en_passant = pawn_index + (8 if turn == 'W' else -8)
+
+    try:
+        halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError(f"Invalid FEN {fen!r}: the halfmove clock and move number must be numbers")
+    if halfmove_clock < 0:
+        raise ValueError(f"Invalid FEN {fen!r}: the halfmove clock must be a non-negative integer")
+    if fullmove_number < 1:
+        raise ValueError(f"Invalid FEN {fen!r}: the move number must be a positive integer")
+
+    board = Board.__new__(Board)
+    board.squares = bytearray(squares)
+    board.size = 8
+    board.last_snapshot = None
+    board.set_position(squares, turn, castling & board.infer_castling(), en_passant, halfmove_clock,
+                       fullmove_number)
+    return board.snapshot()
+
+
 if __name__ == "__main__":
     b = Board()
     b.print()
@@ -0,0 +1,239 @@
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+
+from board import Board
+from pgn import play_san, read_games
+
+# Opening book files are a header followed by fixed-size records sorted by position key then move, so a
+# position's moves can be found by binary search in the memory-mapped file without reading it all.
+BOOK_MAGIC = b"CHSB"
+BOOK_VERSION = 1
+# Header fields: magic, version, and number of records
+BOOK_HEADER = struct.Struct("<4sBxxxQ")
+# Record fields: position key (see Board.key), encoded move, then the number of games in which the move was
+# played that white won, drew, and black won
+BOOK_RECORD = struct.Struct("<QH2xIII")
+# Number of positions into each game that are added to the book
+DEFAULT_MAX_PLIES = 30
+# Number of (position, move) entries kept in memory while building, before they are written to a sorted run
+# file. This bounds the memory used, however large the archives are.
+DEFAULT_RUN_ENTRIES = 1000000
+# Index of the count for each game result, in an entry's counts
+RESULT_INDEX = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}
+
+
+class BookMove:
+    """A move from the opening book, with the results of the games it was played in"""
+
+    def __init__(self, move, white_wins, draws, black_wins):
+        # Encoded move
+        self.move = move
+        self.white_wins = white_wins
+        self.draws = draws
+        self.black_wins = black_wins
+
+    @property
+    def games(self):
+        """Number of games the move was played in"""
+        return self.white_wins + self.draws + self.black_wins
+
+    def score(self, colour):
+        """Gets the fraction of points scored with the move
+
+        :param colour: 'W' or 'B', the player who made the move
+        :return: Score from 0 to 1, counting a draw as half a point
+        """
+        wins = self.white_wins if colour == 'W' else self.black_wins
+        return (wins + self.draws / 2) / self.games if self.games else 0
+
+
+class OpeningBook:
+    """Reads an opening book file, which stays memory-mapped until close is called"""
+
+    def __init__(self, filename):
+        """
+        :param filename: Name of the book file
+        :raises ValueError: if the file is not a book file
+        """
+        self.file = open(filename, mode='rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self.file.close()
+            raise ValueError(f"{filename} is not a book file")
+        magic, version, self.count = BOOK_HEADER.unpack_from(self.map) if len(self.map) >= BOOK_HEADER.size \
+            else (None, None, 0)
+        if magic != BOOK_MAGIC or version != BOOK_VERSION \
+                or len(self.map) != BOOK_HEADER.size + self.count * BOOK_RECORD.size:
+            self.close()
+            raise ValueError(f"{filename} is not a book file")
+
+    def close(self):
+        """Unmaps and closes the file"""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def key_at(self, index):
+        """Gets the position key of a record
+
+        :param index: Record number
+        :return: Position key
+        """
+        return struct.unpack_from("<Q", self.map, BOOK_HEADER.size + index * BOOK_RECORD.size)[0]
+
+    def lookup(self, key):
+        """Finds the book moves for a position, by binary search
+
+        :param key: Position key (see Board.key)
+        :return: List of BookMove, most played first (empty if the position is not in the book)
+        """
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) >> 1
+            if self.key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        for index in range(low, self.count):
+            record_key, move, white_wins, draws, black_wins = \
+                BOOK_RECORD.unpack_from(self.map, BOOK_HEADER.size + index * BOOK_RECORD.size)
+            if record_key != key:
+                break
+            moves.append(BookMove(move, white_wins, draws, black_wins))
+        moves.sort(key=lambda book_move: book_move.games, reverse=True)
+        return moves
+
+
+def game_entries(games, max_plies=DEFAULT_MAX_PLIES):
+    """Gets the (position key, move, result) of the first moves of each game. Games with an unknown result,
+    and moves after an invalid one, are skipped.
+
+    :param games: Iterable of PgnGame
+    :param max_plies: Number of moves into each game to use
+    :return: Generator of (position key, encoded move, result index) tuples
+    """
+    for game in games:
+        result = RESULT_INDEX.get(game.result)
+        if result is None or game.tags.get("SetUp") == "1":
+            continue
+        board = Board()
+        for san in game.moves[:max_plies]:
+            key = board.key
+            try:
+                record = play_san(board, san)
+            except RuntimeError:
+                break
+            yield key, record[0], result
+
+
+def _write_run(entries, filename):
+    """Writes book entries to a run file, sorted by position key then move
+
+    :param entries: Dictionary of (position key, move) to list of [white wins, draws, black wins]
+    :param filename: Name of the run file
+    """
+    with open(filename, mode='wb') as file:
+        file.write(b"".join(BOOK_RECORD.pack(key, move, *counts) for (key, move), counts in sorted(entries.items())))
+
+
+def _read_run(filename):
+    """Reads the records of a run file, a block at a time
+
+    :param filename: Name of the run file
+    :return: Generator of (position key, move, white wins, draws, black wins) tuples
+    """
+    with open(filename, mode='rb') as file:
+        while True:
+            data = file.read(BOOK_RECORD.size * 4096)
+            if not data:
+                break
+            yield from BOOK_RECORD.iter_unpack(data)
+
+
+def build_book(pgn_filenames, book_filename, max_plies=DEFAULT_MAX_PLIES, run_entries=DEFAULT_RUN_ENTRIES):
+    """Builds an opening book from PGN files. Entries are counted in memory until there are run_entries of them,
+    then written to a sorted run file; the run files are then merged into the book. Only one game, one batch of
+    entries, and a block of each run file are in memory at a time.
+
+    :param pgn_filenames: Names of the PGN files
+    :param book_filename: Name of the book file to write
+    :param max_plies: Number of moves into each game to add to the book
+    :param run_entries: Number of entries to count in memory before writing a run file
+    :return: Number of records in the book
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(book_filename))) as run_directory:
+        runs = []
+        entries = {}
+        for pgn_filename in pgn_filenames:
+            with open(pgn_filename, encoding='utf-8', errors='replace') as file:
+                for key, move, result in game_entries(read_games(file), max_plies):
+                    counts = entries.get((key, move))
+                    if counts is None:
+                        counts = entries[(key, move)] = [0, 0, 0]
+                    counts[result] += 1
+                    if len(entries) >= run_entries:
+                        runs.append(os.path.join(run_directory, f"run-{len(runs)}"))
+                        _write_run(entries, runs[-1])
+                        entries = {}
+        runs.append(os.path.join(run_directory, f"run-{len(runs)}"))
+        _write_run(entries, runs[-1])
+        del entries
+
+        # Merge the runs, adding up the counts of records for the same position and move
+        # The book is written to a temporary file that then replaces it in one step, so books already mapped
+        # (e.g. by a game being played) never see a half-written table
+        count = 0
+        temp_filename = book_filename + ".tmp"
+        with open(temp_filename, mode='wb') as book:
+            book.write(BOOK_HEADER.pack(BOOK_MAGIC, BOOK_VERSION, 0))
+            block = []
+            current = None
+            for key, move, white_wins, draws, black_wins in heapq.merge(*(_read_run(run) for run in runs)):
+                if current is not None and current[0] == key and current[1] == move:
+                    current[2] += white_wins
+                    current[3] += draws
+                    current[4] += black_wins
+                    continue
+                if current is not None:
+                    block.append(BOOK_RECORD.pack(*current))
+                    count += 1
+                    if len(block) == 4096:
+                        book.write(b"".join(block))
+                        block = []
+                current = [key, move, white_wins, draws, black_wins]
+            if current is not None:
+                block.append(BOOK_RECORD.pack(*current))
+                count += 1
+            book.write(b"".join(block))
+            book.seek(0)
+            book.write(BOOK_HEADER.pack(BOOK_MAGIC, BOOK_VERSION, count))
+            book.flush()
+            os.fsync(book.fileno())
+        os.replace(temp_filename, book_filename)
+    return count
+
+
+if __name__ == "__main__":
+    # Usage: python book.py <book file> <PGN file> [<PGN file> ...]
+    if len(sys.argv) < 3:
+        print("Usage: python book.py <book file> <PGN file> [<PGN file> ...]")
+    else:
+        start = time.perf_counter()
+        records = build_book(sys.argv[2:], sys.argv[1])
+        print(f"Wrote {records} positions and moves to {sys.argv[1]} in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,484 @@
+import time
+
+from board import EMPTY, PAWN, QUEEN, KING, BLACK, PIECE_CHARS, DRAW, move_name
+
+# Value of each piece type in centipawns, indexed by piece type
+PIECE_VALUES = (0, 100, 320, 330, 500, 900, 20000)
+
+# Piece-square tables, giving a bonus (or penalty) for a white piece on each square. They are laid out as the
+# board is printed, from a8 at the top left to h1 at the bottom right. Black uses the mirror image.
+PAWN_TABLE = (
+    0,   0,   0,   0,   0,   0,   0,   0,
+    50,  50,  50,  50,  50,  50,  50,  50,
+    10,  10,  20,  30,  30,  20,  10,  10,
+    5,   5,  10,  25,  25,  10,   5,   5,
+    0,   0,   0,  20,  20,   0,   0,   0,
+    5,  -5, -10,   0,   0, -10,  -5,   5,
+    5,  10,  10, -20, -20,  10,  10,   5,
+    0,   0,   0,   0,   0,   0,   0,   0)
+KNIGHT_TABLE = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50)
+BISHOP_TABLE = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20)
+ROOK_TABLE = (
+    0,   0,   0,   0,   0,   0,   0,   0,
+    5,  10,  10,  10,  10,  10,  10,   5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    0,   0,   0,   5,   5,   0,   0,   0)
+QUEEN_TABLE = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+    -5,   0,   5,   5,   5,   5,   0,  -5,
+    0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20)
+KING_TABLE = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20,  20,   0,   0,   0,   0,  20,  20,
+    20,  30,  10,   0,   0,  10,  30,  20)
+PIECE_TABLES = (None, PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_TABLE)
+
+# Score (from white's point of view) of each piece code on each square, indexed by (piece code << 6) | square index
+PIECE_SQUARE_SCORES = [0] * (len(PIECE_CHARS) << 6)
+for _piece_type in range(PAWN, KING + 1):
+    for _index in range(64):
+        _row = _index >> 3
+        _col = _index & 7
+        PIECE_SQUARE_SCORES[(_piece_type << 6) | _index] = \
+            PIECE_VALUES[_piece_type] + PIECE_TABLES[_piece_type][(7 - _row) * 8 + _col]
+        PIECE_SQUARE_SCORES[((_piece_type | BLACK) << 6) | _index] = \
+            -PIECE_VALUES[_piece_type] - PIECE_TABLES[_piece_type][_row * 8 + _col]
+
+# Scores above this are checkmates, with the number of plies to mate subtracted
+MATE_SCORE = 100000
+MATE_THRESHOLD = MATE_SCORE - 1000
+INFINITY = MATE_SCORE + 1
+
+# Kinds of score stored in the transposition table
+EXACT = 0
+LOWER_BOUND = 1  # the score is at least this (the search failed high)
+UPPER_BOUND = 2  # the score is at most this (the search failed low)
+
+# Move ordering priorities
+TABLE_MOVE_PRIORITY = 1 << 30
+CAPTURE_PRIORITY = 1 << 28
+KILLER_PRIORITY = 1 << 27
+
+# How many nodes to search between checks of the clock
+CLOCK_CHECK_INTERVAL = 2048
+
+
+def evaluate(board):
+    """Evaluates a position by material and piece-square tables
+
+    :param board: Board to evaluate
+    :return: Score in centipawns, from the point of view of the player to move
+    """
+    scores = PIECE_SQUARE_SCORES
+    score = sum(scores[(code << 6) | index] for index, code in enumerate(board.squares) if code)
+    return -score if board.turn == 'B' else score
+
+
+class SearchResult:
+    """The outcome of a search, with statistics"""
+
+    def __init__(self, move, score, depth, nodes, seconds, pv):
+        # Best move found (encoded), or None if there are no legal moves
+        self.move = move
+        # Score of the best move in centipawns, for the player to move
+        self.score = score
+        # Depth of the last completed iteration
+        self.depth = depth
+        # Number of positions searched (including quiescence search)
+        self.nodes = nodes
+        # Time taken in seconds
+        self.seconds = seconds
+        # Principal variation: the best line of play found, as encoded moves
+        self.pv = pv
+
+    @property
+    def nodes_per_second(self):
+        """Search speed, in nodes per second"""
+        return self.nodes / self.seconds if self.seconds > 0 else 0
+
+    def __str__(self):
+        """Returns a summary of the search
+
+        :return: String with the move, score, and statistics
+        """
+        if abs(self.score) >= MATE_THRESHOLD:
+            plies = MATE_SCORE - abs(self.score)
+            score = f"{'' if self.score > 0 else '-'}mate in {(plies + 1) // 2}"
+        else:
+            score = f"{self.score / 100:+.2f}"
+        move = move_name(self.move) if self.move is not None else "none"
+        return f"{move} (depth {self.depth}, score {score}, {self.nodes} nodes in {self.seconds:.2f}s, " \
+               f"{self.nodes_per_second:.0f} nodes/s, pv {' '.join(move_name(move) for move in self.pv)})"
+
+
+class Engine:
+    """Chooses moves using an alpha-beta search"""
+
+    def __init__(self, table_bits=18, tablebase=None):
+        """
+        :param table_bits: The transposition table has 2 ** table_bits entries
+        :param tablebase: Tablebase to look up positions with few pieces in, or None
+        """
+        # Transposition table entries are tuples of (key, depth, score, kind, move, age), or None
+        self.table = [None] * (1 << table_bits)
+        self.table_mask = (1 << table_bits) - 1
+        # Incremented for each search, so entries from old searches are replaced first
+        self.age = 0
+        # Two quiet moves per ply that recently caused a cutoff
+        self.killers = []
+        # Score for each (from square, to square) of quiet moves that caused cutoffs
+        self.history = [0] * 4096
+        self.nodes = 0
+        self.deadline = None
+        self.stopped = False
+        # Number of times each key occurs in the positions on the current search path (and before it), to find
+        # repetitions without scanning the whole game at every node
+        self.path_keys = {}
+        self.tablebase = tablebase
+
+    def clear(self):
+        """Clears the transposition table and move ordering statistics, e.g. before starting a new game"""
+        self.table = [None] * len(self.table)
+        self.history = [0] * 4096
+        self.age = 0
+
+    def search(self, board, max_depth=None, time_limit=None, previous_keys=(), root_moves=None):
+        """Searches for the best move for the player to move, using iterative deepening until
+        reaching the maximum depth or running out of time. The board is restored afterwards.
+
+        :param board: Board to search
+        :param max_depth: Maximum depth to search, in plies (defaults to 4 if there is no time limit)
+        :param time_limit: Maximum time to search, in seconds, or None for no limit
+        :param previous_keys: Keys of positions reached earlier in the game, so repetitions are avoided
+        :param root_moves: Only search these moves from the root position, or None to search all legal moves
+        :return: SearchResult
+        """
+        if max_depth is None:
+            max_depth = 4 if time_limit is None else 100
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.stopped = False
+        self.nodes = 0
+        self.age += 1
+        self.killers = [[None, None] for _ in range(max_depth + 1)]
+        self.path_keys = {}
+        for key in previous_keys:
+            self.enter_position(key)
+
+        moves = list(board.generate_moves(board.turn))
+        if root_moves is not None:
+            moves = [move for move in moves if move in root_moves]
+        if not moves:
+            score = -MATE_SCORE if board.in_check(board.turn) else 0
+            return SearchResult(None, score, 0, 0, time.perf_counter() - start, [])
+
+        best_move = moves[0]
+        best_score = 0
+        completed_depth = 0
+        for depth in range(1, max_depth + 1):
+            move, score = self.search_root(board, moves, depth, best_move)
+            if self.stopped:
+                break
+            best_move, best_score, completed_depth = move, score, depth
+            # Search the best move first in the next iteration
+            moves.remove(move)
+            moves.insert(0, move)
+            if abs(score) >= MATE_THRESHOLD or (self.deadline is not None and time.perf_counter() > self.deadline):
+                break
+
+        return SearchResult(best_move, best_score, completed_depth, self.nodes, time.perf_counter() - start,
+                            self.principal_variation(board, best_move, completed_depth))
+
+    def search_root(self, board, moves, depth, first_move):
+        """Searches each move from the root position to a given depth
+
+        :param board: Board to search
+        :param moves: Legal moves in the root position
+        :param depth: Depth to search, in plies
+        :param first_move: Move to search first
+        :return: Best move and its score
+        """
+        alpha = -INFINITY
+        best_move = first_move
+        self.enter_position(board.key)
+        for move in moves:
+            record = board.make_move(move)
+            score = -self.negamax(board, depth - 1, -INFINITY, -alpha, 1)
+            board.unmake_move(record)
+            if self.stopped:
+                break
+            if score > alpha:
+                alpha = score
+                best_move = move
+        self.leave_position(board.key)
+        if not self.stopped:
+            self.store(board.key, depth, alpha, EXACT, best_move, 0)
+        return best_move, alpha
+
+    def enter_position(self, key):
+        """Adds a position to the search path
+
+        :param key: Key of the position
+        """
+        self.path_keys[key] = self.path_keys.get(key, 0) + 1
+
+    def leave_position(self, key):
+        """Removes a position from the search path
+
+        :param key: Key of the position
+        """
+        count = self.path_keys[key] - 1
+        if count:
+            self.path_keys[key] = count
+        else:
+            del self.path_keys[key]
+
+    def negamax(self, board, depth, alpha, beta, ply):
+        """Searches a position with alpha-beta pruning
+
+        :param board: Board to search
+        :param depth: Remaining depth, in plies
+        :param alpha: Lower bound of the score the player to move can already get
+        :param beta: Upper bound of the score the opponent will allow
+        :param ply: Number of plies from the root
+        :return: Score for the player to move
+        """
+        if depth <= 0:
+            return self.quiesce(board, alpha, beta)
+        self.count_node()
+        if self.stopped:
+            return 0
+
+        key = board.key
+        # Draw by repetition or the fifty-move rule
+        if board.halfmove_clock >= 100 or key in self.path_keys:
+            return 0
+
+        # Positions in the tablebase have an exact score, from the plies to mate
+        if self.tablebase is not None:
+            result = self.tablebase.probe(board)
+            if result is not None:
+                outcome, plies = result
+                return 0 if outcome == DRAW else (MATE_SCORE - ply - plies) * outcome
+
+        # Use the transposition table to skip the search, or at least to find the best move to try first
+        entry = self.table[key & self.table_mask]
+        table_move = None
+        if entry is not None and entry[0] == key:
+            table_move = entry[4]
+            if entry[1] >= depth:
+                score = entry[2]
+                if score >= MATE_THRESHOLD:
+                    score -= ply
+                elif score <= -MATE_THRESHOLD:
+                    score += ply
+                kind = entry[3]
+                if kind == EXACT or (kind == LOWER_BOUND and score >= beta) \
+                        or (kind == UPPER_BOUND and score <= alpha):
+                    return score
+
+        moves = list(board.generate_moves(board.turn))
+        if not moves:
+            # Checkmate (sooner is better) or stalemate
+            return -MATE_SCORE + ply if board.in_check(board.turn) else 0
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        self.enter_position(key)
+        for move in self.order_moves(board, moves, table_move, ply):
+            record = board.make_move(move)
+            score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move(record)
+            if self.stopped:
+                self.leave_position(key)
+                return 0
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if record[1] == EMPTY and not move >> 12:
+                            self.remember_cutoff(move, depth, ply)
+                        break
+        self.leave_position(key)
+
+        if best_score <= original_alpha:
+            kind = UPPER_BOUND
+        elif best_score >= beta:
+            kind = LOWER_BOUND
+        else:
+            kind = EXACT
+        self.store(key, depth, best_score, kind, best_move, ply)
+        return best_score
+
+    def quiesce(self, board, alpha, beta):
+        """Searches captures and promotions only, until the position is quiet, so that
+        positions are not evaluated in the middle of an exchange of pieces
+
+        :param board: Board to search
+        :param alpha: Lower bound of the score the player to move can already get
+        :param beta: Upper bound of the score the opponent will allow
+        :return: Score for the player to move
+        """
+        self.count_node()
+        if self.stopped:
+            return 0
+        # The player to move can choose not to capture, so the static evaluation is a lower bound
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        squares = board.squares
+        en_passant = board.en_passant
+        captures = [move for move in board.generate_moves(board.turn)
+                    if squares[(move >> 6) & 63] != EMPTY or move >> 12 == QUEEN
+                    or ((move >> 6) & 63 == en_passant and squares[move & 63] & 7 == PAWN)]
+        captures.sort(key=lambda move: PIECE_VALUES[squares[(move >> 6) & 63] & 7] * 16
+                      - PIECE_VALUES[squares[move & 63] & 7] // 100, reverse=True)
+        for move in captures:
+            record = board.make_move(move)
+            score = -self.quiesce(board, -beta, -alpha)
+            board.unmake_move(record)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def count_node(self):
+        """Counts a searched node, and stops the search if it has run out of time"""
+        self.nodes += 1
+        if self.nodes % CLOCK_CHECK_INTERVAL == 0 and self.deadline is not None \
+                and time.perf_counter() > self.deadline:
+            self.stopped = True
+
+    def order_moves(self, board, moves, table_move, ply):
+        """Sorts moves so the ones most likely to be best are searched first: the move from the
+        transposition table, then captures (most valuable victim, least valuable attacker),
+        then killer moves, then other moves by their history score
+
+        :param board: Board the moves are for
+        :param moves: List of encoded moves
+        :param table_move: Best move stored in the transposition table, or None
+        :param ply: Number of plies from the root
+        :return: Sorted list of moves
+        """
+        squares = board.squares
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history
+
+        def priority(move):
+            if move == table_move:
+                return TABLE_MOVE_PRIORITY
+            captured = squares[(move >> 6) & 63]
+            if captured != EMPTY:
+                return CAPTURE_PRIORITY + PIECE_VALUES[captured & 7] * 16 - PIECE_VALUES[squares[move & 63] & 7] // 100
+            if move >> 12 == QUEEN:
+                return CAPTURE_PRIORITY
+            if move in killers:
+                return KILLER_PRIORITY
+            return history[move & 4095]
+
+        return sorted(moves, key=priority, reverse=True)
+
+    def remember_cutoff(self, move, depth, ply):
+        """Records a quiet move that caused a beta cutoff, as a killer move and in the history scores
+
+        :param move: Encoded move
+        :param depth: Remaining depth when the cutoff happened
+        :param ply: Number of plies from the root
+        """
+        if ply < len(self.killers):
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        self.history[move & 4095] += depth * depth
+
+    def store(self, key, depth, score, kind, move, ply):
+        """Stores a search result in the transposition table. An existing entry for a different position is
+        only replaced if it is from an earlier search or was searched less deeply.
+
+        :param key: Key of the position
+        :param depth: Depth searched
+        :param score: Score found
+        :param kind: EXACT, LOWER_BOUND, or UPPER_BOUND
+        :param move: Best move found, or None
+        :param ply: Number of plies from the root (mate scores are stored relative to the position)
+        """
+        index = key & self.table_mask
+        entry = self.table[index]
+        if entry is not None and entry[0] != key and entry[5] == self.age and entry[1] > depth:
+            return
+        if score >= MATE_THRESHOLD:
+            score += ply
+        elif score <= -MATE_THRESHOLD:
+            score -= ply
+        self.table[index] = (key, depth, score, kind, move, self.age)
+
+    def principal_variation(self, board, first_move, max_length):
+        """Follows the best moves stored in the transposition table to find the expected line of play
+
+        :param board: Board at the root position (restored afterwards)
+        :param first_move: Best move at the root
+        :param max_length: Maximum number of moves
+        :return: List of encoded moves
+        """
+        pv = []
+        records = []
+        move = first_move
+        seen = set()
+        while move is not None and len(pv) < max(max_length, 1) and board.key not in seen:
+            if move not in board.generate_moves(board.turn):
+                break
+            seen.add(board.key)
+            pv.append(move)
+            records.append(board.make_move(move))
+            entry = self.table[board.key & self.table_mask]
+            move = entry[4] if entry is not None and entry[0] == board.key else None
+        while records:
+            board.unmake_move(records.pop())
+        return pv
+
+
+if __name__ == "__main__":
+    from board import Board
+    b = Board()
+    engine = Engine()
+    for depth_limit in range(1, 5):
+        print(engine.search(b, max_depth=depth_limit))
+    print(engine.search(b, time_limit=2))
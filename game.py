@@ -1,36 +1,94 @@
-from board import Board
+from board import Board, VALID_MOVE, move_error_message, move_name
+from engine import Engine
 from gamefile import GameFile
 
 
 class Game:
     """Represents a game of chess"""
 
-    def __init__(self, filename, load=False):
+    def __init__(self, filename, load=False, computer=None, think_time=2.0, game_file=None, book=None, fen=None):
+        """
+        :param filename: File to save the game to (or load it from)
+        :param load: True to load the game from the file, False to start a new game
+        :param computer: 'W' or 'B' for the computer to play that side, or None for two human players
+        :param think_time: Time the computer spends choosing each move, in seconds
+        :param game_file: Object to save and load the game with instead of a GameFile for the filename,
+        such as one from GameStore.game_file
+        :param book: OpeningBook to suggest moves from, or None
+        :param fen: Position to start a new game from, in FEN, or None for the initial position
+        :raises ValueError: if the FEN string is not valid
+        """
         # Store the filename for saving/loading
-        self.game_file = GameFile(filename)
-        # Create a board
-        self.board = Board()
-        # White is the first player
-        self.next_player = 'W'
+        self.game_file = game_file or GameFile(filename)
+        # Create a board (white is the first player, unless the FEN says otherwise)
+        self.board = Board.from_fen(fen) if fen and not load else Board()
+        # Keys of the positions reached so far, and how many times each has been reached
+        self.key_history = []
+        self.key_counts = {}
+        # Undo records of the moves made so far (see Board.make_move), for taking back moves
+        self.undo_stack = []
+        # Objects told which squares change with each move or take back, through their
+        # squares_changed(game, squares) method (e.g. render.AnsiRenderer or render.SpectatorChannel)
+        self.listeners = []
+        self.reset_history()
         if load:
             # Load the stored state of the game
             self.game_file.load(self)
         else:
             # Save the initial state to file (overwriting)
             self.game_file.save(self)
+        # Side played by the computer, if any
+        self.computer = computer
+        self.think_time = think_time
+        self.engine = Engine() if computer else None
+        self.book = book
+
+    def close(self):
+        """Closes the game's file"""
+        self.game_file.close()
+
+    def fen(self):
+        """Gets the current position in FEN
 
-    def update_file_with_castle(self, isWhite, isKingside):
-        if isWhite and isKingside:
-            self.game_file.update(self, ["e1", "f1", "g1", "h1"])
-        elif isWhite and isKingside:
-            self.game_file.update(self, ["a1", "c1", "d1", "e1"])
-        elif isKingside:  # for black
-            self.game_file.update(self, ["e8", "f8", "g8", "h8"])
-        else:  # queenside black
-            self.game_file.update(self, ["a8", "c8", "d8", "e8"])
-
-    def play(self):
-        """Plays the game by repeatedly asking for moves"""
+        :return: FEN string
+        """
+        return self.board.to_fen()
+
+    def set_fen(self, fen):
+        """Sets up a position given in FEN, starting the history of moves again from it, and saves it to file
+
+        :param fen: FEN string
+        :raises ValueError: if the FEN string is not valid
+        """
+        self.board = Board.from_fen(fen)
+        self.reset_history()
+        self.game_file.save(self)
+        self.notify_listeners(list(range(64)))
+
+    @property
+    def next_player(self):
+        """The player to move next, 'W' or 'B' (kept by the board)"""
+        return self.board.turn
+
+    @next_player.setter
+    def next_player(self, colour):
+        self.board.set_turn(colour)
+
+    def play(self, renderer=None):
+        """Plays the game by repeatedly asking for moves
+
+        :param renderer: Listener to draw the board with, such as render.AnsiRenderer, which redraws only the
+        squares that change; or None to print the whole board after each move
+        """
+        if renderer is not None:
+            renderer.draw(self.board)
+            self.listeners.append(renderer)
+            try:
+                while self.play_move():
+                    pass
+            finally:
+                self.listeners.remove(renderer)
+            return
         # Show the current state of the board
         print('\n')
         self.board.print()
@@ -43,6 +101,9 @@ class Game:
 
         :return True if gameplay should continue, False otherwise
         """
+        if self.next_player == self.computer:
+            return self.play_computer_move()
+
         # Ask for the next player's move
         player_colour = "White" if self.next_player == "W" else "Black"
         move = input(f"{player_colour} player's move: ").lower()
@@ -51,36 +112,195 @@ class Game:
             print(f"Thanks for playing, goodbye!")
             return False
 
-        elif move == "o-o" or move == "o-o-o":
-            # Try to play a castling move
+        elif move == "undo" or move == "takeback":
+            # Take back the last move
+            if not self.take_back():
+                print(">>> There are no moves to take back")
+            return True
+
+        elif move == "book":
+            # Suggest moves from the opening book
+            self.print_book_moves()
+            return True
+
+        # Try to play the move
+        error = self.apply_move(move)
+        if error:
+            print(f">>> Invalid move: {error}")
+            return True
+
+        # Check if the game is over, or the next player is in check
+        return self.check_game_over()
+
+    def apply_move(self, move):
+        """Plays a move for the next player, given as text, without asking for input or printing anything.
+        Invalid moves are reported with a message, not an exception, so this can be used by servers.
+
+        :param move: Lower case move text: "o-o", "o-o-o", or the from and to squares (see parse_move)
+        :return: Message saying why the move is invalid, or None if it was played
+        """
+        if move == "o-o" or move == "o-o-o":
+            # Castling move
             is_white = self.next_player == "W"
             is_kingside = move == "o-o"
-            try:
-                self.board.castle(is_white, is_kingside)
-                self.toggle_player()
-                self.update_file_with_castle(is_white, is_kingside)
-            except RuntimeError as err:
-                print(">>> Invalid move :(")
-                return True
+            code = self.board.check_castle(is_white, is_kingside)
+            if code != VALID_MOVE:
+                return move_error_message(code, player="White" if is_white else "Black",
+                                          side="kingside" if is_kingside else "queenside")
+            self.record_position(self.board.make_move(self.board.castling_move(is_white, is_kingside)))
+            return None
 
-        else:
-            # Try to play a non-castling move
-            try:
-                from_col, from_row, to_col, to_row = self.parse_move(move)
-                is_en_passant = self.board.is_en_passant(from_col, from_row, to_col, to_row)
-                self.board.move(self.next_player, from_col, from_row, to_col, to_row)
-                self.toggle_player()
-                squares_to_update = [(from_col, from_row), (to_col, to_row)]
-                if is_en_passant:
-                    squares_to_update.append((to_col, from_row))
-                self.game_file.update(self, squares_to_update)
-            except RuntimeError as err:
-                print(f">>> Invalid move: {err}")
-                return True
-
-        # Switch to the other player
+        # Non-castling move
+        try:
+            from_col, from_row, to_col, to_row = self.parse_move(move)
+        except RuntimeError as err:
+            return str(err)
+        code = self.board.check_move(self.next_player, from_col, from_row, to_col, to_row)
+        if code != VALID_MOVE:
+            return move_error_message(code, square=f"{from_col}{from_row}", promotion="Q")
+        self.record_position(self.board.make_move(self.board.encode(from_col, from_row, to_col, to_row)))
+        return None
+
+    def play_computer_move(self):
+        """Lets the computer choose a move, then updates the board (in memory and file).
+
+        :return True if gameplay should continue, False otherwise
+        """
+        player_colour = "White" if self.next_player == "W" else "Black"
+        print(f"{player_colour} player (computer) is thinking...")
+        result = self.engine.search(self.board, time_limit=self.think_time, previous_keys=self.key_history[:-1])
+        print(f"{player_colour} player's move: {move_name(result.move)}")
+        print(f">>> Searched {result}")
+        self.record_position(self.board.make_move(result.move))
+        return self.check_game_over()
+
+    def book_moves(self):
+        """Looks up the current position in the opening book
+
+        :return: List of BookMove, most played first (empty if there is no book, or the position is not in it)
+        """
+        return self.book.lookup(self.board.key) if self.book else []
+
+    def print_book_moves(self):
+        """Prints the opening book's moves for the current position"""
+        book_moves = self.book_moves()
+        if not book_moves:
+            print(">>> No book moves for this position")
+        for book_move in book_moves[:5]:
+            print(f">>> Book move {move_name(book_move.move)}: played in {book_move.games} games, "
+                  f"scoring {book_move.score(self.next_player):.0%}")
+
+    def reset_history(self):
+        """Starts the history of moves and positions from the board's current position"""
+        self.key_history = [self.board.key]
+        self.key_counts = {self.board.key: 1}
+        self.undo_stack = []
+
+    def record_position(self, record, save=True):
+        """Records a move that has been made, and the key of the board's position after it,
+        then saves the move to file
+
+        :param record: Undo record for the move, from the board
+        :param save: True to save the move to file, False if it is already saved (e.g. when loading)
+        """
+        self.undo_stack.append(record)
+        key = self.board.key
+        self.key_history.append(key)
+        self.key_counts[key] = self.key_counts.get(key, 0) + 1
+        if save:
+            self.game_file.record_move(self, record[0])
+        if self.listeners:
+            self.notify_listeners(self.board.changed_squares(record))
+
+    def take_back(self, save=True):
+        """Takes back the last move (in memory and file)
+
+        :param save: True to save the take back to file, False if it is already saved (e.g. when loading)
+        :return: True if a move was taken back, False if there are no moves to take back
+        """
+        if not self.undo_stack:
+            return False
+        key = self.key_history.pop()
+        self.key_counts[key] -= 1
+        record = self.undo_stack.pop()
+        # The changed squares are worked out from the position after the move, so before taking it back
+        changed = self.board.changed_squares(record) if self.listeners else None
+        self.board.unmake_move(record)
+        if save:
+            self.game_file.record_take_back(self)
+        if changed:
+            self.notify_listeners(changed)
         return True
 
+    def notify_listeners(self, squares):
+        """Tells the listeners which squares have changed
+
+        :param squares: Square indices
+        """
+        for listener in self.listeners:
+            listener.squares_changed(self, squares)
+
+    def is_threefold_repetition(self):
+        """Checks if the current position has been reached three times
+
+        :return: True if the game is drawn by repetition, False otherwise
+        """
+        return self.key_counts.get(self.board.key, 0) >= 3
+
+    def is_fifty_move_draw(self):
+        """Checks if fifty moves by each player have been made without a capture or pawn move
+
+        :return: True if the game is drawn by the fifty-move rule, False otherwise
+        """
+        return self.board.halfmove_clock >= 100
+
+    def status(self):
+        """Works out whether the game is over, or the next player is in check
+
+        :return: "checkmate", "stalemate", "repetition", "fifty moves", "check", or "" if none of these
+        """
+        if self.board.has_legal_move(self.next_player):
+            if self.is_threefold_repetition():
+                return "repetition"
+            if self.is_fifty_move_draw():
+                return "fifty moves"
+            return "check" if self.board.in_check(self.next_player) else ""
+        # No legal moves, so the game is over
+        return "checkmate" if self.board.in_check(self.next_player) else "stalemate"
+
+    def check_game_over(self):
+        """Announces check, checkmate, stalemate, or a draw for the next player
+
+        :return: True if gameplay should continue, False if the game is over
+        """
+        status = self.status()
+        if status == "check":
+            print(f">>> {self.status_message(status)}")
+        if status in ("", "check"):
+            return True
+        self.board.print()
+        print(f">>> {self.status_message(status)}")
+        return False
+
+    def status_message(self, status):
+        """Describes a status from the status method to the players
+
+        :param status: Status string, e.g. "checkmate"
+        :return: Message, or "" if there is nothing to announce
+        """
+        if status == "check":
+            return "Check!"
+        if status == "repetition":
+            return "The same position has been reached three times. The game is a draw"
+        if status == "fifty moves":
+            return "Fifty moves without a capture or pawn move. The game is a draw"
+        if status == "checkmate":
+            winner = "Black" if self.next_player == "W" else "White"
+            return f"Checkmate! {winner} player wins"
+        if status == "stalemate":
+            return "Stalemate! The game is a draw"
+        return ""
+
     def toggle_player(self):
         """Toggles the next player between black and white"""
         self.next_player = "B" if self.next_player == "W" else "W"
@@ -117,6 +337,7 @@ class Game:
 
 
 if __name__ == "__main__":
-    game = Game("testgame.txt")
-    # game = Game("testgame.txt", True)
+    game = Game("testgame.dat")
+    # game = Game("testgame.dat", True)
     game.play()
+    game.close()
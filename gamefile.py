@@ -1,66 +1,503 @@
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from board import Board, CHARS_TO_CODES, PIECE_CODES
+
+# Game files are binary, with two snapshot slots. Each slot has an 18 byte header followed by the piece code of
+# each of the 64 squares (from a1 along each row to h8). Snapshots are written to the older slot, so a crash
+# while writing one leaves the other intact.
+MAGIC = b"CHES"
+VERSION = 1
+# Slot header fields: magic, version, next player ('W' or 'B'), castling rights, en-passant square,
+# halfmove clock, fullmove number, sequence number of the last journal record included, and a checksum of the
+# rest of the slot
+HEADER = struct.Struct("<4sBcBBHHIH")
+SQUARES_OFFSET = HEADER.size
+SLOT_SIZE = SQUARES_OFFSET + 64
+FILE_SIZE = 2 * SLOT_SIZE
+# En-passant square value when there is none
+NO_EN_PASSANT = 255
+# Size of the old text format: the next player, then a letter for each square
+TEXT_SIZE = 65
+
+# Moves since the last snapshot are appended to a journal file (the game file's name plus JOURNAL_SUFFIX), as
+# fixed-size records of: sequence number, kind of record, encoded move, and a checksum of the rest of the record
+JOURNAL_SUFFIX = ".log"
+JOURNAL_RECORD = struct.Struct("<IBxHI")
+JOURNAL_MOVE = 1
+JOURNAL_TAKE_BACK = 2
+
+# Default seconds between fsyncs of the journal (moves made in between share an fsync)
+DEFAULT_SYNC_INTERVAL = 0.1
+# Default number of journal records before a new snapshot is written and the journal emptied
+DEFAULT_COMPACT_INTERVAL = 200
+
+
+def read_text_file(filename):
+    """Reads a game from the old text format (the next player, then 64 characters for the squares)
+
+    :param filename: Name of the text file
+    :return: Board with the game's position (castling rights are inferred from the position)
+    :raises ValueError: if the file is not in the text format
+    """
+    with open(filename, mode='rb') as file:
+        text = file.read()
+    if len(text) != TEXT_SIZE or text[:1] not in (b'W', b'B') \
+            or any(chr(char) not in PIECE_CODES for char in text[1:]):
+        raise ValueError(f"{filename} is not a text game file")
+    board = Board()
+    board.set_position(text[1:].translate(CHARS_TO_CODES), text[:1].decode('ascii'))
+    board.castling = board.infer_castling()
+    board.key = board.compute_key()
+    return board
+
+
+def pack_board(board, sequence=0):
+    """Packs a board into a snapshot slot
+
+    :param board: Board (or BoardSnapshot) to pack
+    :param sequence: Sequence number of the last journal record included in the snapshot
+    :return: Bytes of the slot
+    """
+    fields = [MAGIC, VERSION, board.turn.encode('ascii'), board.castling,
+              NO_EN_PASSANT if board.en_passant is None else board.en_passant,
+              min(board.halfmove_clock, 0xFFFF), min(board.fullmove_number, 0xFFFF), sequence, 0]
+    # The checksum covers the slot with the checksum field set to 0
+    fields[-1] = zlib.crc32(board.squares, zlib.crc32(HEADER.pack(*fields))) & 0xFFFF
+    return HEADER.pack(*fields) + bytes(board.squares)
+
+
+def unpack_slot(data):
+    """Unpacks a snapshot slot
+
+    :param data: Bytes of the slot
+    :return: Tuple of (sequence number, squares, next player, castling rights, en-passant square,
+    halfmove clock, fullmove number), or None if the slot is empty or damaged
+    """
+    magic, version, next_player, castling, en_passant, halfmove_clock, fullmove_number, sequence, checksum = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or next_player not in (b'W', b'B') or fullmove_number < 1:
+        return None
+    squares = bytes(data[SQUARES_OFFSET:SLOT_SIZE])
+    header = HEADER.pack(magic, version, next_player, castling, en_passant, halfmove_clock, fullmove_number,
+                         sequence, 0)
+    if zlib.crc32(squares, zlib.crc32(header)) & 0xFFFF != checksum:
+        return None
+    return (sequence, squares, next_player.decode('ascii'), castling,
+            None if en_passant == NO_EN_PASSANT else en_passant, halfmove_clock, fullmove_number)
+
+
+def check_game_file(data, filename):
+    """Checks that a file is a binary game file, before anything is written to it
+
+    :param data: Bytes of the file
+    :param filename: Name of the file, for the error message
+    :raises ValueError: if the file has the wrong size, or no snapshot slot starts with the magic number
+    and version
+    """
+    if len(data) != FILE_SIZE or not any(data[offset:offset + len(MAGIC)] == MAGIC and
+                                         data[offset + len(MAGIC)] == VERSION for offset in (0, SLOT_SIZE)):
+        raise ValueError(f"{filename} is not a game file")
+
+
+def pack_journal_record(sequence, kind, move=0):
+    """Packs a journal record
+
+    :param sequence: Sequence number of the record
+    :param kind: JOURNAL_MOVE or JOURNAL_TAKE_BACK
+    :param move: Encoded move, for JOURNAL_MOVE
+    :return: Bytes of the record
+    """
+    checksum = zlib.crc32(JOURNAL_RECORD.pack(sequence, kind, move, 0))
+    return JOURNAL_RECORD.pack(sequence, kind, move, checksum)
+
+
+def parse_journal(data, snapshot_sequence):
+    """Finds the journal records that follow a snapshot
+
+    :param data: Bytes of the journal
+    :param snapshot_sequence: Sequence number of the last record included in the snapshot
+    :return: Tuple of the list of (sequence number, kind, move) records after the snapshot, in order, and the
+    number of bytes at the start of the journal that are valid (any after that are damaged or partly written)
+    """
+    records = []
+    valid_size = 0
+    last_sequence = snapshot_sequence
+    for offset in range(0, len(data) - JOURNAL_RECORD.size + 1, JOURNAL_RECORD.size):
+        sequence, kind, move, checksum = JOURNAL_RECORD.unpack_from(data, offset)
+        if zlib.crc32(JOURNAL_RECORD.pack(sequence, kind, move, 0)) != checksum:
+            break
+        valid_size = offset + JOURNAL_RECORD.size
+        if sequence <= snapshot_sequence:
+            # Already included in the snapshot
+            continue
+        if sequence != last_sequence + 1:
+            break
+        last_sequence = sequence
+        records.append((sequence, kind, move))
+    return records, valid_size
+
+
+def read_game_file(filename):
+    """Reads a game file (binary or text) and its journal without changing either of them, e.g. for auditing
+
+    :param filename: Name of the game file
+    :return: Tuple of a Board with the latest snapshot's position, the list of (sequence number, kind, move)
+    journal records after it, and the number of damaged or partly written bytes at the end of the journal
+    :raises IOError: if the game file cannot be read
+    :raises ValueError: if the file is not a game file
+    """
+    with open(filename, mode='rb') as file:
+        data = file.read(FILE_SIZE + 1)
+    if len(data) == TEXT_SIZE:
+        return read_text_file(filename), [], 0
+    check_game_file(data, filename)
+    slots = [slot for slot in (unpack_slot(data[:SLOT_SIZE]), unpack_slot(data[SLOT_SIZE:])) if slot is not None]
+    if not slots:
+        raise ValueError(f"{filename} has no valid snapshot")
+    snapshot_sequence, squares, next_player, castling, en_passant, halfmove_clock, fullmove_number = \
+        max(slots, key=lambda slot: slot[0])
+    board = Board()
+    board.set_position(squares, next_player, castling, en_passant, halfmove_clock, fullmove_number)
+    try:
+        with open(filename + JOURNAL_SUFFIX, mode='rb') as journal:
+            journal_data = journal.read()
+    except FileNotFoundError:
+        journal_data = b""
+    records, valid_size = parse_journal(journal_data, snapshot_sequence)
+    return board, records, len(journal_data) - valid_size
+
+
+def convert_text_file(text_filename, binary_filename=None):
+    """Converts a game file from the old text format to the binary format
+
+    :param text_filename: Name of the text file
+    :param binary_filename: Name of the binary file to create (defaults to replacing the text file)
+    """
+    board = read_text_file(text_filename)
+    binary_filename = binary_filename or text_filename
+    # Written to a temporary file that then replaces the binary file in one step, so a crash or a full disk
+    # cannot leave the game (or the text file it replaces) half written
+    with open(binary_filename + ".tmp", mode='wb') as file:
+        file.write(pack_board(board))
+        file.write(bytes(SLOT_SIZE))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(binary_filename + ".tmp", binary_filename)
+
+
+class GroupCommitter:
+    """Background thread that periodically fsyncs the journals of game files with unsynced records,
+    so that the moves made by many games in each interval share the cost of syncing"""
+
+    def __init__(self, interval):
+        """
+        :param interval: Seconds between syncs
+        """
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.thread = threading.Thread(target=self.run, name="journal-sync", daemon=True)
+        self.thread.start()
+
+    def add(self, game_file):
+        """Adds a game file to be synced at the end of the current interval
+
+        :param game_file: GameFile with unsynced journal records
+        """
+        with self.lock:
+            self.pending.add(game_file)
+
+    def discard(self, game_file):
+        """Stops a game file being synced (e.g. because it has been closed)
+
+        :param game_file: GameFile to remove
+        """
+        with self.lock:
+            self.pending.discard(game_file)
+
+    def run(self):
+        """Syncs the pending game files, once per interval"""
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                pending = self.pending
+                self.pending = set()
+            for game_file in pending:
+                game_file.sync()
+
+
+# Group committers, by sync interval
+_committers = {}
+_committers_lock = threading.Lock()
+
+
+def group_committer(interval):
+    """Gets the shared group committer for a sync interval, starting it if needed
+
+    :param interval: Seconds between syncs
+    :return: GroupCommitter
+    """
+    with _committers_lock:
+        if interval not in _committers:
+            _committers[interval] = GroupCommitter(interval)
+        return _committers[interval]
+
+
 class GameFile:
-    """Handles file operations for loading and saving chess games"""
+    """Handles file operations for loading and saving chess games.
+
+    The game file holds a snapshot of the position, and each move since the snapshot is appended to a journal.
+    Loading replays the journal from the snapshot. Every compact_interval records, a new snapshot is written and
+    the journal is emptied. The files stay open (the game file memory-mapped) until close is called."""
 
-    def __init__(self, filename):
+    def __init__(self, filename, sync_interval=DEFAULT_SYNC_INTERVAL, compact_interval=DEFAULT_COMPACT_INTERVAL):
+        """
+        :param filename: Name of the game file
+        :param sync_interval: Seconds between fsyncs of the journal, or 0 to fsync after every move
+        :param compact_interval: Number of journal records before a new snapshot is written
+        """
         self.filename = filename
+        self.journal_filename = filename + JOURNAL_SUFFIX
+        self.sync_interval = sync_interval
+        self.compact_interval = compact_interval
+        self.file = None
+        self.map = None
+        self.journal = None
+        # Sequence number of the last journal record written, and of the last one in a snapshot
+        self.sequence = 0
+        self.snapshot_sequence = 0
+        # Slot holding the latest snapshot
+        self.slot = 0
+        # Number of moves in the journal that have not been taken back
+        self.journal_moves = 0
+        self.lock = threading.Lock()
+        self.unsynced = False
+
+    def open(self, create):
+        """Opens the game file and journal, and maps the game file into memory, if not already open.
+        Files in the old text format are converted. Nothing is written (and no journal is created) unless the
+        file is found to be a game file.
+
+        :param create: True to create the files (or empty them, if they already exist)
+        :raises ValueError: if the file is not a game file
+        """
+        if self.map is not None:
+            return
+        if create:
+            self.file = open(self.filename, mode='w+b')
+            self.file.truncate(FILE_SIZE)
+            self.journal = open(self.journal_filename, mode='w+b')
+        else:
+            with open(self.filename, mode='rb') as file:
+                data = file.read(FILE_SIZE + 1)
+            if len(data) == TEXT_SIZE:
+                # Raises ValueError, leaving the file alone, if it is not in the text format
+                convert_text_file(self.filename)
+            else:
+                check_game_file(data, self.filename)
+            self.file = open(self.filename, mode='r+b')
+            self.journal = open(self.journal_filename, mode='a+b')
+        self.map = mmap.mmap(self.file.fileno(), FILE_SIZE)
+
+    def close(self):
+        """Syncs the journal to disk, and closes the files"""
+        if self.map is None:
+            return
+        if self.sync_interval:
+            group_committer(self.sync_interval).discard(self)
+        self.sync()
+        with self.lock:
+            self.map.close()
+            self.map = None
+            self.file.close()
+            self.file = None
+            self.journal.close()
+            self.journal = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def load(self, game):
-        """Loads the state of the game from file"
+        """Loads the state of the game from file: the latest snapshot, then the moves in the journal after it
 
         :param game: Game instance to load data into
         """
         try:
-            with open(self.filename, mode='r') as file:
-                # First char in the file is the next player
-                game.next_player = file.read(1)
-                # Each square of each row of the board are the next 64 characters
-                for i in range(game.board.size ** 2):
-                    square_index = i % game.board.size
-                    square_col = chr(square_index + 97)  # chr(97) is 'a'
-                    square_row = (i // game.board.size) + 1
-                    square_value = file.read(1)
-                    game.board.set_square(square_col, square_row, square_value)
-
-        except IOError as err:
+            self.read(game)
+        except (IOError, ValueError) as err:
             print(f"Error loading file: {err}")
 
+    def read(self, game):
+        """Loads the state of the game from file, like load, but raises an exception if it fails
+
+        :param game: Game instance to load data into
+        :raises IOError: if the file cannot be read
+        :raises ValueError: if the file is not a game file
+        """
+        self.open(create=False)
+        slots = [unpack_slot(self.map[slot * SLOT_SIZE:(slot + 1) * SLOT_SIZE]) for slot in (0, 1)]
+        if slots[0] is None and slots[1] is None:
+            raise ValueError(f"{self.filename} is not a game file")
+        self.slot = 1 if slots[0] is None or (slots[1] is not None and slots[1][0] > slots[0][0]) else 0
+        self.snapshot_sequence, squares, next_player, castling, en_passant, halfmove_clock, fullmove_number = \
+            slots[self.slot]
+        game.board.set_position(squares, next_player, castling, en_passant, halfmove_clock, fullmove_number)
+        game.reset_history()
+        self.sequence = self.snapshot_sequence
+        self.replay_journal(game)
+
+    def replay_journal(self, game):
+        """Replays the journal records after the snapshot. Any damaged or partly written records at
+        the end of the journal (e.g. from a crash) are removed.
+
+        :param game: Game instance to replay the moves in
+        """
+        self.journal.seek(0)
+        data = self.journal.read()
+        records, valid_size = parse_journal(data, self.snapshot_sequence)
+        for sequence, kind, move in records:
+            self.sequence = sequence
+            if kind == JOURNAL_MOVE:
+                game.record_position(game.board.make_move(move), save=False)
+                self.journal_moves += 1
+            elif kind == JOURNAL_TAKE_BACK:
+                game.take_back(save=False)
+                self.journal_moves -= 1
+        if valid_size < len(data):
+            self.journal.truncate(valid_size)
+
     def save(self, game):
-        """Saves the current state of the game to file
+        """Saves the current state of the game to file, as a new snapshot
 
         :param game: Game instance to be saved"""
         try:
-            with open(self.filename, mode='w+') as file:
-                # First char in the file is the next player
-                file.write(game.next_player)
-                # Then the board as a string of 64 characters
-                file.write(str(game.board))
+            if self.map is None:
+                self.open(create=True)
+            self.write_snapshot(game.board)
 
-        except IOError as err:
+        except (IOError, ValueError) as err:
             print(f"Error saving file: {err}")
 
-    def update(self, game, squares):
-        """Saves the game's next player and state of specified squares to file using random-access.
+    def write_snapshot(self, board):
+        """Writes the board to the older snapshot slot and syncs it, then empties the journal
 
-        :param game: Game instance to be saved
-        :param squares: List of squares, where each square has the column letter at index 0 and
-        the row number at index 1. These may be strings like "a8" or tuples like ("h", 1).
+        :param board: Board to save
+        """
+        with self.lock:
+            # Each snapshot has its own sequence number, so the latest slot can always be told apart
+            self.sequence += 1
+            slot = 1 - self.slot
+            self.map[slot * SLOT_SIZE:(slot + 1) * SLOT_SIZE] = pack_board(board, self.sequence)
+            self.map.flush()
+            self.slot = slot
+            self.snapshot_sequence = self.sequence
+            self.journal_moves = 0
+            # The journal records are all in the snapshot now
+            self.journal.seek(0)
+            self.journal.truncate()
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.unsynced = False
+
+    def record_move(self, game, move):
+        """Appends a move to the journal
+
+        :param game: Game instance the move was made in
+        :param move: Encoded move
+        """
+        self.append(game, JOURNAL_MOVE, move)
+
+    def record_take_back(self, game):
+        """Appends the taking back of a move to the journal. If the move was made before the
+        latest snapshot, a new snapshot is written instead.
+
+        :param game: Game instance the move was taken back in
+        """
+        if self.journal_moves > 0:
+            self.append(game, JOURNAL_TAKE_BACK)
+        else:
+            self.save(game)
+
+    def append(self, game, kind, move=0):
+        """Appends a record to the journal. The journal is synced to disk after every record, or by the
+        group committer at the end of the sync interval. A new snapshot is written every compact_interval records.
+
+        :param game: Game instance the record is for
+        :param kind: JOURNAL_MOVE or JOURNAL_TAKE_BACK
+        :param move: Encoded move, for JOURNAL_MOVE
         """
         try:
-            with open(self.filename, mode='r+') as file:
-                # Update the next player
-                file.seek(0)
-                file.write(game.next_player)
-                # Update for each square
-                for square in squares:
-                    col = square[0]
-                    col_index = ord(col.lower()) - 97  # ord('a') is 97
-                    row = square[1]
-                    row_index = int(row) - 1
-                    offset = row_index * 8 + col_index + 1
-                    value = game.board.get_square(col, int(row))
-                    file.seek(offset)
-                    file.write(value)
-        except IOError as err:
-            print(f"Error saving file with  random-access: {err}")
+            if self.map is None:
+                self.open(create=False)
+            with self.lock:
+                self.sequence += 1
+                self.journal.write(pack_journal_record(self.sequence, kind, move))
+                self.journal_moves += 1 if kind == JOURNAL_MOVE else -1
+                self.unsynced = True
+            if self.sequence - self.snapshot_sequence >= self.compact_interval:
+                self.write_snapshot(game.board)
+            elif self.sync_interval:
+                group_committer(self.sync_interval).add(self)
+            else:
+                self.sync()
+        except (IOError, ValueError) as err:
+            print(f"Error saving move to journal: {err}")
             # Save the entire state instead
             self.save(game)
+
+    def sync(self):
+        """Writes any journal records not yet synced to disk"""
+        with self.lock:
+            if self.unsynced and self.journal is not None:
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+                self.unsynced = False
+
+    def update(self, game):
+        """Saves the game's state to file, for callers that have changed squares directly. The whole position
+        is written as a new snapshot: the journal's moves follow the latest snapshot, so it cannot be changed in
+        place, and writing the older slot means a crash cannot leave a half-updated board.
+
+        :param game: Game instance to be saved
+        """
+        self.save(game)
+
+
+class NullGameFile:
+    """Has the same methods as GameFile, but saves nothing, for games that are not kept (e.g. scripted replays
+    and benchmarks)"""
+
+    def load(self, game):
+        """Leaves the game in its initial position, as there is nothing to load"""
+
+    def save(self, game):
+        """Does nothing"""
+
+    def record_move(self, game, move):
+        """Does nothing"""
+
+    def record_take_back(self, game):
+        """Does nothing"""
+
+    def update(self, game):
+        """Does nothing"""
+
+    def close(self):
+        """Does nothing"""
+
+
+if __name__ == "__main__":
+    # Usage: python gamefile.py <text game file> [<binary game file>]
+    if len(sys.argv) < 2:
+        print("Usage: python gamefile.py <text game file> [<binary game file>]")
+    else:
+        convert_text_file(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,431 @@
+import fcntl
+import mmap
+import os
+import struct
+import zlib
+
+from board import Board
+from gamefile import SLOT_SIZE, pack_board, unpack_slot
+
+# A game store keeps many games in a directory of shard files, instead of one file per game. Each game id belongs
+# to one shard. A shard has a data file of fixed-size game slots and an index file mapping game ids to slots.
+#
+# The data file has a header, then a slot for each game: the game id (UTF-8, padded with zeros) and two
+# snapshots of the game (in the game file's snapshot format), written alternately so a crash while writing
+# one leaves the other intact.
+DATA_MAGIC = b"CHSD"
+INDEX_MAGIC = b"CHSI"
+VERSION = 1
+# Header fields: magic, version, number of slots used (data file) or index capacity (index file)
+FILE_HEADER = struct.Struct("<4sBxxxI4x")
+MAX_ID_LENGTH = 32
+GAME_SLOT_SIZE = MAX_ID_LENGTH + 2 * SLOT_SIZE
+# The index file is an open-addressing hash table of entries of (hash of game id, slot number).
+# A hash of 0 marks an empty entry.
+INDEX_ENTRY = struct.Struct("<QI")
+INITIAL_INDEX_CAPACITY = 1024
+# The index is rebuilt with double the capacity when it is fuller than this
+MAX_INDEX_LOAD = 0.7
+
+
+def id_hash(game_id):
+    """Hashes a game id for the index
+
+    :param game_id: Game id as bytes
+    :return: Non-zero 64-bit hash
+    """
+    return (zlib.crc32(game_id) << 32 | zlib.adler32(game_id)) or 1
+
+
+class Shard:
+    """One shard of a game store: a data file of game slots and its index.
+    Any number of processes can read a shard, but only one can write to it at a time."""
+
+    def __init__(self, path):
+        """
+        :param path: Path of the shard's files, without the extension
+        """
+        self.data_filename = path + ".games"
+        self.index_filename = path + ".index"
+        self.lock_filename = path + ".lock"
+        self.data_fd = None
+        self.index_map = None
+        self.index_inode = None
+        self.capacity = 0
+        self.lock_file = None
+
+    def open(self, write):
+        """Opens the shard's files, creating them if needed
+
+        :param write: True to open for writing, which waits for any other writer to finish with the shard
+        """
+        if write and self.lock_file is None:
+            self.lock_file = open(self.lock_filename, mode='a+b')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            if self.data_fd is not None:
+                # Re-open for writing
+                self.close_files()
+        if self.data_fd is not None:
+            return
+        if not os.path.exists(self.data_filename):
+            if not write:
+                return
+            with open(self.data_filename, mode='wb') as file:
+                file.write(FILE_HEADER.pack(DATA_MAGIC, VERSION, 0))
+            self.write_index_file(self.index_filename, INITIAL_INDEX_CAPACITY, ())
+        self.data_fd = os.open(self.data_filename, os.O_RDWR if write else os.O_RDONLY)
+        self.map_index()
+
+    def map_index(self):
+        """Maps the index file into memory (again, if it has been rebuilt by a writer)"""
+        if self.index_map is not None:
+            self.index_map.close()
+        with open(self.index_filename, mode='r+b' if self.lock_file else 'rb') as file:
+            self.index_inode = os.fstat(file.fileno()).st_ino
+            self.index_map = mmap.mmap(file.fileno(), 0,
+                                       access=mmap.ACCESS_WRITE if self.lock_file else mmap.ACCESS_READ)
+        magic, version, self.capacity = FILE_HEADER.unpack_from(self.index_map)
+        if magic != INDEX_MAGIC or version != VERSION:
+            raise ValueError(f"{self.index_filename} is not a game store index")
+
+    def close_files(self):
+        """Closes the shard's data and index files"""
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
+        if self.data_fd is not None:
+            os.close(self.data_fd)
+            self.data_fd = None
+
+    def close(self):
+        """Closes the shard, letting another process write to it"""
+        if self.data_fd is not None and self.lock_file is not None:
+            os.fsync(self.data_fd)
+        self.close_files()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def slot_count(self):
+        """Gets the number of slots used in the data file
+
+        :return: Number of slots
+        """
+        return FILE_HEADER.unpack(os.pread(self.data_fd, FILE_HEADER.size, 0))[2]
+
+    def find_slot(self, game_id):
+        """Finds the slot for a game
+
+        :param game_id: Game id as bytes
+        :return: Slot number, or None if the game is not in the shard
+        """
+        slot = self.probe(game_id)[1]
+        if slot is None and os.stat(self.index_filename).st_ino != self.index_inode:
+            # The index has been rebuilt by a writer since it was mapped
+            self.map_index()
+            slot = self.probe(game_id)[1]
+        return slot
+
+    def probe(self, game_id):
+        """Looks up a game id in the index
+
+        :param game_id: Game id as bytes
+        :return: Tuple of the index entry number for the game (or the empty entry where it would go),
+        and the game's slot number (or None)
+        """
+        target = id_hash(game_id)
+        index_map = self.index_map
+        mask = self.capacity - 1
+        entry = target & mask
+        while True:
+            entry_hash, slot = INDEX_ENTRY.unpack_from(index_map, FILE_HEADER.size + entry * INDEX_ENTRY.size)
+            if entry_hash == 0:
+                return entry, None
+            if entry_hash == target and self.read_id(slot) == game_id:
+                return entry, slot
+            entry = (entry + 1) & mask
+
+    def read_id(self, slot):
+        """Reads the game id stored in a slot
+
+        :param slot: Slot number
+        :return: Game id as bytes
+        """
+        return os.pread(self.data_fd, MAX_ID_LENGTH, FILE_HEADER.size + slot * GAME_SLOT_SIZE).rstrip(b"\0")
+
+    def load(self, game_id, board):
+        """Loads a game's latest snapshot into a board
+
+        :param game_id: Game id as bytes
+        :param board: Board to load the position into
+        :return: True if the game was found, False otherwise
+        """
+        if self.data_fd is None:
+            return False
+        slot = self.find_slot(game_id)
+        if slot is None:
+            return False
+        snapshot = self.read_snapshot(slot)
+        if snapshot is None:
+            return False
+        _, squares, next_player, castling, en_passant, halfmove_clock, fullmove_number = snapshot
+        board.set_position(squares, next_player, castling, en_passant, halfmove_clock, fullmove_number)
+        return True
+
+    def read_snapshot(self, slot):
+        """Reads the latest valid snapshot in a slot
+
+        :param slot: Slot number
+        :return: Unpacked snapshot (see gamefile.unpack_slot), or None if neither snapshot is valid
+        """
+        data = os.pread(self.data_fd, GAME_SLOT_SIZE, FILE_HEADER.size + slot * GAME_SLOT_SIZE)
+        snapshots = [snapshot for snapshot in (unpack_slot(data[MAX_ID_LENGTH:MAX_ID_LENGTH + SLOT_SIZE]),
+                                               unpack_slot(data[MAX_ID_LENGTH + SLOT_SIZE:]))
+                     if snapshot is not None]
+        return max(snapshots, key=lambda snapshot: snapshot[0]) if snapshots else None
+
+    def save(self, game_id, board):
+        """Saves a board as a game's latest snapshot, adding the game to the shard if needed.
+        The shard must be open for writing.
+
+        :param game_id: Game id as bytes
+        :param board: Board (or BoardSnapshot) to save
+        """
+        entry, slot = self.probe(game_id)
+        if slot is None:
+            # Add a new slot at the end of the data file, then add it to the index
+            slot = self.slot_count()
+            os.pwrite(self.data_fd, game_id.ljust(GAME_SLOT_SIZE, b"\0"), FILE_HEADER.size + slot * GAME_SLOT_SIZE)
+            os.pwrite(self.data_fd, FILE_HEADER.pack(DATA_MAGIC, VERSION, slot + 1), 0)
+            self.add_to_index(entry, game_id, slot)
+            sequence, older = 1, 0
+        else:
+            data = os.pread(self.data_fd, 2 * SLOT_SIZE, FILE_HEADER.size + slot * GAME_SLOT_SIZE + MAX_ID_LENGTH)
+            sequences = [snapshot[0] if snapshot is not None else -1
+                         for snapshot in (unpack_slot(data[:SLOT_SIZE]), unpack_slot(data[SLOT_SIZE:]))]
+            sequence = max(sequences) + 1
+            older = 0 if sequences[0] <= sequences[1] else 1
+        os.pwrite(self.data_fd, pack_board(board, sequence),
+                  FILE_HEADER.size + slot * GAME_SLOT_SIZE + MAX_ID_LENGTH + older * SLOT_SIZE)
+
+    def add_to_index(self, entry, game_id, slot):
+        """Adds a game to the index, rebuilding the index with more capacity if it is getting full
+
+        :param entry: Empty index entry number to use
+        :param game_id: Game id as bytes
+        :param slot: Slot number of the game
+        """
+        INDEX_ENTRY.pack_into(self.index_map, FILE_HEADER.size + entry * INDEX_ENTRY.size, id_hash(game_id), slot)
+        if slot + 1 > self.capacity * MAX_INDEX_LOAD:
+            # Build a bigger index from the ids in the data file, then swap it in
+            ids = (self.read_id(slot) for slot in range(self.slot_count()))
+            temp_filename = self.index_filename + ".tmp"
+            self.write_index_file(temp_filename, self.capacity * 2, ids)
+            os.replace(temp_filename, self.index_filename)
+            self.map_index()
+
+    @staticmethod
+    def write_index_file(filename, capacity, game_ids):
+        """Writes an index file
+
+        :param filename: Name of the index file
+        :param capacity: Number of index entries (a power of 2)
+        :param game_ids: Game ids (as bytes) in slot order
+        """
+        entries = bytearray(FILE_HEADER.size + capacity * INDEX_ENTRY.size)
+        FILE_HEADER.pack_into(entries, 0, INDEX_MAGIC, VERSION, capacity)
+        for slot, game_id in enumerate(game_ids):
+            target = id_hash(game_id)
+            entry = target & (capacity - 1)
+            while INDEX_ENTRY.unpack_from(entries, FILE_HEADER.size + entry * INDEX_ENTRY.size)[0]:
+                entry = (entry + 1) & (capacity - 1)
+            INDEX_ENTRY.pack_into(entries, FILE_HEADER.size + entry * INDEX_ENTRY.size, target, slot)
+        with open(filename, mode='wb') as file:
+            file.write(entries)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def game_ids(self):
+        """Gets the ids of all the games in the shard
+
+        :return: List of game ids as bytes
+        """
+        if self.data_fd is None:
+            return []
+        return [self.read_id(slot) for slot in range(self.slot_count())]
+
+
+class GameStore:
+    """Stores many games in a directory of shard files"""
+
+    def __init__(self, directory, shards=16):
+        """
+        :param directory: Directory for the shard files (created if needed)
+        :param shards: Number of shards. Must be the same every time the store is opened.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.shards = [Shard(os.path.join(directory, f"shard-{number:03}")) for number in range(shards)]
+
+    def close(self):
+        """Closes all the shards"""
+        for shard in self.shards:
+            shard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def shard_for(self, game_id, write=False):
+        """Gets the (open) shard a game belongs to
+
+        :param game_id: Game id as bytes
+        :param write: True to open the shard for writing
+        :return: Shard
+        """
+        shard = self.shards[zlib.crc32(game_id) % len(self.shards)]
+        shard.open(write)
+        return shard
+
+    @staticmethod
+    def encode_id(game_id):
+        """Encodes a game id for storage
+
+        :param game_id: Game id string
+        :return: Game id as bytes
+        :raises ValueError: if the id is empty or too long
+        """
+        encoded = game_id.encode('utf-8')
+        if not 0 < len(encoded) <= MAX_ID_LENGTH or b"\0" in encoded:
+            raise ValueError(f"Invalid game id {game_id!r}")
+        return encoded
+
+    def load(self, game_id, board=None):
+        """Loads a game
+
+        :param game_id: Game id string
+        :param board: Board to load the game into (defaults to a new Board)
+        :return: Board, or None if the game is not in the store
+        """
+        encoded = self.encode_id(game_id)
+        board = board or Board()
+        return board if self.shard_for(encoded).load(encoded, board) else None
+
+    def save(self, game_id, board):
+        """Saves a game
+
+        :param game_id: Game id string
+        :param board: Board with the game's position
+        """
+        encoded = self.encode_id(game_id)
+        self.shard_for(encoded, write=True).save(encoded, board)
+
+    def load_many(self, game_ids):
+        """Loads many games, grouped by shard
+
+        :param game_ids: Iterable of game id strings
+        :return: Dictionary of game id to Board, for the games found
+        """
+        by_shard = {}
+        for game_id in game_ids:
+            encoded = self.encode_id(game_id)
+            by_shard.setdefault(zlib.crc32(encoded) % len(self.shards), []).append((game_id, encoded))
+        boards = {}
+        for number, games in by_shard.items():
+            shard = self.shards[number]
+            shard.open(write=False)
+            for game_id, encoded in games:
+                board = Board()
+                if shard.load(encoded, board):
+                    boards[game_id] = board
+        return boards
+
+    def save_many(self, games):
+        """Saves many games, grouped by shard, syncing each shard once at the end
+
+        :param games: Iterable of (game id string, Board or BoardSnapshot) pairs
+        """
+        by_shard = {}
+        for game_id, board in games:
+            encoded = self.encode_id(game_id)
+            by_shard.setdefault(zlib.crc32(encoded) % len(self.shards), []).append((encoded, board))
+        for number, shard_games in by_shard.items():
+            shard = self.shards[number]
+            shard.open(write=True)
+            for encoded, board in shard_games:
+                shard.save(encoded, board)
+            os.fsync(shard.data_fd)
+
+    def game_ids(self):
+        """Gets the ids of all the games in the store
+
+        :return: List of game id strings
+        """
+        ids = []
+        for shard in self.shards:
+            shard.open(write=False)
+            ids += [game_id.decode('utf-8') for game_id in shard.game_ids()]
+        return ids
+
+    def game_file(self, game_id):
+        """Gets an object that saves and loads one game in the store, which a Game can use instead of a GameFile
+
+        :param game_id: Game id string
+        :return: StoredGameFile
+        """
+        return StoredGameFile(self, game_id)
+
+
+class StoredGameFile:
+    """Saves and loads a game in a GameStore, with the same methods as GameFile.
+    Each move saves the whole position as the game's next snapshot."""
+
+    def __init__(self, store, game_id):
+        """
+        :param store: GameStore holding the game
+        :param game_id: Game id string
+        """
+        self.store = store
+        self.game_id = game_id
+
+    def load(self, game):
+        """Loads the state of the game from the store
+
+        :param game: Game instance to load data into
+        """
+        if self.store.load(self.game_id, game.board) is None:
+            print(f"Error loading game: {self.game_id} is not in the store")
+        game.reset_history()
+
+    def save(self, game):
+        """Saves the current state of the game to the store
+
+        :param game: Game instance to be saved
+        """
+        self.store.save(self.game_id, game.board)
+
+    def record_move(self, game, move):
+        """Saves the game after a move
+
+        :param game: Game instance the move was made in
+        :param move: Encoded move
+        """
+        self.save(game)
+
+    def record_take_back(self, game):
+        """Saves the game after a move was taken back
+
+        :param game: Game instance the move was taken back in
+        """
+        self.save(game)
+
+    def update(self, game):
+        """Saves the game after squares were changed
+
+        :param game: Game instance to be saved
+        """
+        self.save(game)
+
+    def close(self):
+        """Nothing to close, as the store's files are shared by its games (close the store instead)"""
@@ -0,0 +1,137 @@
+import sys
+import time
+
+from game import Game
+from gamefile import NullGameFile
+
+# Move scripts are text with one command per line, as typed when playing interactively: a move such as "e2 e4"
+# or "o-o", or "undo". Games are separated by blank lines, and lines starting with '#' are comments. A game may
+# start with a "fen <position>" line, to start from a position other than the initial one.
+
+# Ways of drawing the board in a game's output: after every command, once at the end, or not at all
+RENDER_MODES = ("full", "final", "none")
+# Statuses that end a game (see Game.status)
+GAME_OVER = ("checkmate", "stalemate", "repetition", "fifty moves")
+
+
+def read_scripts(file, name):
+    """Reads the games of a move script one at a time
+
+    :param file: Text file (or any iterable of lines)
+    :param name: Name of the script, used to name its games
+    :return: Generator of (game name, list of commands) pairs
+    """
+    commands = []
+    number = 0
+    for line in file:
+        line = line.strip()
+        if line.startswith('#'):
+            continue
+        if line:
+            commands.append(line)
+        elif commands:
+            number += 1
+            yield f"{name}:{number}", commands
+            commands = []
+    if commands:
+        yield f"{name}:{number + 1}", commands
+
+
+def run_script(name, commands, render="final"):
+    """Plays a game's commands through Game, collecting everything it shows in one buffer
+
+    :param name: Name of the game, for the first line of the output
+    :param commands: List of commands (see the module comment)
+    :param render: "full" to draw the board after every command, "final" to draw it at the end, or "none"
+    :return: Tuple of the output text, and the number of moves played
+    """
+    lines = [f"[{name}]"]
+    fen = None
+    if commands and commands[0].lower().startswith("fen "):
+        fen = commands[0][4:].strip()
+        commands = commands[1:]
+    try:
+        game = Game(None, game_file=NullGameFile(), fen=fen)
+    except ValueError as err:
+        lines.append(f">>> {err}")
+        return "\n".join(lines) + "\n\n", 0
+
+    moves = 0
+    status = game.status()
+    for number, command in enumerate(commands):
+        if status in GAME_OVER:
+            lines.append(f">>> The game is over, so the last {len(commands) - number} commands were skipped")
+            break
+        text = command.lower()
+        if text == "undo" or text == "takeback":
+            if not game.take_back():
+                lines.append(f"{command}: >>> There are no moves to take back")
+                continue
+        else:
+            error = game.apply_move(text)
+            if error:
+                lines.append(f"{command}: >>> Invalid move: {error}")
+                continue
+            moves += 1
+        status = game.status()
+        message = game.status_message(status)
+        if render == "full":
+            lines.append(command)
+            lines.append(game.board.render())
+        if message:
+            lines.append(f"{command}: >>> {message}" if render != "full" else f">>> {message}")
+    if render == "final":
+        lines.append(game.board.render())
+    lines.append(f"Result: {status or 'in progress'}")
+    lines.append(f"FEN: {game.fen()}")
+    return "\n".join(lines) + "\n\n", moves
+
+
+def run_scripts(filenames, render="final", output=None):
+    """Plays every game in move scripts, writing each game's output with a single write, then reports the
+    number of moves played per second (to stderr, so it does not mix with the games' output)
+
+    :param filenames: Names of the script files, or "-" for stdin
+    :param render: "full", "final" or "none" (see run_script)
+    :param output: Text file to write the games' output to (defaults to stdout)
+    :return: Tuple of the number of games, and the number of moves played
+    """
+    output = output or sys.stdout
+    games = 0
+    moves = 0
+    start = time.perf_counter()
+    for filename in filenames:
+        file = sys.stdin if filename == "-" else open(filename, encoding='utf-8')
+        try:
+            for name, commands in read_scripts(file, "stdin" if filename == "-" else filename):
+                text, played = run_script(name, commands, render)
+                output.write(text)
+                games += 1
+                moves += played
+        finally:
+            if file is not sys.stdin:
+                file.close()
+    seconds = time.perf_counter() - start
+    print(f"{games} games, {moves} moves in {seconds:.2f}s ({moves / seconds if seconds > 0 else 0:.0f} moves/s)",
+          file=sys.stderr)
+    return games, moves
+
+
+def main(arguments):
+    """Runs move scripts given on the command line
+
+    :param arguments: Optional render mode, then script file names (stdin if there are none)
+    """
+    render = "final"
+    if arguments and arguments[0] in RENDER_MODES:
+        render = arguments[0]
+        arguments = arguments[1:]
+    try:
+        run_scripts(arguments or ["-"], render)
+    except OSError as err:
+        print(f"Error reading script: {err}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    # Usage: python headless.py [full|final|none] [script file ...]    (reads stdin if no files are given)
+    main(sys.argv[1:])
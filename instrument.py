@@ -0,0 +1,270 @@
+import cProfile
+import functools
+import inspect
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from board import Board
+from game import Game
+from gamefile import GameFile
+from gamestore import GameStore
+from server import BatchedGameFile, GameServer
+
+# Optional instrumentation of the stages of processing a move. While enabled, each stage's method is replaced on
+# its class by a wrapper that counts the calls and records their latency in a histogram; disabling puts the
+# original methods back, so there is no cost at all while instrumentation is off. A stage's time includes the
+# stages called inside it (e.g. board.check_move includes board.leaves_king_in_check), and the time of a coroutine
+# stage (server.flush) includes any time it spends waiting.
+
+# Stage name, class and method name of each stage that can be instrumented
+STAGES = (
+    ("game.apply_move", Game, "apply_move"),
+    ("game.parse_move", Game, "parse_move"),
+    ("game.status", Game, "status"),
+    ("board.check_move", Board, "check_move_index"),
+    ("board.validate_movement", Board, "validate_movement_index"),
+    ("board.empty_between", Board, "empty_between_index"),
+    ("board.is_en_passant", Board, "is_en_passant_index"),
+    ("board.leaves_king_in_check", Board, "leaves_king_in_check"),
+    ("board.make_move", Board, "make_move"),
+    ("gamefile.record_move", GameFile, "record_move"),
+    ("gamefile.record_take_back", GameFile, "record_take_back"),
+    ("gamefile.save", GameFile, "save"),
+    ("gamefile.update", GameFile, "update"),
+    ("gamefile.sync", GameFile, "sync"),
+    ("server.save", BatchedGameFile, "save"),
+    ("server.update", BatchedGameFile, "update"),
+    ("server.flush", GameServer, "flush"),
+    ("gamestore.save_many", GameStore, "save_many"),
+)
+# Upper bounds of the latency histogram buckets, in seconds (there is one more bucket for anything slower)
+BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2,
+           0.1, 0.25, 0.5, 1.0)
+# Default seconds between dumps of the metrics to file
+DEFAULT_DUMP_INTERVAL = 10.0
+# Prefix of the metric names in the Prometheus text format
+PROMETHEUS_PREFIX = "chess_stage"
+
+
+class StageStats:
+    """Counters and latency histogram of one stage. Updates from several threads at once may occasionally
+    be lost, which is accepted to keep recording cheap."""
+
+    def __init__(self):
+        self.count = 0
+        # Number of calls that raised an exception
+        self.errors = 0
+        self.total_seconds = 0.0
+        # Number of calls in each bucket of BUCKETS, then slower calls
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+
+# Stats of every stage, by stage name
+_stats = {name: StageStats() for name, _, _ in STAGES}
+# Original methods of the instrumented stages, by stage name
+_originals = {}
+_lock = threading.Lock()
+
+
+def _timed(name, method):
+    """Wraps a method to record its calls in a stage's stats
+
+    :param name: Stage name
+    :param method: Function to wrap
+    :return: Wrapper function
+    """
+    stats = _stats[name]
+    buckets = stats.buckets
+    perf_counter = time.perf_counter
+
+    def record(start):
+        elapsed = perf_counter() - start
+        stats.count += 1
+        stats.total_seconds += elapsed
+        buckets[bisect_left(BUCKETS, elapsed)] += 1
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def coroutine_wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except BaseException:
+                stats.errors += 1
+                raise
+            finally:
+                record(start)
+        return coroutine_wrapper
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except BaseException:
+            stats.errors += 1
+            raise
+        finally:
+            record(start)
+    return wrapper
+
+
+def enable(names=None):
+    """Starts recording stages
+
+    :param names: Names of the stages to record (see STAGES), or None for all of them
+    :raises ValueError: if a stage name is unknown
+    """
+    known = {name for name, _, _ in STAGES}
+    for name in names or ():
+        if name not in known:
+            raise ValueError(f"Unknown stage {name}")
+    with _lock:
+        for name, cls, method_name in STAGES:
+            if (names is None or name in names) and name not in _originals:
+                _originals[name] = cls.__dict__[method_name]
+                setattr(cls, method_name, _timed(name, _originals[name]))
+
+
+def disable():
+    """Stops recording stages, putting back the original methods. The stats recorded so far are kept."""
+    with _lock:
+        for name, cls, method_name in STAGES:
+            if name in _originals:
+                setattr(cls, method_name, _originals.pop(name))
+
+
+def is_enabled():
+    """Checks if any stage is being recorded
+
+    :return: True if instrumentation is on
+    """
+    return bool(_originals)
+
+
+def reset():
+    """Sets every stage's stats back to zero"""
+    for stats in _stats.values():
+        stats.count = 0
+        stats.errors = 0
+        stats.total_seconds = 0.0
+        stats.buckets[:] = [0] * len(stats.buckets)
+
+
+def snapshot():
+    """Gets a copy of the stats of every stage that has been called
+
+    :return: Dictionary with the time of the snapshot, and the stats of each stage by name: count, errors,
+    total_seconds, mean_seconds, and buckets (list of [upper bound in seconds or None, number of calls])
+    """
+    stages = {}
+    for name, stats in _stats.items():
+        count = stats.count
+        if not count:
+            continue
+        stages[name] = {"count": count, "errors": stats.errors, "total_seconds": stats.total_seconds,
+                        "mean_seconds": stats.total_seconds / count,
+                        "buckets": [[bound, calls] for bound, calls in zip(BUCKETS + (None,), stats.buckets)]}
+    return {"time": time.time(), "enabled": is_enabled(), "stages": stages}
+
+
+def prometheus_text(data=None):
+    """Formats stats in the Prometheus text exposition format, as cumulative histograms
+
+    :param data: Dictionary from snapshot (defaults to a new snapshot)
+    :return: Text of the metrics
+    """
+    data = data or snapshot()
+    lines = [f"# TYPE {PROMETHEUS_PREFIX}_seconds histogram"]
+    for name, stats in data["stages"].items():
+        cumulative = 0
+        for bound, calls in stats["buckets"]:
+            cumulative += calls
+            le = "+Inf" if bound is None else bound
+            lines.append(f'{PROMETHEUS_PREFIX}_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'{PROMETHEUS_PREFIX}_seconds_sum{{stage="{name}"}} {stats["total_seconds"]}')
+        lines.append(f'{PROMETHEUS_PREFIX}_seconds_count{{stage="{name}"}} {stats["count"]}')
+    lines.append(f"# TYPE {PROMETHEUS_PREFIX}_errors_total counter")
+    for name, stats in data["stages"].items():
+        lines.append(f'{PROMETHEUS_PREFIX}_errors_total{{stage="{name}"}} {stats["errors"]}')
+    return "\n".join(lines) + "\n"
+
+
+def dump(filename):
+    """Writes a snapshot of the stats to a file, replacing it in one step so readers never see part of a dump.
+    Files ending in .prom or .txt get the Prometheus text format, and others JSON.
+
+    :param filename: Name of the file
+    """
+    data = snapshot()
+    if filename.endswith((".prom", ".txt")):
+        text = prometheus_text(data)
+    else:
+        text = json.dumps(data, indent=2) + "\n"
+    with open(filename + ".tmp", mode='w') as file:
+        file.write(text)
+    os.replace(filename + ".tmp", filename)
+
+
+class MetricsDumper:
+    """Background thread that dumps the stats to a file periodically, and once more when stopped"""
+
+    def __init__(self, filename, interval=DEFAULT_DUMP_INTERVAL):
+        """
+        :param filename: Name of the file (see dump for the formats)
+        :param interval: Seconds between dumps
+        """
+        self.filename = filename
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics-dump", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Dumps the stats once per interval until stopped"""
+        while not self.stopping.wait(self.interval):
+            try:
+                dump(self.filename)
+            except OSError as err:
+                print(f"Error writing metrics: {err}")
+
+    def stop(self):
+        """Stops the thread, then writes a final dump"""
+        self.stopping.set()
+        self.thread.join()
+        dump(self.filename)
+
+
+class SessionProfiler:
+    """Profiles a sample of sessions (e.g. server connections) with cProfile, writing each one's stats to a
+    file in a directory (view them with python -m pstats <file>). Only one profile can be collecting at a
+    time, so the caller enables a session's profile only while running that session's code."""
+
+    def __init__(self, directory, rate=1.0):
+        """
+        :param directory: Directory to write the profile files to (created if needed)
+        :param rate: Fraction of sessions to profile, from 0 to 1
+        """
+        self.directory = directory
+        self.rate = rate
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        """Decides whether to profile a session
+
+        :return: cProfile.Profile to enable while running the session's code, or None if it is not sampled
+        """
+        return cProfile.Profile() if random.random() < self.rate else None
+
+    def finish(self, name, profile):
+        """Writes a session's profile to file
+
+        :param name: Name of the session
+        :param profile: Profile returned by start (ignored if None)
+        """
+        if profile is not None:
+            profile.dump_stats(os.path.join(self.directory, f"{name}.prof"))
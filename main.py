@@ -1,6 +1,11 @@
+import os
+import sys
+
 from game import Game
 
-default_filename = "chessgame.txt"
+default_filename = "chessgame.dat"
+# Opening book used for suggestions, if it exists (built with book.py)
+default_book_filename = "openings.book"
 
 
 def print_instructions():
@@ -23,14 +28,22 @@ def print_instructions():
     print("   - You can only move piece of your own colour")
     print("   - You can only take pieces of your opponent's colour")
     print("   - The piece must be able to move that way, for example bishops can only move diagonally")
+    print("   - You cannot make a move that leaves your king in check (including moving a pinned piece)")
+    print("- The game ends when a player is checkmated or stalemated")
     print("- Some aspects are not currently validated or implemented:")
-    print("   - When a king has been checked or checkmated, including when pieces are pinned and cannot be moved")
     print("   - Pawns they reach the end of the board are automatically promoted to queens without asking the player")
+    print("- Type \"undo\" instead of a move to take back the last move")
+    print(f"- Type \"book\" instead of a move to see moves from the opening book ({default_book_filename})")
     print("- Type \"exit\" or \"quit\" instead of a move to exit the game. The state is saved to file you selected \
 when starting the game, so you can continue playing later.")
 
 
-def main():
+def main(ansi=False):
+    """Runs the menu for playing games on this computer
+
+    :param ansi: True to draw the board once and then redraw only the squares that change (needs an ANSI
+    terminal), False to print the whole board after each move
+    """
     print("Welcome to Chess")
     print("================")
     while True:
@@ -45,8 +58,22 @@ def main():
         elif response == 'N' or response == 'L':
             action = 'save' if response == 'N' else 'load'
             filename = input(f"File to {action} game? [or push enter for default: {default_filename}]\n > ").strip()
-            game = Game(filename or default_filename, response == 'L')
-            game.play()
+            computer = input("Computer plays which side? [W]hite, [B]lack, or push enter for none\n > ").upper()
+            book = None
+            if os.path.exists(default_book_filename):
+                # Imported only when needed, so playing does not depend on the modules the book uses
+                from book import OpeningBook
+                book = OpeningBook(default_book_filename)
+            game = Game(filename or default_filename, response == 'L',
+                        computer=computer if computer in ('W', 'B') else None, book=book)
+            renderer = None
+            if ansi:
+                from render import AnsiRenderer
+                renderer = AnsiRenderer()
+            game.play(renderer)
+            game.close()
+            if book:
+                book.close()
         elif response == "Q":
             print("Goodbye!")
             break
@@ -55,5 +82,23 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    # Usage: python main.py            to play on this computer
+    #    or: python main.py ansi       to play on this computer, redrawing only the squares that change
+    #    or: python main.py server [port] [store directory] [metrics file] [fraction of connections to profile]
+    #        to host games over the network (see server.py)
+    #    or: python main.py script [full|final|none] [script file ...]
+    #        to play move scripts without asking for input (see headless.py), reading stdin if no files are given
+    # The modules for scripts and the server are imported only when used, as the server's store needs fcntl,
+    # which is not available on every platform
+    if len(sys.argv) > 1 and sys.argv[1] == "script":
+        import headless
+        headless.main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "server":
+        import server
+        server.serve(int(sys.argv[2]) if len(sys.argv) > 2 else server.DEFAULT_PORT,
+                     sys.argv[3] if len(sys.argv) > 3 else server.DEFAULT_STORE,
+                     sys.argv[4] if len(sys.argv) > 4 else None,
+                     float(sys.argv[5]) if len(sys.argv) > 5 else 0.0)
+    else:
+        main(len(sys.argv) > 1 and sys.argv[1] == "ansi")
 
@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from board import Board, move_name
+from engine import Engine, SearchResult, MATE_THRESHOLD
+
+# Positions for the benchmark, as moves played from the initial position
+BENCHMARK_POSITIONS = (
+    "",
+    "e2e4 e7e5 g1f3 b8c6 f1b5 a7a6",
+    "d2d4 g8f6 c2c4 e7e6 b1c3 f8b4",
+    "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3",
+    "e2e4 e7e6 d2d4 d7d5 b1c3 g8f6 c1g5 f8e7 e4e5 f6d7",
+)
+
+# Engine used by each worker process, kept between searches so its transposition table is reused
+_worker_engine = None
+
+
+def _search_worker(board, max_depth, time_limit, previous_keys, root_moves):
+    """Searches some of the root moves in a worker process
+
+    :param board: Board to search
+    :param max_depth: Maximum depth to search, in plies
+    :param time_limit: Maximum time to search, in seconds, or None for no limit
+    :param previous_keys: Keys of positions reached earlier in the game
+    :param root_moves: Moves from the root position for this worker to search
+    :return: SearchResult
+    """
+    global _worker_engine
+    if _worker_engine is None:
+        _worker_engine = Engine()
+    return _worker_engine.search(board, max_depth, time_limit, previous_keys, root_moves)
+
+
+class ParallelEngine:
+    """Chooses moves by splitting the moves from the root position between worker processes,
+    so a search can use more than one CPU core"""
+
+    def __init__(self, workers=None):
+        """
+        :param workers: Number of worker processes (defaults to the number of CPU cores)
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(self.workers)
+
+    def close(self):
+        """Shuts down the worker processes"""
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def search(self, board, max_depth=None, time_limit=None, previous_keys=()):
+        """Searches for the best move for the player to move (see Engine.search). Each worker
+        searches an equal share of the root moves, and the best result is used.
+
+        :param board: Board to search
+        :param max_depth: Maximum depth to search, in plies (defaults to 4 if there is no time limit)
+        :param time_limit: Maximum time to search, in seconds, or None for no limit
+        :param previous_keys: Keys of positions reached earlier in the game, so repetitions are avoided
+        :return: SearchResult, with the total nodes searched by all workers
+        """
+        start = time.perf_counter()
+        moves = list(board.generate_moves(board.turn))
+        if len(moves) <= 1 or self.workers == 1:
+            return _search_worker(board, max_depth, time_limit, previous_keys, None)
+
+        # Deal the moves out in order of a quick search's move ordering, so each worker gets a mix of good
+        # and bad moves
+        ordered = Engine(table_bits=10).order_moves(board, moves, None, 0)
+        shares = [ordered[worker::self.workers] for worker in range(self.workers)]
+        futures = [self.executor.submit(_search_worker, board, max_depth, time_limit, tuple(previous_keys), share)
+                   for share in shares if share]
+        results = [future.result() for future in futures]
+
+        # A worker that finds a forced mate stops early, so a mate is taken whatever its depth. Otherwise only
+        # scores from the deepest search completed are compared, as scores from different depths are not
+        # comparable.
+        mates = [result for result in results if result.score >= MATE_THRESHOLD]
+        if mates:
+            best = max(mates, key=lambda result: result.score)
+        else:
+            deepest = max(result.depth for result in results)
+            best = max((result for result in results if result.depth == deepest), key=lambda result: result.score)
+        return SearchResult(best.move, best.score, best.depth, sum(result.nodes for result in results),
+                            time.perf_counter() - start, best.pv)
+
+
+def benchmark_position(moves):
+    """Sets up a benchmark position
+
+    :param moves: Moves played from the initial position, in coordinate notation separated by spaces
+    :return: Board
+    """
+    board = Board()
+    for name in moves.split():
+        for move in board.generate_moves(board.turn):
+            if move_name(move) == name:
+                board.make_move(move)
+                break
+        else:
+            raise RuntimeError(f"Illegal benchmark move {name}")
+    return board
+
+
+def benchmark(max_workers, depth):
+    """Times searches of the benchmark positions with 1 to max_workers worker processes, and prints the speedup
+
+    :param max_workers: Largest number of worker processes to try
+    :param depth: Depth to search each position
+    """
+    boards = [benchmark_position(moves) for moves in BENCHMARK_POSITIONS]
+    base_seconds = None
+    print(f"Searching {len(boards)} positions to depth {depth}")
+    print("workers   seconds     nodes   nodes/s  speedup")
+    for workers in range(1, max_workers + 1):
+        with ParallelEngine(workers) as engine:
+            start = time.perf_counter()
+            nodes = 0
+            for board in boards:
+                nodes += engine.search(board, max_depth=depth).nodes
+            seconds = time.perf_counter() - start
+        if base_seconds is None:
+            base_seconds = seconds
+        print(f"{workers:7} {seconds:9.2f} {nodes:9} {nodes / seconds:9.0f} {base_seconds / seconds:8.2f}")
+
+
+if __name__ == "__main__":
+    # Usage: python parallel.py [max workers] [depth]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1,
+              int(sys.argv[2]) if len(sys.argv) > 2 else 4)
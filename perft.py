@@ -0,0 +1,66 @@
+import sys
+import time
+
+from board import Board, move_name
+
+
+def perft(board, colour, depth):
+    """Counts the leaf nodes of the tree of legal moves, to a given depth
+
+    :param board: Board to start from
+    :param colour: 'W' or 'B' for the player to move
+    :param depth: Number of moves (plies) to look ahead
+    :return: Number of positions at the given depth
+    """
+    if depth == 0:
+        return 1
+    moves = board.generate_moves(colour)
+    if depth == 1:
+        # No need to make the last moves, just count them
+        return sum(1 for _ in moves)
+    next_colour = 'B' if colour == 'W' else 'W'
+    nodes = 0
+    for move in list(moves):
+        record = board.make_move(move)
+        nodes += perft(board, next_colour, depth - 1)
+        board.unmake_move(record)
+    return nodes
+
+
+def divide(board, colour, depth):
+    """Counts the leaf nodes below each legal move, to help find move generation errors
+
+    :param board: Board to start from
+    :param colour: 'W' or 'B' for the player to move
+    :param depth: Number of moves (plies) to look ahead, at least 1
+    :return: Dictionary of move name to number of positions at the given depth
+    """
+    next_colour = 'B' if colour == 'W' else 'W'
+    counts = {}
+    for move in list(board.generate_moves(colour)):
+        record = board.make_move(move)
+        counts[move_name(move)] = perft(board, next_colour, depth - 1)
+        board.unmake_move(record)
+    return counts
+
+
+def main():
+    """Runs perft with the depth given on the command line, from the position given in FEN after it (the
+    initial position if there is none). Add "divide" to also show the count for each move."""
+    arguments = [argument for argument in sys.argv[1:] if argument != "divide"]
+    depth = int(arguments[0]) if arguments else 3
+    board = Board.from_fen(" ".join(arguments[1:])) if len(arguments) > 1 else Board()
+    start = time.perf_counter()
+    if "divide" in sys.argv[1:]:
+        counts = divide(board, board.turn, depth)
+        for name, count in sorted(counts.items()):
+            print(f"{name}: {count}")
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(board, board.turn, depth)
+    seconds = time.perf_counter() - start
+    print(f"Depth {depth}: {nodes} nodes in {seconds:.3f}s ({nodes / max(seconds, 1e-9):.0f} nodes/s)")
+
+
+if __name__ == "__main__":
+    main()
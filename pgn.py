@@ -0,0 +1,292 @@
+import re
+import sys
+import time
+
+from board import (Board, EMPTY, PAWN, QUEEN, KING, BLACK, PIECE_CHARS, PIECE_CODES, INITIAL_FEN,
+                   square_index, square_name)
+
+# Tokens in the movetext of a game: comments, variations, annotations, move numbers, results, and moves
+TOKEN_PATTERN = re.compile(r"\{[^}]*\}|\{.*|;.*|\(|\)|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s{};()$]+")
+TAG_PATTERN = re.compile(r'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+# A move in standard algebraic notation (SAN), without check or annotation symbols
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$")
+# The seven tags every PGN game should have, in the standard order
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+
+class PgnGame:
+    """A game read from a PGN file"""
+
+    def __init__(self):
+        # Tag pairs, e.g. {"White": "Carlsen, Magnus"}
+        self.tags = {}
+        # Moves in standard algebraic notation (SAN), e.g. ["e4", "e5", "Nf3"]
+        self.moves = []
+        # "1-0", "0-1", "1/2-1/2", or "*" if unknown
+        self.result = "*"
+
+    def replay(self, board=None):
+        """Replays the game's moves through Board.move and Board.castle
+
+        :param board: Board to play the moves on (defaults to a new Board in the position of the game's FEN tag,
+        or the initial position)
+        :return: Board after the last move
+        :raises RuntimeError: if a move is invalid, with the move number in the message
+        :raises ValueError: if the game's FEN tag is not valid
+        """
+        board = board or (Board.from_fen(self.tags["FEN"]) if "FEN" in self.tags else Board())
+        for ply, san in enumerate(self.moves):
+            try:
+                play_san(board, san)
+            except RuntimeError as err:
+                raise RuntimeError(f"Invalid move {ply // 2 + 1}{'.' if ply % 2 == 0 else '...'}{san}: {err}")
+        return board
+
+
+def read_games(file):
+    """Reads games from a PGN file one at a time, without reading the whole file into memory
+
+    :param file: Text file (or any iterable of lines)
+    :return: Generator of PgnGame
+    """
+    game = PgnGame()
+    in_comment = False
+    variation_depth = 0
+    for line in file:
+        if in_comment:
+            end = line.find('}')
+            if end < 0:
+                continue
+            line = line[end + 1:]
+            in_comment = False
+        stripped = line.strip()
+        if not stripped or stripped[0] == '%':
+            continue
+        if stripped[0] == '[' and variation_depth == 0:
+            match = TAG_PATTERN.match(stripped)
+            if match:
+                if game.moves:
+                    # A new game has started without the previous one ending with a result
+                    yield game
+                    game = PgnGame()
+                game.tags[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                continue
+        for token in TOKEN_PATTERN.findall(stripped):
+            first = token[0]
+            if first == '{':
+                in_comment = not token.endswith('}')
+            elif first == ';' or first == '$':
+                continue
+            elif first == '(':
+                variation_depth += 1
+            elif first == ')':
+                variation_depth = max(variation_depth - 1, 0)
+            elif variation_depth:
+                continue
+            elif token in RESULTS:
+                game.result = token
+                yield game
+                game = PgnGame()
+            elif first.isdigit() and token[-1] == '.':
+                continue
+            else:
+                game.moves.append(token)
+    if game.moves or game.tags:
+        yield game
+
+
+def resolve_san(board, san):
+    """Works out which move a SAN string means in the current position
+
+    :param board: Board with the position (the player to move is board.turn)
+    :param san: Move in standard algebraic notation, e.g. "Nbxd7+" or "e8=Q" or "O-O"
+    :return: Tuple of (from square index, to square index, promotion letter or None), or a string "O-O" or
+    "O-O-O" for castling
+    :raises RuntimeError: if the string is not a valid move in the position
+    """
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        return text.replace('0', 'O')
+    match = SAN_PATTERN.match(text)
+    if not match:
+        raise RuntimeError(f"Invalid move format {san}")
+    piece_letter, from_file, from_rank, _, to_name, promotion = match.groups()
+    own = BLACK if board.turn == 'B' else 0
+    piece = PIECE_CODES[piece_letter or 'P'] | own
+    to_index = square_index(to_name[0], int(to_name[1]))
+
+    squares = board.squares
+    candidates = []
+    for from_index in range(64):
+        if squares[from_index] != piece:
+            continue
+        if from_file is not None and from_index & 7 != ord(from_file) - 97:
+            continue
+        if from_rank is not None and from_index >> 3 != int(from_rank) - 1:
+            continue
+        if board.validate_movement_index(piece, from_index, to_index):
+            candidates.append(from_index)
+    if len(candidates) > 1:
+        # Pinned pieces cannot move, so they do not need to be disambiguated
+        move_promotion = PIECE_CODES[promotion] if promotion else (QUEEN if piece & 7 == PAWN and (
+            to_index >= 56 or to_index < 8) else EMPTY)
+        candidates = [from_index for from_index in candidates
+                      if not board.leaves_king_in_check(from_index | to_index << 6 | move_promotion << 12)]
+    if not candidates:
+        raise RuntimeError(f"No {PIECE_CHARS[piece]} can move to {to_name}")
+    if len(candidates) > 1:
+        raise RuntimeError(f"Ambiguous move {san}")
+    return candidates[0], to_index, promotion
+
+
+def play_san(board, san):
+    """Plays a move given in SAN through Board.move or Board.castle
+
+    :param board: Board to play the move on (the player to move is board.turn)
+    :param san: Move in standard algebraic notation
+    :return: Undo record for the move
+    :raises RuntimeError: if the move is invalid
+    """
+    resolved = resolve_san(board, san)
+    if isinstance(resolved, str):
+        return board.castle(board.turn == 'W', resolved == "O-O")
+    from_index, to_index, promotion = resolved
+    return board.move(board.turn, chr(97 + (from_index & 7)), (from_index >> 3) + 1,
+                      chr(97 + (to_index & 7)), (to_index >> 3) + 1, promotion or 'Q')
+
+
+def move_to_san(board, move):
+    """Writes a move in standard algebraic notation (SAN)
+
+    :param board: Board with the position before the move (restored afterwards)
+    :param move: Encoded move, which must be legal
+    :return: SAN string, e.g. "Nbxd7+"
+    """
+    squares = board.squares
+    from_index = move & 63
+    to_index = (move >> 6) & 63
+    piece = squares[from_index]
+    piece_type = piece & 7
+    if piece_type == KING and abs(to_index - from_index) == 2:
+        san = "O-O" if to_index > from_index else "O-O-O"
+    else:
+        capture = squares[to_index] != EMPTY or (piece_type == PAWN and to_index == board.en_passant)
+        if piece_type == PAWN:
+            san = (square_name(from_index)[0] + "x" if capture else "") + square_name(to_index)
+            if move >> 12:
+                san += "=" + PIECE_CHARS[move >> 12]
+        else:
+            # Add the file, rank, or both, if other pieces of the same type could also move to the square
+            others = [other & 63 for other in board.generate_moves(board.turn)
+                      if (other >> 6) & 63 == to_index and other & 63 != from_index and squares[other & 63] == piece]
+            disambiguation = ""
+            if others:
+                if all(other & 7 != from_index & 7 for other in others):
+                    disambiguation = square_name(from_index)[0]
+                elif all(other >> 3 != from_index >> 3 for other in others):
+                    disambiguation = square_name(from_index)[1]
+                else:
+                    disambiguation = square_name(from_index)
+            san = PIECE_CHARS[piece_type] + disambiguation + ("x" if capture else "") + square_name(to_index)
+    record = board.make_move(move)
+    if board.in_check(board.turn):
+        san += "#" if not board.has_legal_move(board.turn) else "+"
+    board.unmake_move(record)
+    return san
+
+
+def game_moves(game):
+    """Gets the position a game started from, and the moves made since, from the game's undo records
+
+    :param game: Game instance
+    :return: Tuple of the starting Board, and a list of encoded moves
+    """
+    board = game.board.copy()
+    for record in reversed(game.undo_stack):
+        board.unmake_move(record)
+    return board, [record[0] for record in game.undo_stack]
+
+
+def escape_tag(value):
+    """Escapes a tag value for writing in a PGN file (read_games undoes this)
+
+    :param value: Tag value
+    :return: Value with backslashes and double quotes escaped with a backslash
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def write_game(file, game, tags=None, result="*"):
+    """Writes a game in PGN format
+
+    :param file: Text file to write to
+    :param game: Game instance whose moves are written
+    :param tags: Dictionary of extra tag pairs (e.g. {"White": "Kasparov, Garry"})
+    :param result: "1-0", "0-1", "1/2-1/2", or "*" if the game is not over
+    """
+    board, moves = game_moves(game)
+    tags = dict(tags or {})
+    tags["Result"] = result
+    fen = board.to_fen()
+    if fen != INITIAL_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = fen
+    lines = [f'[{name} "{escape_tag(tags.get(name, "?"))}"]' for name in SEVEN_TAG_ROSTER]
+    lines += [f'[{name} "{escape_tag(value)}"]' for name, value in tags.items() if name not in SEVEN_TAG_ROSTER]
+    file.write("\n".join(lines) + "\n\n")
+
+    # Movetext, wrapped to lines of at most 80 characters
+    line = ""
+    move_number = board.fullmove_number
+    for ply, move in enumerate(moves):
+        words = []
+        if board.turn == 'W':
+            words.append(f"{move_number}.")
+        elif ply == 0:
+            words.append(f"{move_number}...")
+        words.append(move_to_san(board, move))
+        if board.turn == 'B':
+            move_number += 1
+        board.make_move(move)
+        for word in words:
+            if line and len(line) + 1 + len(word) > 80:
+                file.write(line + "\n")
+                line = ""
+            line = f"{line} {word}" if line else word
+    file.write(f"{line} {result}\n\n" if line else f"{result}\n\n")
+
+
+def benchmark(filename):
+    """Reads and replays every game in a PGN file, printing the throughput and peak memory use
+
+    :param filename: Name of the PGN file
+    """
+    # Only available on Unix, so imported here rather than for every use of the module
+    import resource
+    start = time.perf_counter()
+    games = 0
+    moves = 0
+    invalid = 0
+    with open(filename, encoding='utf-8', errors='replace') as file:
+        for game in read_games(file):
+            games += 1
+            moves += len(game.moves)
+            try:
+                game.replay()
+            except RuntimeError as err:
+                invalid += 1
+                print(f"Game {games}: {err}")
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{games} games ({invalid} invalid), {moves} moves in {seconds:.2f}s")
+    print(f"{games / seconds:.1f} games/s, {moves / seconds:.0f} moves/s, peak memory {peak_memory:.1f} MB")
+
+
+if __name__ == "__main__":
+    # Usage: python pgn.py <PGN file>
+    if len(sys.argv) < 2:
+        print("Usage: python pgn.py <PGN file>")
+    else:
+        benchmark(sys.argv[1])
@@ -0,0 +1,135 @@
+import sys
+
+from board import PIECE_CHARS, PIECE_CODES, COL_INDEX, square_name
+
+# Renderers and spectator channels are game listeners (see Game.listeners): after each move or take back they
+# are given the squares that changed, so drawing or sending a move costs the same however full the board is.
+
+# ANSI escape sequences to clear the screen, and to clear from the cursor to the end of the screen
+CLEAR_SCREEN = "\x1b[H\x1b[2J"
+CLEAR_BELOW = "\x1b[J"
+# Screen line (from 1) of the first row of squares in Board.render's drawing, and the column of the a file
+FIRST_ROW_LINE = 3
+FIRST_COLUMN = 5
+# Screen line below the drawing, where prompts and messages go
+PROMPT_LINE = 21
+# Letter used for an empty square in square deltas
+EMPTY_DELTA = '.'
+
+
+def square_deltas(board, squares):
+    """Describes the contents of some squares compactly, e.g. "e2. e4P" after 1. e4
+
+    :param board: Board to describe
+    :param squares: List of square indices
+    :return: Square name followed by the piece letter (or EMPTY_DELTA) for each square, separated by spaces
+    """
+    board_squares = board.squares
+    return " ".join([square_name(index) + (PIECE_CHARS[board_squares[index]].strip() or EMPTY_DELTA)
+                     for index in squares])
+
+
+def apply_deltas(board, deltas):
+    """Updates a board's squares from square deltas (see square_deltas). The board's key is not updated.
+
+    :param board: Board to update
+    :param deltas: Square deltas text
+    :return: List of the square indices changed
+    :raises ValueError: if the text is not square deltas
+    """
+    changed = []
+    for delta in deltas.split():
+        if len(delta) != 3 or delta[0] not in COL_INDEX or delta[1] not in "12345678" \
+                or (delta[2] not in PIECE_CODES and delta[2] != EMPTY_DELTA):
+            raise ValueError(f"Invalid square delta {delta}")
+        index = (int(delta[1]) - 1) * 8 + COL_INDEX[delta[0]]
+        board.squares[index] = PIECE_CODES[' ' if delta[2] == EMPTY_DELTA else delta[2]]
+        changed.append(index)
+    return changed
+
+
+class AnsiRenderer:
+    """Draws a board on an ANSI terminal, then redraws only the squares that change by moving the cursor to
+    them, with one write per move"""
+
+    def __init__(self, output=None):
+        """
+        :param output: Text file to draw on (defaults to stdout)
+        """
+        self.output = output or sys.stdout
+        self.drawn = False
+
+    def draw(self, board):
+        """Clears the screen and draws the whole board, leaving the cursor below it
+
+        :param board: Board to draw
+        """
+        self.output.write(f"{CLEAR_SCREEN}{board.render()}\x1b[{PROMPT_LINE};1H")
+        self.output.flush()
+        self.drawn = True
+
+    def draw_squares(self, board, squares):
+        """Redraws some squares of the board, then clears the text below it
+
+        :param board: Board to draw
+        :param squares: List of square indices to redraw
+        """
+        if not self.drawn:
+            self.draw(board)
+            return
+        board_squares = board.squares
+        parts = [f"\x1b[{FIRST_ROW_LINE + 2 * (7 - (index >> 3))};{FIRST_COLUMN + 4 * (index & 7)}H"
+                 f"{PIECE_CHARS[board_squares[index]]}" for index in squares]
+        parts.append(f"\x1b[{PROMPT_LINE};1H{CLEAR_BELOW}")
+        self.output.write("".join(parts))
+        self.output.flush()
+
+    def squares_changed(self, game, squares):
+        """Redraws the squares changed by a move or take back
+
+        :param game: Game the squares changed in
+        :param squares: List of square indices
+        """
+        self.draw_squares(game.board, squares)
+
+
+class SpectatorChannel:
+    """Sends the changes to a game to any number of spectators. Each change is encoded once, as a line of
+    square deltas, and the same bytes are passed to every spectator."""
+
+    def __init__(self):
+        # Functions that send bytes to each spectator
+        self.subscribers = []
+        # Number of change messages sent, and bytes sent to all spectators
+        self.messages = 0
+        self.bytes_sent = 0
+
+    def subscribe(self, send):
+        """Adds a spectator
+
+        :param send: Function that sends bytes to the spectator
+        """
+        self.subscribers.append(send)
+
+    def unsubscribe(self, send):
+        """Removes a spectator, if it is subscribed
+
+        :param send: Function passed to subscribe
+        """
+        if send in self.subscribers:
+            self.subscribers.remove(send)
+
+    def squares_changed(self, game, squares):
+        """Sends a move or take back to the spectators, as "delta <next player> <square deltas>"
+
+        :param game: Game the squares changed in
+        :param squares: List of square indices
+        """
+        if not self.subscribers:
+            return
+        data = f"delta {game.next_player} {square_deltas(game.board, squares)}\n".encode('ascii')
+        self.messages += 1
+        # Copy the list, as a spectator may be unsubscribed while sending
+        for send in list(self.subscribers):
+            send(data)
+            self.bytes_sent += len(data)
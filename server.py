@@ -0,0 +1,473 @@
+import asyncio
+import secrets
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from board import Board, CHARS_TO_CODES
+from game import Game
+from gamestore import GameStore
+from render import AnsiRenderer, SpectatorChannel, apply_deltas
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_STORE = "games"
+# Seconds between batched writes of the games that have changed
+DEFAULT_FLUSH_INTERVAL = 0.05
+# Bytes waiting to be sent to a spectator before it is disconnected for not keeping up
+MAX_SPECTATOR_BUFFER = 64 * 1024
+
+# Moves played by each load generator client, then taken back, over and over
+LOAD_MOVES = ("e2 e4", "e7 e5", "g1 f3", "b8 c6", "f1 b5", "a7 a6", "b5 a4", "g8 f6", "o-o", "f8 e7")
+
+
+class BatchedGameFile:
+    """Saves a game through a GameServer's batched writes, with the same methods as GameFile. Each change
+    only marks the game as changed, and its latest position is written to the server's store with the next
+    batch, so a game file never blocks the event loop."""
+
+    def __init__(self, server, game_id, board=None):
+        """
+        :param server: GameServer that writes the game
+        :param game_id: Game id string
+        :param board: Board with the game's position, already read from the store (for load)
+        """
+        self.server = server
+        self.game_id = game_id
+        self.board = board
+
+    def load(self, game):
+        """Loads the position already read from the store
+
+        :param game: Game instance to load data into
+        """
+        game.board = self.board
+        game.reset_history()
+
+    def save(self, game):
+        """Marks the game to be written with the next batch
+
+        :param game: Game instance to be saved
+        """
+        self.server.changed[self.game_id] = game.board
+
+    def record_move(self, game, move):
+        """Marks the game to be written after a move
+
+        :param game: Game instance the move was made in
+        :param move: Encoded move
+        """
+        self.save(game)
+
+    def record_take_back(self, game):
+        """Marks the game to be written after a move was taken back
+
+        :param game: Game instance the move was taken back in
+        """
+        self.save(game)
+
+    def update(self, game):
+        """Marks the game to be written after squares were changed
+
+        :param game: Game instance to be saved
+        """
+        self.save(game)
+
+    def close(self):
+        """Nothing to close, as the server's store is shared by its games"""
+
+
+class GameServer:
+    """Hosts many games at once over TCP, using asyncio. Each connection plays one game at a time, sending
+    one command per line and getting one reply line:
+
+    - "new" starts a game, replying "ok <game id>". It can be followed by a position in FEN to start from.
+    - "load <game id>" continues a saved game, replying "ok <game id>". Connections that load the same game
+      share it, each seeing the moves made by the others.
+    - "move <move>" plays a move (e.g. "move e2 e4" or "move o-o"), replying "ok" followed by "check",
+      "checkmate", "stalemate", "repetition" or "fifty moves" if one applies
+    - "undo" takes back the last move, replying "ok"
+    - "board" replies "ok" followed by the next player and the 64 squares (as in the old text file format)
+    - "fen" replies "ok" followed by the position in FEN
+    - "watch <game id>" replies "ok" followed by the next player and the 64 squares, then sends a line
+      "delta <next player> <square deltas>" (see render.square_deltas) each time a move is made or taken back
+      in the game, by any connection playing it
+    - "unwatch" stops watching, replying "ok"
+    - "quit" replies "ok" and closes the connection
+
+    Invalid commands and moves get the reply "error <message>". Games are saved to a GameStore in batches,
+    by a thread, so slow disks do not hold up play."""
+
+    def __init__(self, directory=DEFAULT_STORE, flush_interval=DEFAULT_FLUSH_INTERVAL, profiler=None):
+        """
+        :param directory: Directory of the GameStore the games are saved in
+        :param flush_interval: Seconds between batched writes of the games that have changed
+        :param profiler: instrument.SessionProfiler to profile a sample of connections with, or None
+        """
+        self.store = GameStore(directory)
+        self.flush_interval = flush_interval
+        # All use of the store is on one thread, so it is never used by two threads at once
+        self.executor = ThreadPoolExecutor(1)
+        # Boards of the games changed since the last batch, by game id
+        self.changed = {}
+        self.sessions = 0
+        self.profiler = profiler
+        # Number of connections accepted, used to name their profiles
+        self.connections = 0
+        # Spectator channel of each game being watched, the Game of each game being played (shared by all the
+        # connections playing it), and the number of connections playing it, by game id
+        self.channels = {}
+        self.playing = {}
+        self.players = {}
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Accepts connections until cancelled, then writes any unsaved games and closes the store
+
+        :param host: Address to listen on
+        :param port: Port to listen on
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=1024)
+        flusher = asyncio.create_task(self.flush_periodically())
+        print(f"Serving games on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            flusher.cancel()
+            await self.flush()
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.store.close)
+            self.executor.shutdown()
+
+    async def flush_periodically(self):
+        """Writes the changed games every flush_interval seconds"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Writes the games changed since the last batch to the store, on the store's thread"""
+        if not self.changed:
+            return
+        # Take snapshots of the boards now, as the games may change while they are being written
+        games = [(game_id, board.snapshot()) for game_id, board in self.changed.items()]
+        self.changed = {}
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.store.save_many, games)
+
+    async def handle_connection(self, reader, writer):
+        """Plays games with one client until it quits or disconnects
+
+        :param reader: Stream to read commands from
+        :param writer: Stream to write replies to
+        """
+        game = None
+        # Game id and send function of the game being watched, if any
+        watching = None
+        self.sessions += 1
+        self.connections += 1
+        profile_name = f"session-{self.connections}"
+        profile = self.profiler.start() if self.profiler else None
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    # Disconnected, or the line was too long
+                    break
+                if not line:
+                    break
+                command, _, argument = line.decode('utf-8', errors='replace').strip().partition(' ')
+                command = command.lower()
+                if command == "quit":
+                    writer.write(b"ok\n")
+                    break
+                if command == "watch" or command == "unwatch":
+                    if watching:
+                        self.unwatch(*watching)
+                        watching = None
+                    reply = "ok"
+                    if command == "watch":
+                        watching, reply = await self.watch(argument.strip().lower(), writer)
+                    writer.write(reply.encode('utf-8') + b"\n")
+                    await writer.drain()
+                    continue
+                if profile is not None and command != "load":
+                    # Other commands never wait, so no other connection's code runs while the profile is on
+                    profile.enable()
+                    try:
+                        game, reply = await self.run_command(game, command, argument.strip())
+                    finally:
+                        profile.disable()
+                else:
+                    game, reply = await self.run_command(game, command, argument.strip())
+                writer.write(reply.encode('utf-8') + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            if watching:
+                self.unwatch(*watching)
+            if game is not None:
+                self.leave(game)
+            writer.close()
+            if profile is not None:
+                self.profiler.finish(profile_name, profile)
+
+    async def run_command(self, game, command, argument):
+        """Runs one command from a client
+
+        :param game: Client's current Game, or None
+        :param command: Lower case command word
+        :param argument: Rest of the line (with its case kept, as FEN needs it)
+        :return: Tuple of the client's Game (which may be a new one), and the reply
+        """
+        if command == "new":
+            game_id = secrets.token_hex(8)
+            try:
+                new_game = Game(None, game_file=BatchedGameFile(self, game_id), fen=argument or None)
+            except ValueError as err:
+                return game, f"error {err}"
+            return self.join(game, new_game), f"ok {game_id}"
+        if command == "load":
+            argument = argument.lower()
+            # A game being played, or changed since the last batch, is newer than its copy in the store
+            board = self.changed.get(argument)
+            if argument not in self.playing and board is None:
+                try:
+                    board = await asyncio.get_running_loop().run_in_executor(self.executor, self.store.load, argument)
+                except ValueError as err:
+                    return game, f"error {err}"
+            if argument in self.playing:
+                # Checked again after loading, as another connection may have loaded the game in the meantime
+                return self.join(game, self.playing[argument]), f"ok {argument}"
+            if board is None:
+                return game, f"error No game {argument}"
+            new_game = Game(None, load=True, game_file=BatchedGameFile(self, argument, board))
+            return self.join(game, new_game), f"ok {argument}"
+        if game is None:
+            return game, "error Start a game with new or load first"
+        if command == "move":
+            error = game.apply_move(argument.lower())
+            if error:
+                return game, f"error {error}"
+            status = game.status()
+            return game, f"ok {status}" if status else "ok"
+        if command == "undo":
+            return game, "ok" if game.take_back() else "error There are no moves to take back"
+        if command == "board":
+            return game, f"ok {game.next_player}{game.board}"
+        if command == "fen":
+            return game, f"ok {game.fen()}"
+        return game, f"error Unknown command {command}"
+
+    def join(self, old_game, game):
+        """Switches a connection to a game. The first connection to play a game makes its moves go to the game's
+        spectators, if it has any.
+
+        :param old_game: Game the connection was playing, or None
+        :param game: Game the connection is starting to play (the one in playing, if the game is being played)
+        :return: The new game
+        """
+        if old_game is not None:
+            self.leave(old_game)
+        game_id = game.game_file.game_id
+        if game_id not in self.playing:
+            self.playing[game_id] = game
+            if game_id in self.channels:
+                game.listeners.append(self.channels[game_id])
+        self.players[game_id] = self.players.get(game_id, 0) + 1
+        return game
+
+    def leave(self, game):
+        """Stops a connection playing a game
+
+        :param game: Game the connection was playing
+        """
+        game_id = game.game_file.game_id
+        self.players[game_id] -= 1
+        if not self.players[game_id]:
+            del self.players[game_id]
+            del self.playing[game_id]
+            if game_id in self.channels:
+                game.listeners.remove(self.channels[game_id])
+
+    async def watch(self, game_id, writer):
+        """Subscribes a connection to the moves of a game
+
+        :param game_id: Game id string
+        :param writer: Stream to send the moves to
+        :return: Tuple of the (game id, send function) to pass to unwatch (or None if the game was not found),
+        and the reply
+        """
+        if game_id in self.playing:
+            board = self.playing[game_id].board
+        elif game_id in self.changed:
+            board = self.changed[game_id]
+        else:
+            try:
+                board = await asyncio.get_running_loop().run_in_executor(self.executor, self.store.load, game_id)
+            except ValueError as err:
+                return None, f"error {err}"
+            if board is None:
+                return None, f"error No game {game_id}"
+        if game_id not in self.channels:
+            # Games only pass their changes to a channel while it has spectators, as working out the changed
+            # squares adds to the time taken by every move
+            self.channels[game_id] = SpectatorChannel()
+            if game_id in self.playing:
+                self.playing[game_id].listeners.append(self.channels[game_id])
+        channel = self.channels[game_id]
+
+        def send(data):
+            if writer.is_closing():
+                return
+            if writer.transport.get_write_buffer_size() > MAX_SPECTATOR_BUFFER:
+                # The spectator is not keeping up, so stop sending to it
+                channel.unsubscribe(send)
+                writer.close()
+            else:
+                writer.write(data)
+        channel.subscribe(send)
+        return (game_id, send), f"ok {board.turn}{board}"
+
+    def unwatch(self, game_id, send):
+        """Unsubscribes a connection from the moves of a game
+
+        :param game_id: Game id string
+        :param send: Send function returned by watch
+        """
+        channel = self.channels.get(game_id)
+        if channel is None:
+            return
+        channel.unsubscribe(send)
+        if not channel.subscribers:
+            del self.channels[game_id]
+            if game_id in self.playing:
+                self.playing[game_id].listeners.remove(channel)
+
+
+def serve(port=DEFAULT_PORT, directory=DEFAULT_STORE, metrics_filename=None, profile_rate=0.0):
+    """Runs a game server until interrupted
+
+    :param port: Port to listen on
+    :param directory: Directory of the GameStore the games are saved in
+    :param metrics_filename: File to dump the move processing stats to periodically (see instrument.dump), or
+    None to leave instrumentation off
+    :param profile_rate: Fraction of connections to profile with cProfile, written to a "profiles" directory
+    """
+    # Imported here as instrument imports this module, for the stages it records
+    import instrument
+
+    dumper = None
+    if metrics_filename:
+        instrument.enable()
+        dumper = instrument.MetricsDumper(metrics_filename)
+    profiler = instrument.SessionProfiler("profiles", profile_rate) if profile_rate > 0 else None
+    try:
+        asyncio.run(GameServer(directory, profiler=profiler).serve(port=port))
+    except KeyboardInterrupt:
+        print("Server stopped")
+    finally:
+        if dumper:
+            dumper.stop()
+
+
+async def load_client(host, port, deadline, latencies):
+    """Plays moves against a server until the deadline, recording the time taken for each reply
+
+    :param host: Server address
+    :param port: Server port
+    :param deadline: Time (from time.perf_counter) to stop at
+    :param latencies: List to add the time taken for each command to, in seconds
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    commands = [f"move {move}" for move in LOAD_MOVES] + ["undo"] * len(LOAD_MOVES)
+    writer.write(b"new\n")
+    await reader.readline()
+    try:
+        while time.perf_counter() < deadline:
+            for command in commands:
+                start = time.perf_counter()
+                writer.write(command.encode('ascii') + b"\n")
+                reply = await reader.readline()
+                latencies.append(time.perf_counter() - start)
+                if not reply.startswith(b"ok"):
+                    raise RuntimeError(f"Server replied {reply.decode().strip()} to {command}")
+        writer.write(b"quit\n")
+        await reader.readline()
+    finally:
+        writer.close()
+
+
+async def generate_load(clients, seconds, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Runs many clients against a server at once, then prints the throughput and latency
+
+    :param clients: Number of clients (each with its own connection and game)
+    :param seconds: How long to run for
+    :param host: Server address
+    :param port: Server port
+    """
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(load_client(host, port, start + seconds, latencies) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    if not latencies:
+        print("No replies")
+        return
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) * 99 // 100, len(latencies) - 1)] * 1000
+    print(f"{clients} clients, {len(latencies)} moves in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} moves/s, "
+          f"latency p50 {p50:.2f}ms, p99 {p99:.2f}ms")
+
+
+async def watch_client(game_id, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Watches a game being played on a server, redrawing the squares that change after each move
+
+    :param game_id: Game id string
+    :param host: Server address
+    :param port: Server port
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"watch {game_id}\n".encode('ascii'))
+        reply = (await reader.readline()).decode('ascii').rstrip("\n")
+        if not reply.startswith("ok "):
+            print(reply or "The server closed the connection")
+            return
+        board = Board()
+        board.set_position(reply[4:68].encode('ascii').translate(CHARS_TO_CODES), reply[3])
+        renderer = AnsiRenderer()
+        renderer.draw(board)
+        print(f"Watching {game_id}: {'White' if board.turn == 'W' else 'Black'} to play")
+        while True:
+            line = (await reader.readline()).decode('ascii')
+            if not line:
+                print("The server closed the connection")
+                return
+            if line.startswith("delta "):
+                turn, deltas = line[6], line[8:]
+                renderer.draw_squares(board, apply_deltas(board, deltas))
+                print(f"Watching {game_id}: {'White' if turn == 'W' else 'Black'} to play")
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    # Usage: python server.py [port] [store directory] [metrics file] [fraction of connections to profile]
+    #    or: python server.py client [clients] [seconds] [port]
+    #    or: python server.py watch <game id> [port]
+    if len(sys.argv) > 2 and sys.argv[1] == "watch":
+        try:
+            asyncio.run(watch_client(sys.argv[2], port=int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_PORT))
+        except KeyboardInterrupt:
+            pass
+    elif len(sys.argv) > 1 and sys.argv[1] == "client":
+        asyncio.run(generate_load(int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+                                  float(sys.argv[3]) if len(sys.argv) > 3 else 10.0,
+                                  port=int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_PORT))
+    else:
+        serve(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT,
+              sys.argv[2] if len(sys.argv) > 2 else DEFAULT_STORE,
+              sys.argv[3] if len(sys.argv) > 3 else None,
+              float(sys.argv[4]) if len(sys.argv) > 4 else 0.0)
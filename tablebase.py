@@ -0,0 +1,584 @@
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from board import (Board, EMPTY, PAWN, KNIGHT, BISHOP, ROOK, KING, BLACK, PIECE_CODES, KNIGHT_ATTACKS, KING_ATTACKS,
+                   ROOK_RAYS, BISHOP_RAYS, QUEEN_RAYS, WIN, DRAW, LOSS)
+
+# Tablebase files hold the result of every position of one set of pieces (e.g. "KQK" for king and queen against
+# king), named by that set, as a 16 byte header followed by a 16-bit value per position. A value is 0 for a
+# draw (or an impossible position), plies to mate + 1 if the player to move wins, and -(plies to mate + 1) if
+# they lose. Positions are numbered by the player to move, then the square of each piece (see TableInfo.index).
+# Castling and en-passant are not included.
+TABLE_MAGIC = b"CHTB"
+TABLE_VERSION = 1
+# Header fields: magic, version, and the set of pieces
+TABLE_HEADER = struct.Struct("<4sBxxx8s")
+TABLE_SUFFIX = ".tb"
+# Largest number of pieces (including the kings) that tables can be made for
+MAX_PIECES = 4
+# Order of the pieces after the king for each side in a set of pieces
+PIECE_ORDER = "QRBNP"
+# Value of each piece for choosing which side of a set of pieces is white, so "KQKR" is used rather than "KRKQ"
+SIDE_VALUES = {'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+
+# Rank of each piece code when sorting pieces into a table's slots: the white king, the black king, white's
+# other pieces in PIECE_ORDER, then black's. SLOT_LETTERS has the letter for each rank.
+SLOT_RANKS = [0] * 16
+SLOT_LETTERS = "KK" + PIECE_ORDER + PIECE_ORDER
+for _rank, _piece in enumerate(PIECE_ORDER):
+    SLOT_RANKS[PIECE_CODES[_piece]] = 2 + _rank
+    SLOT_RANKS[PIECE_CODES[_piece] | BLACK] = 7 + _rank
+SLOT_RANKS[KING | BLACK] = 1
+# Translation of piece codes to 1, and empty squares to 0, for finding the pieces quickly
+OCCUPIED = bytes(0 if code == EMPTY else 1 for code in range(256))
+
+# Positions in a table are reduced by symmetry. Without pawns, the board can be mirrored left to right, top to
+# bottom, and along the a1-h8 diagonal, so the white king only needs to be on one of these 10 squares (a1-d1-d4).
+PAWNLESS_KING_SQUARES = tuple(index for index in range(64) if (index >> 3) <= (index & 7) <= 3)
+# With pawns, the board can only be mirrored left to right, so the white king only needs to be on files a to d
+PAWN_KING_SQUARES = tuple(index for index in range(64) if index & 7 <= 3)
+
+
+def _symmetry(index, flip_files, flip_rows, transpose):
+    """Gets the square a square is moved to by a symmetry of the board"""
+    if flip_files:
+        index ^= 7
+    if flip_rows:
+        index ^= 56
+    if transpose:
+        index = ((index & 7) << 3) | (index >> 3)
+    return index
+
+
+def _pawnless_symmetry(king_index):
+    """Gets the symmetry that moves the white king from a square to one of PAWNLESS_KING_SQUARES
+
+    :param king_index: Square of the white king
+    :return: Tuple of the square each square is moved to
+    """
+    flip_files = king_index & 7 > 3
+    flip_rows = king_index >> 3 > 3
+    moved = _symmetry(king_index, flip_files, flip_rows, False)
+    transpose = moved >> 3 > moved & 7
+    return tuple(_symmetry(index, flip_files, flip_rows, transpose) for index in range(64))
+
+
+# Symmetry to use for each square of the white king, as the square each square is moved to
+PAWNLESS_SYMMETRIES = tuple(_pawnless_symmetry(king_index) for king_index in range(64))
+# Square each square is moved to by mirroring along the a1-h8 diagonal
+TRANSPOSE = tuple(_symmetry(index, False, False, True) for index in range(64))
+PAWN_SYMMETRIES = tuple(tuple(index ^ 7 if king_index & 7 > 3 else index for index in range(64))
+                        for king_index in range(64))
+
+# Number of the table's positions evaluated by a worker process at a time
+CHUNK_SIZE = 4096
+# Counter value for positions that can never be lost (impossible positions and stalemates)
+NEVER = 255
+
+
+def side_key(pieces):
+    """Gets a key for sorting the sides of a set of pieces, so the stronger side is white
+
+    :param pieces: Letters of a side's pieces, apart from the king, e.g. "QP"
+    :return: Key
+    """
+    return sum(SIDE_VALUES[piece] for piece in pieces), pieces
+
+
+def canonical_signature(white, black):
+    """Gets the name of the table holding a set of pieces, which has the stronger side as white
+
+    :param white: Letters of white's pieces apart from the king, in PIECE_ORDER
+    :param black: Letters of black's pieces apart from the king, in PIECE_ORDER
+    :return: Tuple of the table's name (e.g. "KQKR"), and True if the colours are swapped in the table
+    """
+    if side_key(black) > side_key(white):
+        return f"K{black}K{white}", True
+    return f"K{white}K{black}", False
+
+
+class TableInfo:
+    """The layout of the table for a set of pieces"""
+
+    def __init__(self, signature):
+        """
+        :param signature: Set of pieces, e.g. "KQK" or "KRKP", with white's pieces first
+        :raises ValueError: if the set of pieces is not valid
+        """
+        black_king = signature.find('K', 1)
+        if signature[:1] != 'K' or black_king < 0 or len(signature) > MAX_PIECES \
+                or any(piece not in PIECE_ORDER for piece in signature[1:black_king] + signature[black_king + 1:]):
+            raise ValueError(f"Invalid set of pieces {signature}")
+        self.signature = signature
+        self.white = signature[1:black_king]
+        self.black = signature[black_king + 1:]
+        # Piece code in each slot: the white king, the black king, white's other pieces, then black's
+        self.pieces = [KING, KING | BLACK] + [PIECE_CODES[piece] for piece in self.white] + \
+                      [PIECE_CODES[piece] | BLACK for piece in self.black]
+        self.has_pawns = 'P' in signature
+        self.king_squares = PAWN_KING_SQUARES if self.has_pawns else PAWNLESS_KING_SQUARES
+        self.symmetries = PAWN_SYMMETRIES if self.has_pawns else PAWNLESS_SYMMETRIES
+        self.king_numbers = [-1] * 64
+        for number, index in enumerate(self.king_squares):
+            self.king_numbers[index] = number
+        self.others = len(self.pieces) - 1
+        self.size = 2 * len(self.king_squares) * 64 ** self.others
+
+    def index(self, squares, black_to_move):
+        """Gets the number of a position in the table
+
+        :param squares: Square of the piece in each slot (see pieces)
+        :param black_to_move: True if black is to move
+        :return: Position number
+        """
+        symmetry = self.symmetries[squares[0]]
+        king_index = symmetry[squares[0]]
+        first = (len(self.king_squares) if black_to_move else 0) + self.king_numbers[king_index]
+        index = first
+        for slot in range(1, len(squares)):
+            index = (index << 6) | symmetry[squares[slot]]
+        if not self.has_pawns and king_index >> 3 == king_index & 7:
+            # The king is on the diagonal, so mirroring along it gives another number for the same position.
+            # Use the smaller one.
+            mirrored = first
+            for slot in range(1, len(squares)):
+                mirrored = (mirrored << 6) | TRANSPOSE[symmetry[squares[slot]]]
+            if mirrored < index:
+                index = mirrored
+        return index
+
+    def decode(self, index):
+        """Gets the position with a number in the table
+
+        :param index: Position number
+        :return: Tuple of the square of the piece in each slot, and True if black is to move
+        """
+        squares = [0] * len(self.pieces)
+        for slot in range(len(squares) - 1, 0, -1):
+            squares[slot] = index & 63
+            index >>= 6
+        squares[0] = self.king_squares[index % len(self.king_squares)]
+        return squares, index >= len(self.king_squares)
+
+    def subtables(self):
+        """Gets the tables that positions in this table can reach by a capture or promotion
+
+        :return: List of table names (apart from the draw with two kings alone)
+        """
+        names = set()
+        for side, other in ((self.white, self.black), (self.black, self.white)):
+            for number, piece in enumerate(side):
+                rest = side[:number] + side[number + 1:]
+                if rest or other:
+                    names.add(canonical_signature(rest, other)[0])
+                if piece == 'P':
+                    for promotion in "QRBN":
+                        promoted = "".join(sorted(rest + promotion, key=PIECE_ORDER.index))
+                        names.add(canonical_signature(promoted, other)[0])
+        return sorted(names)
+
+
+_table_infos = {}
+
+
+def table_info(signature):
+    """Gets the (cached) layout of the table for a set of pieces
+
+    :param signature: Set of pieces, e.g. "KQK"
+    :return: TableInfo
+    """
+    info = _table_infos.get(signature)
+    if info is None:
+        info = _table_infos[signature] = TableInfo(signature)
+    return info
+
+
+class Table:
+    """A memory-mapped tablebase file"""
+
+    def __init__(self, filename):
+        """
+        :param filename: Name of the table file
+        :raises ValueError: if the file is not a table file
+        """
+        self.file = open(filename, mode='rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, signature = TABLE_HEADER.unpack_from(self.map)
+        self.info = table_info(signature.rstrip(b"\0").decode('ascii'))
+        if magic != TABLE_MAGIC or version != TABLE_VERSION \
+                or len(self.map) != TABLE_HEADER.size + 2 * self.info.size:
+            self.map.close()
+            self.file.close()
+            raise ValueError(f"{filename} is not a table file")
+        self.values = memoryview(self.map)[TABLE_HEADER.size:].cast('h')
+
+    def close(self):
+        """Unmaps and closes the file"""
+        self.values.release()
+        self.map.close()
+        self.file.close()
+
+
+class Tablebase:
+    """Looks up positions with few pieces in a directory of table files, which are opened when first needed"""
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory of the table files
+        """
+        self.directory = directory
+        # Open tables by name, or None for tables that do not exist
+        self.tables = {}
+        # Tables found for each set of pieces (see material_table)
+        self.materials = {}
+
+    def close(self):
+        """Closes all the tables"""
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+        self.materials = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def table(self, signature):
+        """Gets an open table
+
+        :param signature: Set of pieces, e.g. "KQK"
+        :return: Table, or None if there is no table for the set of pieces
+        """
+        if signature in self.tables:
+            return self.tables[signature]
+        filename = os.path.join(self.directory, signature + TABLE_SUFFIX)
+        table = self.tables[signature] = Table(filename) if os.path.exists(filename) else None
+        return table
+
+    def probe(self, board):
+        """Looks up a position
+
+        :param board: Board with the position
+        :return: Tuple of WIN, DRAW or LOSS for the player to move, and the number of plies to mate (0 for a
+        draw), or None if the position is not in the tablebase
+        """
+        value = self.probe_value(board)
+        if value is None:
+            return None
+        if value == 0:
+            return DRAW, 0
+        return (WIN, value - 1) if value > 0 else (LOSS, -value - 1)
+
+    def probe_value(self, board):
+        """Looks up a position's value as stored in its table (see TABLE_MAGIC)
+
+        :param board: Board with the position
+        :return: Value, or None if the position is not in the tablebase
+        """
+        squares = board.squares
+        if squares.count(EMPTY) < 64 - MAX_PIECES or board.castling or board.en_passant is not None:
+            return None
+        found = []
+        occupied = squares.translate(OCCUPIED)
+        index = occupied.find(1)
+        while index >= 0:
+            found.append((SLOT_RANKS[squares[index]], index))
+            index = occupied.find(1, index + 1)
+        if len(found) == 2:
+            # Two kings alone is a draw
+            return 0
+        # Sorting puts the pieces in the order of a table's slots: the kings, white's pieces, then black's
+        found.sort()
+        material = tuple(rank for rank, _ in found)
+        entry = self.materials.get(material)
+        if entry is None:
+            entry = self.materials[material] = self.material_table(material)
+        table, swapped, white_count = entry
+        if table is None:
+            return None
+        if swapped:
+            # Swap the colours, by mirroring the board top to bottom
+            positions = [found[1][1] ^ 56, found[0][1] ^ 56] + [index ^ 56 for _, index in found[2 + white_count:]] \
+                + [index ^ 56 for _, index in found[2:2 + white_count]]
+            return table.values[table.info.index(positions, board.turn == 'W')]
+        return table.values[table.info.index([index for _, index in found], board.turn == 'B')]
+
+    def material_table(self, material):
+        """Finds the table for a set of pieces
+
+        :param material: Sorted slot ranks (see SLOT_RANKS) of the pieces
+        :return: Tuple of the Table (or None if there is none), True if the colours are swapped in the table,
+        and the number of white pieces apart from the king
+        """
+        white = "".join(SLOT_LETTERS[rank] for rank in material if 2 <= rank < 7)
+        black = "".join(SLOT_LETTERS[rank] for rank in material if rank >= 7)
+        table = self.table(f"K{white}K{black}")
+        if table is not None:
+            return table, False, len(white)
+        return self.table(f"K{black}K{white}"), True, len(white)
+
+
+# Board and tablebase used by each worker process, kept between chunks
+_worker_board = None
+_worker_tablebases = {}
+
+
+def _set_up(board, info, squares, black_to_move):
+    """Puts the pieces of a table position on a board
+
+    :param board: Board to use
+    :param info: TableInfo of the table
+    :param squares: Square of the piece in each slot
+    :param black_to_move: True if black is to move
+    :return: False if two pieces are on the same square or a pawn is on the first or last row, True otherwise
+    """
+    board_squares = board.squares
+    board_squares[:] = bytes(64)
+    for slot, index in enumerate(squares):
+        piece = info.pieces[slot]
+        if board_squares[index] != EMPTY or (piece & 7 == PAWN and (index < 8 or index >= 56)):
+            return False
+        board_squares[index] = piece
+    board.turn = 'B' if black_to_move else 'W'
+    board.castling = 0
+    board.en_passant = None
+    board.halfmove_clock = 0
+    return True
+
+
+def _worker_setup(directory=None):
+    """Gets the worker process's board, and its tablebase for a directory (or None if no directory is given)"""
+    global _worker_board
+    if _worker_board is None:
+        _worker_board = Board()
+    if directory is not None and directory not in _worker_tablebases:
+        _worker_tablebases[directory] = Tablebase(directory)
+    return _worker_board, _worker_tablebases.get(directory)
+
+
+def _initial_values(signature, directory, start):
+    """Works out what is known about a chunk of a table's positions before the retrograde analysis (run in a
+    worker process): checkmates, and the results of captures and promotions, which are found in smaller tables
+
+    :param signature: Table name
+    :param directory: Directory of the smaller tables
+    :param start: Number of the first position in the chunk
+    :return: Tuple of the chunk's counters (the number of different positions in the table that each position
+    can move to, plus the number of moves that draw by capture or promotion, or NEVER), the plies to mate by
+    capture or promotion (0 for none), and the most plies to be mated after a capture or promotion (0 for none)
+    """
+    info = table_info(signature)
+    board, tablebase = _worker_setup(directory)
+    stop = min(start + CHUNK_SIZE, info.size)
+    counters = bytearray(stop - start)
+    wins = array('h', bytes(2 * (stop - start)))
+    losses = array('h', bytes(2 * (stop - start)))
+    for offset in range(stop - start):
+        squares, black_to_move = info.decode(start + offset)
+        colour = 'B' if black_to_move else 'W'
+        # Skip impossible positions, and positions that have a smaller number by symmetry
+        if info.index(squares, black_to_move) != start + offset or not _set_up(board, info, squares, black_to_move) \
+                or board.in_check('W' if black_to_move else 'B'):
+            counters[offset] = NEVER
+            continue
+        moves = list(board.generate_moves(colour))
+        if not moves:
+            # Checkmate is a loss in 0 plies (counter 0), and stalemate is a draw
+            counters[offset] = 0 if board.in_check(colour) else NEVER
+            continue
+        children = set()
+        draws = 0
+        win = 0
+        loss = 0
+        for move in moves:
+            from_index = move & 63
+            to_index = (move >> 6) & 63
+            if board.squares[to_index] != EMPTY or move >> 12:
+                record = board.make_move(move)
+                value = tablebase.probe_value(board)
+                board.unmake_move(record)
+                if value is None:
+                    raise RuntimeError(f"Missing table for a capture or promotion from {signature}")
+                if value == 0:
+                    draws += 1
+                elif value < 0:
+                    # The opponent is mated in -value - 1 plies, so this is a mate in -value
+                    win = -value if not win or -value < win else win
+                else:
+                    loss = max(loss, value)
+            else:
+                child = list(squares)
+                child[child.index(from_index)] = to_index
+                children.add(info.index(child, not black_to_move))
+        counters[offset] = min(len(children) + draws, NEVER - 1)
+        wins[offset] = win
+        losses[offset] = loss
+    return bytes(counters), wins.tobytes(), losses.tobytes()
+
+
+def _unmove_targets(squares, piece, index):
+    """Gets the squares a piece could have moved from to reach a square, without capturing or promoting
+
+    :param squares: Board squares
+    :param piece: Piece code
+    :param index: Square the piece is on
+    :return: List of square indexes
+    """
+    piece_type = piece & 7
+    if piece_type == PAWN:
+        step = 8 if piece & BLACK else -8
+        row = index >> 3
+        if (row < 2 if step < 0 else row > 5) or squares[index + step] != EMPTY:
+            return []
+        if row == (3 if step < 0 else 4) and squares[index + 2 * step] == EMPTY:
+            return [index + step, index + 2 * step]
+        return [index + step]
+    if piece_type == KNIGHT or piece_type == KING:
+        return [target for target in (KNIGHT_ATTACKS if piece_type == KNIGHT else KING_ATTACKS)[index]
+                if squares[target] == EMPTY]
+    targets = []
+    for ray in (ROOK_RAYS if piece_type == ROOK else BISHOP_RAYS if piece_type == BISHOP else QUEEN_RAYS)[index]:
+        for target in ray:
+            if squares[target] != EMPTY:
+                break
+            targets.append(target)
+    return targets
+
+
+def _predecessors(signature, indexes):
+    """Finds the positions in a table that can move to each of some positions (run in a worker process)
+
+    :param signature: Table name
+    :param indexes: Numbers of the positions
+    :return: List of lists of position numbers, without repeats
+    """
+    info = table_info(signature)
+    board = _worker_setup()[0]
+    results = []
+    for index in indexes:
+        squares, black_to_move = info.decode(index)
+        _set_up(board, info, squares, black_to_move)
+        # The player who made the last move, whose pieces are moved back
+        mover = 0 if black_to_move else BLACK
+        king_index = squares[1] if black_to_move else squares[0]
+        board_squares = board.squares
+        found = set()
+        for slot, piece in enumerate(info.pieces):
+            if piece & BLACK != mover:
+                continue
+            index_from = squares[slot]
+            for target in _unmove_targets(board_squares, piece, index_from):
+                board_squares[index_from] = EMPTY
+                board_squares[target] = piece
+                # The player to move in the position found cannot be giving check
+                if not board.is_attacked_by(king_index, mover):
+                    previous = list(squares)
+                    previous[slot] = target
+                    found.add(info.index(previous, not black_to_move))
+                board_squares[target] = EMPTY
+                board_squares[index_from] = piece
+        results.append(list(found))
+    return results
+
+
+def generate_table(signature, directory, workers=None, verbose=True):
+    """Generates the table for a set of pieces by retrograde analysis, first generating any smaller tables it
+    needs. Positions are worked backwards from checkmates: a position is won in n + 1 plies if a move reaches a
+    position lost in n plies, and lost in n + 1 plies when every move reaches a won position, the last of which
+    is won in n plies. Positions that are never found to be won or lost are draws.
+
+    :param signature: Set of pieces, e.g. "KQK" (the stronger side first)
+    :param directory: Directory for the table files
+    :param workers: Number of worker processes (defaults to the number of CPU cores)
+    :param verbose: True to print progress
+    """
+    info = table_info(signature)
+    os.makedirs(directory, exist_ok=True)
+    for subtable in info.subtables():
+        if not os.path.exists(os.path.join(directory, subtable + TABLE_SUFFIX)):
+            generate_table(subtable, directory, workers, verbose)
+    start_time = time.perf_counter()
+    size = info.size
+    with ProcessPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        counters = bytearray()
+        wins = array('h')
+        losses = array('h')
+        for chunk_counters, chunk_wins, chunk_losses in executor.map(
+                partial(_initial_values, signature, directory), range(0, size, CHUNK_SIZE)):
+            counters += chunk_counters
+            wins.frombytes(chunk_wins)
+            losses.frombytes(chunk_losses)
+
+        # Positions to decide, by plies to mate
+        win_queue = {}
+        loss_queue = {}
+        for index in range(size):
+            if wins[index]:
+                win_queue.setdefault(wins[index], []).append(index)
+            elif counters[index] == 0:
+                loss_queue.setdefault(losses[index], []).append(index)
+
+        values = array('h', bytes(2 * size))
+        plies = 0
+        while plies <= max(max(win_queue, default=-1), max(loss_queue, default=-1)):
+            # A position can be queued more than once, so only take the first
+            won = []
+            for index in win_queue.pop(plies, ()):
+                if values[index] == 0:
+                    values[index] = plies + 1
+                    won.append(index)
+            lost = []
+            for index in loss_queue.pop(plies, ()):
+                if values[index] == 0:
+                    values[index] = -plies - 1
+                    lost.append(index)
+            chunks = [lost[chunk:chunk + CHUNK_SIZE] for chunk in range(0, len(lost), CHUNK_SIZE)]
+            for predecessors in executor.map(partial(_predecessors, signature), chunks):
+                for previous_list in predecessors:
+                    for previous in previous_list:
+                        if values[previous] == 0:
+                            win_queue.setdefault(plies + 1, []).append(previous)
+            chunks = [won[chunk:chunk + CHUNK_SIZE] for chunk in range(0, len(won), CHUNK_SIZE)]
+            for predecessors in executor.map(partial(_predecessors, signature), chunks):
+                for previous_list in predecessors:
+                    for previous in previous_list:
+                        if values[previous] == 0 and not wins[previous] and counters[previous] != NEVER:
+                            counters[previous] -= 1
+                            if counters[previous] == 0:
+                                loss_queue.setdefault(max(plies + 1, losses[previous]), []).append(previous)
+            plies += 1
+
+    if sys.byteorder == 'big':
+        values.byteswap()
+    filename = os.path.join(directory, signature + TABLE_SUFFIX)
+    with open(filename + ".tmp", mode='wb') as file:
+        file.write(TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, signature.encode('ascii')))
+        values.tofile(file)
+    os.replace(filename + ".tmp", filename)
+    if verbose:
+        won = sum(1 for value in values if value > 0)
+        lost = sum(1 for value in values if value < 0)
+        longest = max((abs(value) - 1 for value in values if value), default=0)
+        print(f"{signature}: {size} positions, {won} won, {lost} lost, longest mate {longest} plies, "
+              f"in {time.perf_counter() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    # Usage: python tablebase.py <directory> <set of pieces> [<set of pieces> ...] [workers]
+    if len(sys.argv) < 3:
+        print("Usage: python tablebase.py <directory> <set of pieces, e.g. KQK> [...] [workers]")
+    else:
+        names = [name.upper() for name in sys.argv[2:] if not name.isdigit()]
+        worker_count = int(sys.argv[-1]) if sys.argv[-1].isdigit() else None
+        for name in names:
+            white_side, black_side = TableInfo(name).white, TableInfo(name).black
+            generate_table(canonical_signature(white_side, black_side)[0], sys.argv[1], worker_count)
@@ -0,0 +1,116 @@
+import pickle
+
+import pytest
+
+from board import Board, BoardSnapshot, INITIAL_FEN, move_name
+from perft import perft
+
+# Positions with known perft counts (from the Chess Programming Wiki), covering castling, en-passant,
+# promotions, pins and checks
+PERFT_POSITIONS = [
+    (INITIAL_FEN, [20, 400, 8902]),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039]),
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812]),
+    ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467]),
+    ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486]),
+]
+
+
+@pytest.mark.parametrize("fen, counts", PERFT_POSITIONS)
+def test_perft(fen, counts):
+    board = Board.from_fen(fen)
+    for depth, count in enumerate(counts, 1):
+        assert perft(board, board.turn, depth) == count, f"depth {depth}"
+    # Making and unmaking every move leaves the board as it was
+    assert board.to_fen() == Board.from_fen(fen).to_fen()
+
+
+def check_make_unmake(board, depth):
+    """Makes and unmakes every move to a depth, checking the key is kept up to date and the board restored"""
+    if depth == 0:
+        return
+    for move in list(board.generate_moves(board.turn)):
+        before = board.copy()
+        record = board.make_move(move)
+        assert board.key == board.compute_key(), f"key after {move_name(move)}"
+        check_make_unmake(board, depth - 1)
+        board.unmake_move(record)
+        assert board.snapshot() == before.snapshot(), f"board after taking back {move_name(move)}"
+
+
+def play(board, names):
+    """Makes moves given in coordinate notation"""
+    for name in names:
+        board.make_move(next(move for move in board.generate_moves(board.turn) if move_name(move) == name))
+    return board
+
+
+@pytest.mark.parametrize("names", [
+    [],
+    # White can take en-passant on f6 or castle, and black can castle
+    ["e2e4", "g8h6", "e4e5", "d7d5", "g1f3", "b8c6", "f1c4", "c8e6", "d2d3", "d8d7", "c1e3", "f7f5"],
+    # Both sides can promote, with and without capturing
+    ["a2a4", "h7h5", "a4a5", "h5h4", "a5a6", "h4h3", "a6b7", "h3g2"],
+])
+def test_make_unmake_restores_board(names):
+    check_make_unmake(play(Board(), names), 2)
+
+
+@pytest.mark.parametrize("fen", [fen for fen, _ in PERFT_POSITIONS])
+def test_make_unmake_restores_board_from_fen(fen):
+    check_make_unmake(Board.from_fen(fen), 2)
+
+
+@pytest.mark.parametrize("fen", [
+    INITIAL_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R b Kq - 12 40",
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    "8/8/8/8/8/8/8/K6k b - - 99 200",
+])
+def test_fen_round_trip(fen):
+    board = Board.from_fen(fen)
+    assert board.to_fen() == fen
+    assert board.key == board.compute_key()
+
+
+def test_fen_keeps_only_usable_en_passant_square():
+    # No black pawn can take on e3, so the square is dropped, as make_move would
+    board = Board.from_fen("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1")
+    assert board.en_passant is None
+    assert board.key == Board.from_fen("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1").key
+
+
+@pytest.mark.parametrize("fen", [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBN w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w KQkq - 0 1",
+    "rnbqqbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "Pnbqkbnr/pppppppp/8/8/8/8/1PPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/1ppppppp/8/8/8/8/PPPPPPPP/pNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkk - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e4 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - x 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - -1 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 0",
+])
+def test_invalid_fen(fen):
+    with pytest.raises(ValueError):
+        Board.from_fen(fen)
+
+
+def test_snapshot_is_shared_until_board_changes():
+    board = Board.from_fen("r3k2r/8/8/8/8/8/8/4K2R b Kkq - 7 42")
+    snapshot = board.snapshot()
+    assert board.snapshot() is snapshot
+    assert Board.from_snapshot(snapshot).to_fen() == board.to_fen()
+    assert pickle.loads(pickle.dumps(snapshot)) == snapshot
+    with pytest.raises(AttributeError):
+        snapshot.turn = 'W'
+
+    record = board.make_move(next(iter(board.generate_moves(board.turn))))
+    assert board.snapshot() != snapshot
+    board.unmake_move(record)
+    assert board.snapshot() == snapshot
+    assert isinstance(snapshot, BoardSnapshot) and hash(board.snapshot()) == hash(snapshot)
@@ -0,0 +1,37 @@
+import os
+
+from board import Board, move_name
+from book import OpeningBook, build_book
+
+PGN = """[Result "1-0"]
+
+1. e4 e5 2. Nf3 Nc6 1-0
+
+[Result "1/2-1/2"]
+
+1. e4 c5 1/2-1/2
+
+[Result "0-1"]
+
+1. d4 d5 0-1
+
+[Result "1-0"]
+
+1. e4 e5 2. Bc4 1-0
+"""
+
+
+def test_build_and_look_up(tmp_path):
+    pgn_filename = str(tmp_path / "games.pgn")
+    with open(pgn_filename, mode='w') as file:
+        file.write(PGN)
+    book_filename = str(tmp_path / "openings.book")
+    # Small runs, so they have to be merged
+    build_book([pgn_filename], book_filename, run_entries=2)
+    # Only the book is left, not the runs or the temporary file it was written to
+    assert sorted(os.listdir(tmp_path)) == ["games.pgn", "openings.book"]
+
+    with OpeningBook(book_filename) as book:
+        moves = {move_name(book_move.move): (book_move.white_wins, book_move.draws, book_move.black_wins)
+                 for book_move in book.lookup(Board().key)}
+    assert moves == {"e2e4": (2, 1, 0), "d2d4": (0, 0, 1)}
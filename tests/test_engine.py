@@ -0,0 +1,14 @@
+from board import Board, move_name
+from engine import Engine
+
+
+def test_quiesce_searches_en_passant():
+    board = Board()
+    for name in ["e2e4", "h7h6", "e4e5", "d7d5"]:
+        board.make_move(next(move for move in board.generate_moves(board.turn) if move_name(move) == name))
+    # Taking on d6 is white's only capture, so it is searched only if en-passant counts as a capture
+    before = bytes(board.squares)
+    engine = Engine(table_bits=8)
+    engine.quiesce(board, -1000000, 1000000)
+    assert engine.nodes > 1
+    assert bytes(board.squares) == before
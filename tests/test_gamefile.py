@@ -0,0 +1,151 @@
+import os
+
+import pytest
+
+from board import BLACK_KINGSIDE, BLACK_QUEENSIDE, WHITE_QUEENSIDE, Board, move_name
+from game import Game
+from gamefile import FILE_SIZE, JOURNAL_RECORD, JOURNAL_SUFFIX, SLOT_SIZE, TEXT_SIZE, GameFile, unpack_slot
+
+# Moves that castle queenside for white and take en-passant for black
+MOVES = ["d2d4", "g8f6", "b1c3", "e7e5", "c1g5", "e5e4", "d1d2", "f8e7", "f2f4", "e4f3", "e1c1"]
+
+
+def play(game, names):
+    """Plays moves given in coordinate notation through a Game, as a player would"""
+    for name in names:
+        board = game.board
+        game.record_position(board.make_move(next(move for move in board.generate_moves(board.turn)
+                                                  if move_name(move) == name)))
+
+
+def state(board):
+    return bytes(board.squares), board.turn, board.castling, board.en_passant, board.halfmove_clock, \
+        board.fullmove_number, board.key
+
+
+def test_moves_are_saved(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename)
+    play(game, MOVES)
+    game.close()
+    assert os.path.getsize(filename) == FILE_SIZE
+
+    loaded = Game(filename, load=True)
+    assert state(loaded.board) == state(game.board)
+    # The journal's moves can be taken back after loading
+    assert loaded.take_back()
+    loaded.close()
+    expected = Game(str(tmp_path / "expected.dat"))
+    play(expected, MOVES[:-1])
+    assert state(Game(filename, load=True).board) == state(expected.board)
+
+
+def test_game_from_fen_keeps_move_number(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename, fen="r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNB1K2R w KQkq - 4 12")
+    play(game, ["e1g1", "d7d6", "b1c3"])
+    game.close()
+
+    loaded = Game(filename, load=True)
+    assert loaded.fen() == game.fen()
+    assert loaded.board.fullmove_number == 13
+    assert loaded.take_back()
+    loaded.close()
+    assert Game(filename, load=True).fen() == "r1bqkb1r/ppp2ppp/2np1n2/4p3/2B1P3/5N2/PPPP1PPP/RNB2RK1 w kq - 0 13"
+
+
+def test_compaction_keeps_position(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename)
+    game.game_file.compact_interval = 3
+    moves = ["g1f3", "g8f6", "f3g1", "f6g8"] * 3
+    play(game, moves)
+    game.close()
+    assert os.path.getsize(filename + JOURNAL_SUFFIX) < len(moves) * JOURNAL_RECORD.size
+    loaded = Game(filename, load=True)
+    assert state(loaded.board) == state(game.board)
+    loaded.close()
+
+
+def test_partly_written_journal_record_is_removed(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename)
+    play(game, MOVES[:3])
+    game.close()
+    journal_size = os.path.getsize(filename + JOURNAL_SUFFIX)
+    # A crash while appending a record leaves part of it at the end of the journal
+    with open(filename + JOURNAL_SUFFIX, mode='ab') as journal:
+        journal.write(b"\x04\0\0\0\x01")
+
+    loaded = Game(filename, load=True)
+    assert state(loaded.board) == state(game.board)
+    assert os.path.getsize(filename + JOURNAL_SUFFIX) == journal_size
+    # New moves follow the last good record
+    play(loaded, MOVES[3:4])
+    loaded.close()
+    assert state(Game(filename, load=True).board) == state(loaded.board)
+
+
+def test_damaged_journal_record_ends_replay(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename)
+    play(game, MOVES[:3])
+    game.close()
+    with open(filename + JOURNAL_SUFFIX, mode='r+b') as journal:
+        journal.seek(2 * JOURNAL_RECORD.size + 6)
+        journal.write(b"\xff")
+    expected = Game(str(tmp_path / "expected.dat"))
+    play(expected, MOVES[:2])
+    assert state(Game(filename, load=True).board) == state(expected.board)
+
+
+def test_damaged_snapshot_falls_back_to_other_slot(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename)
+    play(game, MOVES)
+    game.game_file.write_snapshot(game.board)
+    game.close()
+    data = bytearray(open(filename, mode='rb').read())
+    latest = 0 if unpack_slot(data[:SLOT_SIZE])[0] > unpack_slot(data[SLOT_SIZE:])[0] else 1
+    data[latest * SLOT_SIZE + SLOT_SIZE - 1] ^= 0xff
+    with open(filename, mode='wb') as file:
+        file.write(data)
+    assert state(Game(filename, load=True).board) == state(Board())
+
+
+def test_update_saves_changed_squares(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename)
+    play(game, MOVES[:3])
+    game.board.set_square('h', 1, ' ')
+    game.game_file.update(game)
+    game.close()
+    assert state(Game(filename, load=True).board) == state(game.board)
+
+
+def test_convert_text_file(tmp_path):
+    filename = str(tmp_path / "game.txt")
+    board = Board()
+    board.set_square('h', 1, ' ')
+    with open(filename, mode='wb') as file:
+        file.write(b"B" + str(board).encode('ascii'))
+    loaded = Game(filename, load=True)
+    loaded.close()
+    assert os.path.getsize(filename) == FILE_SIZE
+    assert sorted(os.listdir(tmp_path)) == ["game.txt", "game.txt" + JOURNAL_SUFFIX]
+    assert bytes(loaded.board.squares) == bytes(board.squares)
+    assert loaded.next_player == 'B'
+    # Castling rights are inferred from the king and rook squares
+    assert loaded.board.castling == WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+
+
+@pytest.mark.parametrize("size", [TEXT_SIZE, SLOT_SIZE, FILE_SIZE, 100])
+def test_other_files_are_left_alone(tmp_path, size):
+    filename = str(tmp_path / "notes.txt")
+    data = (b"Not a game file, just some notes. " * 10)[:size]
+    with open(filename, mode='wb') as file:
+        file.write(data)
+    with pytest.raises(ValueError):
+        GameFile(filename).open(create=False)
+    assert open(filename, mode='rb').read() == data
+    assert not os.path.exists(filename + JOURNAL_SUFFIX)
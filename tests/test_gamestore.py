@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from board import Board, move_name
+from game import Game
+from gamestore import FILE_HEADER, MAX_ID_LENGTH, GameStore
+
+# Positions to save, as moves played from the initial position
+POSITIONS = [
+    ["e2e4"],
+    ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "g8f6", "e1g1"],
+    ["d2d4", "d7d5", "c2c4", "d5c4", "e2e4", "b7b5", "a2a4", "c7c5"],
+]
+
+
+def board_after(names):
+    board = Board()
+    for name in names:
+        board.make_move(next(move for move in board.generate_moves(board.turn) if move_name(move) == name))
+    return board
+
+
+def state(board):
+    return bytes(board.squares), board.turn, board.castling, board.en_passant, board.halfmove_clock, \
+        board.fullmove_number
+
+
+def fill(store, count):
+    """Saves count games to a store, returning their state by game id"""
+    games = {f"game-{number}": board_after(POSITIONS[number % len(POSITIONS)]) for number in range(count)}
+    store.save_many(games.items())
+    return {game_id: state(board) for game_id, board in games.items()}
+
+
+def test_save_and_load_across_shards(tmp_path):
+    with GameStore(str(tmp_path), shards=4) as store:
+        games = fill(store, 200)
+        # Saving again replaces the game's position
+        board = Board.from_fen("r3k2r/8/8/8/8/8/8/4K2R b Kkq - 7 42")
+        store.save("game-0", board)
+        games["game-0"] = state(board)
+    assert all(os.path.getsize(tmp_path / f"shard-{number:03}.games") > FILE_HEADER.size for number in range(4))
+
+    with GameStore(str(tmp_path), shards=4) as store:
+        assert sorted(store.game_ids()) == sorted(games)
+        assert {game_id: state(board) for game_id, board in store.load_many(games).items()} == games
+        assert state(store.load("game-1")) == games["game-1"]
+        assert store.load("missing") is None
+
+
+def test_index_grows(tmp_path):
+    with GameStore(str(tmp_path), shards=1) as store:
+        games = fill(store, 1000)
+    with GameStore(str(tmp_path), shards=1) as store:
+        assert all(state(store.load(game_id)) == game for game_id, game in games.items())
+
+
+@pytest.mark.parametrize("game_id", ["", "x" * (MAX_ID_LENGTH + 1), "a\0b"])
+def test_invalid_game_id(tmp_path, game_id):
+    with GameStore(str(tmp_path)) as store:
+        with pytest.raises(ValueError):
+            store.save(game_id, Board())
+
+
+def test_game_played_through_store(tmp_path):
+    with GameStore(str(tmp_path)) as store:
+        game = Game(None, game_file=store.game_file("played"))
+        for name in ["e2e4", "e7e5", "g1f3"]:
+            board = game.board
+            game.record_position(board.make_move(next(move for move in board.generate_moves(board.turn)
+                                                      if move_name(move) == name)))
+        game.take_back()
+        loaded = Game(None, load=True, game_file=store.game_file("played"))
+        assert state(loaded.board) == state(game.board) == state(board_after(["e2e4", "e7e5"]))
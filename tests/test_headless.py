@@ -0,0 +1,39 @@
+import io
+
+from headless import read_scripts, run_script
+
+SCRIPT = """# Fool's mate, then a game from a position
+f2 f3
+e7 e5
+g2 g4
+d8 h4
+a2 a3
+
+fen 4k3/8/8/8/8/8/8/4K2R w K - 0 1
+o-o
+undo
+e1 e3
+"""
+
+
+def test_scripts_are_split_into_games():
+    games = list(read_scripts(io.StringIO(SCRIPT), "test"))
+    assert [name for name, _ in games] == ["test:1", "test:2"]
+    assert games[1][1][0] == "fen 4k3/8/8/8/8/8/8/4K2R w K - 0 1"
+
+
+def test_game_over_skips_the_remaining_commands():
+    name, commands = next(read_scripts(io.StringIO(SCRIPT), "test"))
+    text, moves = run_script(name, commands, render="none")
+    assert moves == 4
+    assert "Checkmate! Black player wins" in text
+    assert "the last 1 commands were skipped" in text
+    assert "Result: checkmate" in text
+
+
+def test_game_from_fen_reports_invalid_moves():
+    name, commands = list(read_scripts(io.StringIO(SCRIPT), "test"))[1]
+    text, moves = run_script(name, commands, render="full")
+    assert moves == 1
+    assert "e1 e3: >>> Invalid move" in text
+    assert "FEN: 4k3/8/8/8/8/8/8/4K2R w K - 0 1" in text
@@ -0,0 +1,37 @@
+import asyncio
+
+import instrument
+from server import GameServer
+
+
+async def play_through_server(directory):
+    """Starts a game on a GameServer, plays a move over a connection, then writes the batch to the store"""
+    game_server = GameServer(directory)
+    server = await asyncio.start_server(game_server.handle_connection, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        replies = []
+        for command in (b"new", b"move e2 e4", b"quit"):
+            writer.write(command + b"\n")
+            await writer.drain()
+            replies.append((await reader.readline()).decode('utf-8').split(' ')[0].strip())
+        writer.close()
+        await game_server.flush()
+    game_server.executor.shutdown()
+    game_server.store.close()
+    return replies
+
+
+def test_server_stages_are_recorded(tmp_path):
+    instrument.reset()
+    instrument.enable()
+    try:
+        assert asyncio.run(play_through_server(str(tmp_path))) == ["ok", "ok", "ok"]
+    finally:
+        instrument.disable()
+    stages = instrument.snapshot()["stages"]
+    for name in ("game.apply_move", "server.save", "server.flush", "gamestore.save_many"):
+        assert stages[name]["count"] >= 1, name
+        assert stages[name]["total_seconds"] > 0, name
+    assert not instrument.is_enabled()
@@ -0,0 +1,72 @@
+import io
+
+import pytest
+
+from board import Board
+from game import Game
+from pgn import read_games, play_san, write_game
+
+SCHOLARS_MATE = ["e4", "e5", "Bc4", "Nc6", "Qh5", "Nf6", "Qxf7#"]
+
+
+def play(game, sans):
+    """Plays moves in SAN through a Game, as a player would"""
+    for san in sans:
+        game.record_position(play_san(game.board, san))
+
+
+def write(game, tags=None, result="*"):
+    file = io.StringIO()
+    write_game(file, game, tags, result)
+    return file.getvalue()
+
+
+def test_round_trip(tmp_path):
+    game = Game(str(tmp_path / "game.dat"))
+    play(game, SCHOLARS_MATE)
+    games = list(read_games(io.StringIO(write(game, {"White": "Anderssen, Adolf"}, "1-0"))))
+    assert len(games) == 1
+    assert games[0].moves == SCHOLARS_MATE
+    assert games[0].result == "1-0"
+    assert games[0].tags["White"] == "Anderssen, Adolf"
+    assert "FEN" not in games[0].tags
+    assert games[0].replay().to_fen() == game.board.to_fen()
+
+
+def test_round_trip_from_fen(tmp_path):
+    fen = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R b KQkq - 3 17"
+    game = Game(str(tmp_path / "game.dat"), fen=fen)
+    play(game, ["O-O-O", "a3", "b3", "Bd3"])
+    text = write(game)
+    assert "17... O-O-O 18. a3" in text
+    games = list(read_games(io.StringIO(text)))
+    assert games[0].tags["FEN"] == fen
+    assert games[0].tags["SetUp"] == "1"
+    assert games[0].replay().to_fen() == game.board.to_fen()
+
+
+def test_round_trip_from_initial_pieces_at_later_move(tmp_path):
+    # The pieces are where they start, but the castling rights and move number are not
+    fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 12"
+    game = Game(str(tmp_path / "game.dat"), fen=fen)
+    play(game, ["e4", "e5"])
+    text = write(game)
+    assert "12. e4 e5" in text
+    games = list(read_games(io.StringIO(text)))
+    assert games[0].tags["FEN"] == fen
+    assert games[0].tags["SetUp"] == "1"
+    assert games[0].replay().to_fen() == game.board.to_fen()
+
+
+@pytest.mark.parametrize("value", ['The "Immortal" Game', "C:\\games\\", 'ends with \\"'])
+def test_tag_escaping(tmp_path, value):
+    game = Game(str(tmp_path / "game.dat"))
+    games = list(read_games(io.StringIO(write(game, {"Event": value, "Annotator": value}))))
+    assert games[0].tags["Event"] == value
+    assert games[0].tags["Annotator"] == value
+
+
+def test_invalid_move_is_reported():
+    games = list(read_games(io.StringIO('[Event "?"]\n\n1. e4 e5 2. Ke3 *\n')))
+    with pytest.raises(RuntimeError, match="2.Ke3"):
+        games[0].replay(Board())
@@ -0,0 +1,51 @@
+import io
+
+from board import Board
+from game import Game
+from gamefile import NullGameFile
+from render import AnsiRenderer, SpectatorChannel, apply_deltas, square_deltas
+
+# Moves that castle for both sides and take en-passant, then some take-backs
+MOVES = ["e2 e4", "g8 f6", "e4 e5", "d7 d5", "e5 d6", "e7 d6", "g1 f3", "f8 e7", "f1 c4", "o-o", "o-o"]
+
+
+def test_square_deltas_round_trip():
+    board = Game(None, game_file=NullGameFile(), fen="4k3/8/8/8/8/8/8/4K2R w K - 0 1").board
+    deltas = square_deltas(board, [4, 7, 60, 0])
+    assert deltas == "e1K h1R e8k a1."
+    copy = Board()
+    assert apply_deltas(copy, deltas) == [4, 7, 60, 0]
+    assert [copy.squares[index] for index in (4, 7, 60, 0)] == [board.squares[index] for index in (4, 7, 60, 0)]
+
+
+def test_spectators_follow_moves_and_take_backs():
+    game = Game(None, game_file=NullGameFile())
+    channel = SpectatorChannel()
+    game.listeners.append(channel)
+    spectator = Board()
+    lines = []
+    channel.subscribe(lines.append)
+    for move in MOVES:
+        assert game.apply_move(move) is None, move
+    for _ in range(3):
+        assert game.take_back(save=False)
+    for line in lines:
+        kind, turn, deltas = line.decode('ascii').rstrip("\n").split(" ", 2)
+        assert kind == "delta"
+        apply_deltas(spectator, deltas)
+    assert bytes(spectator.squares) == bytes(game.board.squares)
+    assert turn == game.next_player
+    assert channel.messages == len(MOVES) + 3
+
+
+def test_ansi_renderer_redraws_only_changed_squares():
+    output = io.StringIO()
+    game = Game(None, game_file=NullGameFile())
+    renderer = AnsiRenderer(output)
+    renderer.draw(game.board)
+    game.listeners.append(renderer)
+    drawn = len(output.getvalue())
+    assert game.apply_move("e2 e4") is None
+    redraw = output.getvalue()[drawn:]
+    # The two squares, then the cursor is moved below the board, which clears the text there
+    assert redraw == "\x1b[15;21H \x1b[11;21HP\x1b[21;1H\x1b[J"
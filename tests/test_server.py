@@ -0,0 +1,95 @@
+import asyncio
+
+from server import GameServer
+
+
+async def run_server(directory, client):
+    """Runs a GameServer while a client talks to it
+
+    :param directory: Directory of the server's store
+    :param client: Coroutine function taking the server and a function that opens a connection to it
+    :return: GameServer, after writing its last batch and closing its store
+    """
+    game_server = GameServer(directory)
+    server = await asyncio.start_server(game_server.handle_connection, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def connect(streams=False):
+        """Opens a connection, returning a function that sends a command and returns the reply (or the reader
+        and writer, if streams is True)"""
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        if streams:
+            return reader, writer
+
+        async def send(command):
+            writer.write(command.encode('utf-8') + b"\n")
+            await writer.drain()
+            return (await reader.readline()).decode('utf-8').strip()
+        return send
+
+    async with server:
+        await client(game_server, connect)
+        await game_server.flush()
+    game_server.executor.shutdown()
+    game_server.store.close()
+    return game_server
+
+
+def test_connections_share_loaded_game(tmp_path):
+    async def client(game_server, connect):
+        first = await connect()
+        game_id = (await first("new")).split(" ")[1]
+        assert await first("move e2 e4") == "ok"
+        # The game is being played, so a second connection shares it rather than reading the store
+        second = await connect()
+        assert await second(f"load {game_id}") == f"ok {game_id}"
+        assert await second("move e7 e5") == "ok"
+        assert await first("board") == await second("board")
+        board = await first("board")
+        assert await first("quit") == "ok"
+        assert await second("quit") == "ok"
+        assert game_server.playing == {} and game_server.players == {}
+
+        # Changed since the last batch, so loaded from memory
+        third = await connect()
+        assert await third(f"load {game_id}") == f"ok {game_id}"
+        assert await third("board") == board
+        assert await third("quit") == "ok"
+
+        # Loaded from the store
+        await game_server.flush()
+        fourth = await connect()
+        assert await fourth(f"load {game_id}") == f"ok {game_id}"
+        assert await fourth("board") == board
+        assert await fourth("load missing") == "error No game missing"
+
+    asyncio.run(run_server(str(tmp_path), client))
+
+
+def test_new_game_from_fen(tmp_path):
+    fen = "r3k2r/8/8/8/8/8/8/4K2R b Kkq - 7 42"
+
+    async def client(game_server, connect):
+        send = await connect()
+        assert (await send(f"new {fen}")).startswith("ok ")
+        assert await send("fen") == f"ok {fen}"
+        assert (await send("new not a position")).startswith("error Invalid FEN")
+
+    asyncio.run(run_server(str(tmp_path), client))
+
+
+def test_spectator_sees_moves_of_game_being_played(tmp_path):
+    async def client(game_server, connect):
+        player = await connect()
+        game_id = (await player("new")).split(" ")[1]
+        reader, writer = await connect(streams=True)
+        writer.write(f"watch {game_id}\n".encode('ascii'))
+        assert (await reader.readline()).decode('ascii').startswith("ok W")
+        assert await player("move e2 e4") == "ok"
+        assert (await reader.readline()).decode('ascii') == "delta B e2. e4P\n"
+        writer.write(b"unwatch\n")
+        assert await reader.readline() == b"ok\n"
+        assert game_server.channels == {}
+        writer.close()
+
+    asyncio.run(run_server(str(tmp_path), client))
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from board import Board, move_name
+from game import Game
+from gamefile import JOURNAL_RECORD, JOURNAL_SUFFIX, JOURNAL_TAKE_BACK, pack_journal_record
+from validate import validate_file, validate_pgn_games
+
+
+def play(game, names):
+    """Plays moves given in coordinate notation through a Game, as a player would"""
+    for name in names:
+        board = game.board
+        game.record_position(board.make_move(next(move for move in board.generate_moves(board.turn)
+                                                  if move_name(move) == name)))
+
+
+def append_record(filename, kind):
+    """Appends a record that follows the last one in a game's journal"""
+    with open(filename + JOURNAL_SUFFIX, mode='rb') as journal:
+        sequence = JOURNAL_RECORD.unpack_from(journal.read()[-JOURNAL_RECORD.size:])[0]
+    with open(filename + JOURNAL_SUFFIX, mode='ab') as journal:
+        journal.write(pack_journal_record(sequence + 1, kind))
+
+
+def test_valid_game(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename)
+    play(game, ["e2e4", "e7e5", "g1f3"])
+    game.close()
+    result = validate_file(filename)
+    assert result.error is None
+    assert result.position == game.next_player + str(game.board)
+
+
+def test_damaged_journal_is_reported(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename)
+    play(game, ["e2e4", "e7e5", "g1f3"])
+    game.close()
+    with open(filename + JOURNAL_SUFFIX, mode='ab') as journal:
+        journal.write(b"\x04\0\0\0\x01")
+    result = validate_file(filename)
+    assert result.error == "The journal ends with 5 damaged bytes"
+    assert result.ply == 3
+
+
+def test_unmatched_take_back_is_reported(tmp_path):
+    filename = str(tmp_path / "game.dat")
+    game = Game(filename)
+    play(game, ["e2e4", "e7e5"])
+    assert game.take_back()
+    assert game.take_back()
+    game.close()
+    append_record(filename, JOURNAL_TAKE_BACK)
+    result = validate_file(filename)
+    assert result.error == "There is no move to take back"
+    # Only the moves count as plies, not the take-backs
+    assert result.ply == 2
+
+
+@pytest.mark.parametrize("kind", ["text", "binary"])
+def test_validate_does_not_change_files(tmp_path, kind):
+    filename = str(tmp_path / "game.dat")
+    if kind == "text":
+        with open(filename, mode='wb') as file:
+            file.write(b"W" + str(Board()).encode('ascii'))
+    else:
+        game = Game(filename)
+        play(game, ["e2e4"])
+        game.close()
+        with open(filename + JOURNAL_SUFFIX, mode='ab') as journal:
+            journal.write(b"\x01")
+    before = {name: open(tmp_path / name, mode='rb').read() for name in os.listdir(tmp_path)}
+    validate_file(filename)
+    assert {name: open(tmp_path / name, mode='rb').read() for name in os.listdir(tmp_path)} == before
+
+
+def test_pgn_games_start_from_their_fen_tag():
+    fen = "r3k2r/8/8/8/8/8/8/4K2R b Kkq - 0 1"
+    valid, illegal, bad_fen = validate_pgn_games([(1, ["O-O-O", "O-O"], fen), (2, ["O-O-O"], None),
+                                                  (3, ["e4"], "not a position")])
+    assert valid.error is None
+    assert illegal.error is not None and illegal.ply == 0
+    assert bad_fen.error.startswith("FEN tag:") and bad_fen.ply == 0
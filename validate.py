@@ -0,0 +1,264 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from board import Board, KING, PAWN, BLACK, PIECE_CHARS
+from gamefile import JOURNAL_SUFFIX, JOURNAL_MOVE, JOURNAL_TAKE_BACK, read_game_file
+from gamestore import GameStore
+from pgn import play_san, read_games
+
+# Number of games sent to a worker process at a time
+CHUNK_SIZE = 64
+# Number of chunks waiting for or being validated per worker process, which bounds the memory used
+CHUNKS_PER_WORKER = 2
+
+# Stores opened by each worker process, by directory, kept between chunks
+_worker_stores = {}
+
+
+class ValidationResult:
+    """The outcome of validating one game"""
+
+    def __init__(self, name, ply, error, position):
+        # File name, game id, or PGN game number of the game
+        self.name = name
+        # Number of moves replayed before the error (0 if the starting position is invalid), or None if valid
+        self.ply = ply
+        # Description of the problem, or None if valid
+        self.error = error
+        # Final position (or the position where the error was found), in the old text format: the next
+        # player followed by 64 characters for the squares
+        self.position = position
+
+    @property
+    def valid(self):
+        """True if the game has no problems"""
+        return self.error is None
+
+    def __str__(self):
+        """Returns a summary of the result
+
+        :return: String with the name, and the error and ply if the game is not valid
+        """
+        if self.valid:
+            return f"{self.name}: valid"
+        return f"{self.name}: ply {self.ply}: {self.error}"
+
+
+def position_error(board):
+    """Checks that a position could occur in a game
+
+    :param board: Board with the position
+    :return: Description of the problem, or None if the position is valid
+    """
+    squares = board.squares
+    for colour, name in ((0, "white"), (BLACK, "black")):
+        kings = squares.count(KING | colour)
+        if kings != 1:
+            return f"There are {kings} {name} kings"
+    for index in list(range(8)) + list(range(56, 64)):
+        if squares[index] & 7 == PAWN:
+            return f"There is a {PIECE_CHARS[squares[index]]} pawn on the first or last row"
+    if board.in_check('B' if board.turn == 'W' else 'W'):
+        return "The player who has just moved is in check"
+    return None
+
+
+def play_move(board, move):
+    """Plays an encoded move through Board.move or Board.castle, so it is fully validated
+
+    :param board: Board to play the move on (the player to move is board.turn)
+    :param move: Encoded move
+    :return: Undo record for the move
+    :raises RuntimeError: if the move is invalid
+    """
+    from_index = move & 63
+    to_index = (move >> 6) & 63
+    if board.squares[from_index] & 7 == KING and abs(to_index - from_index) == 2:
+        return board.castle(board.turn == 'W', to_index > from_index)
+    return board.move(board.turn, chr(97 + (from_index & 7)), (from_index >> 3) + 1,
+                      chr(97 + (to_index & 7)), (to_index >> 3) + 1, PIECE_CHARS[move >> 12] if move >> 12 else 'Q')
+
+
+def validate_file(filename):
+    """Validates a game file: checks the snapshot position, and replays the journal's moves through Board.move.
+    The files are only read, so text files are not converted and damaged journals are not truncated.
+
+    :param filename: Name of the game file
+    :return: ValidationResult
+    """
+    try:
+        board, records, damaged_bytes = read_game_file(filename)
+    except (IOError, ValueError) as err:
+        return ValidationResult(filename, 0, str(err), None)
+    error = position_error(board)
+    if error:
+        return ValidationResult(filename, 0, error, board.turn + str(board))
+    undo_records = []
+    ply = 0
+    for _, kind, move in records:
+        if kind == JOURNAL_MOVE:
+            try:
+                undo_records.append(play_move(board, move))
+            except RuntimeError as err:
+                return ValidationResult(filename, ply, str(err), board.turn + str(board))
+            ply += 1
+        elif kind == JOURNAL_TAKE_BACK:
+            if not undo_records:
+                return ValidationResult(filename, ply, "There is no move to take back", board.turn + str(board))
+            board.unmake_move(undo_records.pop())
+        else:
+            return ValidationResult(filename, ply, f"Invalid journal record of kind {kind}", board.turn + str(board))
+    if damaged_bytes:
+        return ValidationResult(filename, ply, f"The journal ends with {damaged_bytes} damaged bytes",
+                                board.turn + str(board))
+    return ValidationResult(filename, None, None, board.turn + str(board))
+
+
+def validate_files(filenames):
+    """Validates game files (run in a worker process)
+
+    :param filenames: List of game file names
+    :return: List of ValidationResult
+    """
+    return [validate_file(filename) for filename in filenames]
+
+
+def validate_stored(directory, game_ids):
+    """Validates the positions of games in a GameStore (run in a worker process)
+
+    :param directory: Directory of the store
+    :param game_ids: List of game id strings
+    :return: List of ValidationResult
+    """
+    if directory not in _worker_stores:
+        _worker_stores[directory] = GameStore(directory)
+    boards = _worker_stores[directory].load_many(game_ids)
+    results = []
+    for game_id in game_ids:
+        board = boards.get(game_id)
+        if board is None:
+            results.append(ValidationResult(game_id, 0, "No valid snapshot", None))
+        else:
+            error = position_error(board)
+            results.append(ValidationResult(game_id, 0 if error else None, error, board.turn + str(board)))
+    return results
+
+
+def validate_pgn_games(games):
+    """Validates games read from a PGN file (run in a worker process)
+
+    :param games: List of (game number, list of moves in SAN, starting position in FEN or None) tuples
+    :return: List of ValidationResult
+    """
+    results = []
+    for number, moves, fen in games:
+        try:
+            board = Board.from_fen(fen) if fen else Board()
+        except ValueError as err:
+            results.append(ValidationResult(f"game {number}", 0, f"FEN tag: {err}", None))
+            continue
+        error = None
+        ply = None
+        for ply, san in enumerate(moves):
+            try:
+                play_san(board, san)
+            except RuntimeError as err:
+                error = f"{san}: {err}"
+                break
+        results.append(ValidationResult(f"game {number}", ply if error else None, error, board.turn + str(board)))
+    return results
+
+
+def archive_chunks(path, chunk_size=CHUNK_SIZE):
+    """Splits an archive of games into chunks of work for the worker processes, reading it a chunk at a time.
+    The archive can be a directory of game files, a GameStore directory, or a PGN file.
+
+    :param path: Path of the archive
+    :param chunk_size: Number of games in each chunk
+    :return: Generator of (function, arguments) pairs, to be called in a worker process
+    """
+    if os.path.isfile(path):
+        with open(path, encoding='utf-8', errors='replace') as file:
+            chunk = []
+            for number, game in enumerate(read_games(file), 1):
+                chunk.append((number, game.moves, game.tags.get("FEN")))
+                if len(chunk) == chunk_size:
+                    yield validate_pgn_games, (chunk,)
+                    chunk = []
+            if chunk:
+                yield validate_pgn_games, (chunk,)
+    elif os.path.exists(os.path.join(path, "shard-000.games")):
+        with GameStore(path) as store:
+            game_ids = store.game_ids()
+        for start in range(0, len(game_ids), chunk_size):
+            yield validate_stored, (path, game_ids[start:start + chunk_size])
+    else:
+        chunk = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(JOURNAL_SUFFIX):
+                    chunk.append(entry.path)
+                    if len(chunk) == chunk_size:
+                        yield validate_files, (chunk,)
+                        chunk = []
+        if chunk:
+            yield validate_files, (chunk,)
+
+
+def validate_archive(path, workers=None, chunk_size=CHUNK_SIZE):
+    """Validates every game in an archive, spread over worker processes. Only a few chunks per worker are
+    read ahead, so the memory used does not grow with the size of the archive.
+
+    :param path: Directory of game files, GameStore directory, or PGN file
+    :param workers: Number of worker processes (defaults to the number of CPU cores)
+    :param chunk_size: Number of games sent to a worker at a time
+    :return: Generator of ValidationResult, in the order the chunks finish
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        for function, arguments in archive_chunks(path, chunk_size):
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            pending.add(executor.submit(function, *arguments))
+        for future in pending:
+            yield from future.result()
+
+
+def main(path, workers=None, positions_filename=None):
+    """Validates an archive of games and prints a summary
+
+    :param path: Directory of game files, GameStore directory, or PGN file
+    :param workers: Number of worker processes (defaults to the number of CPU cores)
+    :param positions_filename: File to write each game's final position to, or None
+    """
+    start = time.perf_counter()
+    games = 0
+    invalid = 0
+    positions = open(positions_filename, mode='w') if positions_filename else None
+    try:
+        for result in validate_archive(path, workers):
+            games += 1
+            if not result.valid:
+                invalid += 1
+                print(result)
+            if positions:
+                positions.write(f"{result.name}\t{result.position or ''}\n")
+    finally:
+        if positions:
+            positions.close()
+    seconds = time.perf_counter() - start
+    print(f"{games} games: {games - invalid} valid, {invalid} invalid, in {seconds:.2f}s "
+          f"({games / seconds if seconds > 0 else 0:.0f} games/s)")
+
+
+if __name__ == "__main__":
+    # Usage: python validate.py <directory, store, or PGN file> [workers] [positions file]
+    if len(sys.argv) < 2:
+        print("Usage: python validate.py <directory, store, or PGN file> [workers] [positions file]")
+    else:
+        main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None, sys.argv[3] if len(sys.argv) > 3 else None)